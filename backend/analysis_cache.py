@@ -0,0 +1,146 @@
+import sqlite3
+import json
+import hashlib
+import re
+import threading
+import time
+
+class AnalysisCache:
+    def __init__(self, db_path='analysis_cache.db', ttl_seconds=7 * 24 * 3600, max_entries=10000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self):
+        """Initialize cache table"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                cache_key TEXT PRIMARY KEY,
+                analysis_json TEXT,
+                created_at REAL,
+                last_accessed REAL
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_accessed
+            ON analysis_cache (last_accessed)
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def normalize_text(bill_text):
+        """Collapse whitespace so re-extracted copies of the same bill hash alike"""
+        return re.sub(r'\s+', ' ', bill_text or '').strip()
+
+    def make_key(self, bill_text, model, prompt_version, temperature):
+        """Build a content-addressed key for one analysis request"""
+        material = json.dumps([
+            self.normalize_text(bill_text),
+            model,
+            prompt_version,
+            temperature
+        ])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, cache_key):
+        """Return the cached analysis for a key, or None on a miss"""
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute(
+            'SELECT analysis_json, created_at FROM analysis_cache WHERE cache_key = ?',
+            (cache_key,)
+        )
+        row = cursor.fetchone()
+
+        if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+            cursor.execute('DELETE FROM analysis_cache WHERE cache_key = ?', (cache_key,))
+            row = None
+        elif row:
+            cursor.execute(
+                'UPDATE analysis_cache SET last_accessed = ? WHERE cache_key = ?',
+                (now, cache_key)
+            )
+
+        conn.commit()
+        conn.close()
+
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return json.loads(row[0]) if row else None
+
+    def set(self, cache_key, analysis):
+        """Store an analysis and evict expired or least recently used entries"""
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT OR REPLACE INTO analysis_cache (cache_key, analysis_json, created_at, last_accessed)
+            VALUES (?, ?, ?, ?)
+        ''', (cache_key, json.dumps(analysis), now, now))
+
+        self.evict(cursor, now)
+
+        conn.commit()
+        conn.close()
+
+    def evict(self, cursor, now):
+        """Drop expired rows, then trim to max_entries by last access"""
+        if self.ttl_seconds:
+            cursor.execute(
+                'DELETE FROM analysis_cache WHERE created_at < ?',
+                (now - self.ttl_seconds,)
+            )
+
+        if self.max_entries:
+            cursor.execute('''
+                DELETE FROM analysis_cache WHERE cache_key IN (
+                    SELECT cache_key FROM analysis_cache
+                    ORDER BY last_accessed DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def clear(self):
+        """Remove every cached analysis"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('DELETE FROM analysis_cache')
+        conn.commit()
+        conn.close()
+
+    def get_stats(self):
+        """Hit/miss counters and current size"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM analysis_cache')
+        size = cursor.fetchone()[0]
+        conn.close()
+
+        with self._lock:
+            hits, misses = self.hits, self.misses
+
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'entries': size,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds
+        }
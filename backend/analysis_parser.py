@@ -0,0 +1,388 @@
+import html
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from bill_extractor import parse_figure
+from instrumentation import instrument
+
+class IncrementalJSONParser:
+    """Parse a streamed JSON object and report each top-level member as it closes.
+
+    Text before the first '{' (preambles, ```json fences) is ignored. Feed
+    chunks as they arrive; feed() returns the (key, value) pairs completed by
+    that chunk, so {"bill_summary": {...}, ...} yields bill_summary as soon
+    as its closing brace is seen.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = None
+        self.member_emitted = False
+        self.started = False
+        self.finished = False
+        self.members = {}
+
+    def feed(self, chunk):
+        completed = []
+        for char in chunk:
+            if self.finished:
+                break
+            if not self.started:
+                if char == '{':
+                    self.started = True
+                    self.depth = 1
+                    self.member_start = 0
+                continue
+
+            self.buffer.append(char)
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 1:
+                    # An object or array member just closed; emit it right away
+                    self._emit(len(self.buffer), completed)
+                elif self.depth == 0:
+                    self._emit(len(self.buffer) - 1, completed)
+                    self.finished = True
+            elif char == ',' and self.depth == 1:
+                self._emit(len(self.buffer) - 1, completed)
+                self.member_start = len(self.buffer)
+                self.member_emitted = False
+        return completed
+
+    def _emit(self, end, completed):
+        if self.member_emitted:
+            return
+        member = ''.join(self.buffer[self.member_start:end]).strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads('{' + member + '}')
+        except ValueError:
+            return
+        for key, value in parsed.items():
+            self.members[key] = value
+            completed.append((key, value))
+        self.member_emitted = True
+
+    def result(self):
+        """Members parsed so far (the whole object once finished is True)"""
+        return dict(self.members)
+
+EFFICIENCY_RATINGS = ('poor', 'average', 'good', 'excellent')
+
+def loads(text):
+    """json.loads, through orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+# Characters that can open or close something: braces, brackets and string quotes
+SIGNIFICANT_RE = re.compile(r'[{}\[\]"]')
+TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+# What a cut-off reply leaves dangling after its last complete value
+DANGLING_TAIL_RE = re.compile(r'(?:,\s*"(?:[^"\\]|\\.)*"\s*:?|(?<=\{)\s*"(?:[^"\\]|\\.)*"\s*:?|[,:])\s*$', re.S)
+
+def string_end(text, position):
+    """Index just past the quote closing a string whose contents start at position, or None"""
+    while True:
+        quote = text.find('"', position)
+        if quote == -1:
+            return None
+        escape = quote
+        while escape > position and text[escape - 1] == '\\':
+            escape -= 1
+        if (quote - escape) % 2 == 0:
+            return quote + 1
+        position = quote + 1
+
+def scan_object(text, start):
+    """End index of the object opening at text[start], or None if it is never closed.
+
+    Jumps from one brace, bracket or quote to the next, skipping string
+    contents in one step, so braces inside strings are not counted.
+    """
+    depth = 0
+    position = start
+    search = SIGNIFICANT_RE.search
+    while True:
+        match = search(text, position)
+        if match is None:
+            return None
+        char = match.group()
+        position = match.end()
+        if char == '"':
+            position = string_end(text, position)
+            if position is None:
+                return None
+        elif char in '{[':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return position
+
+def close_truncated(fragment):
+    """Close the strings and brackets left open by a reply cut off mid-object"""
+    closers = []
+    position = 0
+    while True:
+        match = SIGNIFICANT_RE.search(fragment, position)
+        if match is None:
+            break
+        char = match.group()
+        position = match.end()
+        if char == '"':
+            position = string_end(fragment, position)
+            if position is None:
+                # Cut inside a string; drop a half-written escape and close it
+                if fragment.endswith('\\') and (len(fragment) - len(fragment.rstrip('\\'))) % 2:
+                    fragment = fragment[:-1]
+                fragment += '"'
+                break
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+        elif closers:
+            closers.pop()
+    # Only the last few hundred characters can be dangling; don't regex the whole reply
+    fragment = fragment.rstrip()
+    cut = max(0, len(fragment) - 256)
+    fragment = fragment[:cut] + DANGLING_TAIL_RE.sub('', fragment[cut:])
+    return fragment + ''.join(reversed(closers))
+
+def try_loads(candidate):
+    try:
+        return loads(candidate)
+    except ValueError:
+        return None
+
+def repair(candidate, repairs):
+    """Parse a candidate object, applying the cheap fixes models usually need"""
+    parsed = try_loads(candidate)
+    if parsed is not None:
+        return parsed
+    if '&quot;' in candidate or '&#' in candidate:
+        candidate = html.unescape(candidate)
+        parsed = try_loads(candidate)
+        if parsed is not None:
+            repairs.append('html entities decoded')
+            return parsed
+    fixed = TRAILING_COMMA_RE.sub(r'\1', candidate)
+    if fixed != candidate:
+        parsed = try_loads(fixed)
+        if parsed is not None:
+            repairs.append('trailing commas removed')
+            return parsed
+    return None
+
+def extract_json(text, max_candidates=5):
+    """First JSON object in a model reply, and the repairs it needed.
+
+    Tries the span from the first '{' to the last '}' first; if that is not
+    JSON, scans for balanced objects so preambles with braces, <think>
+    blocks and trailing prose are skipped. A reply cut off mid-object is
+    closed.
+    Returns (None, repairs) when nothing parses.
+    """
+    repairs = []
+    if '<think>' in text:
+        end = text.find('</think>')
+        if end != -1:
+            text = text[end + len('</think>'):]
+    if '&quot;' in text and '"' not in text:
+        text = html.unescape(text)
+        repairs.append('html entities decoded')
+
+    start = text.find('{')
+    end = text.rfind('}')
+    if start != -1 and end > start:
+        # Fast path: usually the reply is one object, at most fenced or wrapped
+        parsed = try_loads(text[start:end + 1])
+        if isinstance(parsed, dict):
+            return parsed, repairs
+
+    for _ in range(max_candidates):
+        if start == -1:
+            break
+        end = scan_object(text, start)
+        if end is None:
+            parsed = repair(close_truncated(text[start:]), repairs)
+            if isinstance(parsed, dict):
+                repairs.append('truncated reply closed')
+                return parsed, repairs
+            break
+        parsed = repair(text[start:end], repairs)
+        if isinstance(parsed, dict):
+            return parsed, repairs
+        start = text.find('{', start + 1)
+    return None, repairs
+
+# Analysis fields by dotted path. 'number' fields are parsed into analysis['figures'],
+# 'choices' are lower-cased and 'list' fields accept a single string.
+ANALYSIS_SCHEMA = {
+    'bill_summary': {'type': 'object', 'required': True, 'summary': True},
+    'bill_summary.billing_period': {'type': 'string'},
+    'bill_summary.total_amount': {'type': 'number', 'required': True, 'summary': True},
+    'bill_summary.units_consumed': {'type': 'number', 'required': True, 'summary': True},
+    'bill_summary.rate_per_unit': {'type': 'number'},
+    'consumption_analysis': {'type': 'object', 'required': True},
+    'consumption_analysis.efficiency_rating': {'type': 'choice', 'choices': EFFICIENCY_RATINGS, 'required': True},
+    'cost_insights': {'type': 'object'},
+    'comparison_metrics': {'type': 'object'},
+    'recommendations': {'type': 'list', 'required': True},
+    'anomalies': {'type': 'list'},
+    'action_items': {'type': 'list'}
+}
+
+def compile_schema(schema):
+    """Flatten the schema into (path, parent keys, key, type, required, summary, choices)
+    tuples, parents first, so checking an analysis is one pass with no rule lookups"""
+    compiled = []
+    for path, rule in sorted(schema.items(), key=lambda item: item[0].count('.')):
+        keys = path.split('.')
+        compiled.append((path, tuple(keys[:-1]), keys[-1], rule['type'], rule.get('required', False),
+                         rule.get('summary', False), rule.get('choices')))
+    return compiled
+
+COMPILED_SCHEMA = compile_schema(ANALYSIS_SCHEMA)
+
+def as_text_list(value):
+    """List of non-empty strings, or None if value cannot be read as one"""
+    if isinstance(value, str):
+        value = [value] if value.strip() else []
+    if not isinstance(value, list):
+        return None
+    items = []
+    for item in value:
+        if isinstance(item, dict) and len(item) == 1:
+            # [{"recommendation": "..."}]
+            item = next(iter(item.values()))
+        if not isinstance(item, str):
+            return None
+        if item.strip():
+            items.append(item)
+    return items
+
+def check_analysis(analysis, require_summary=True, coerce=False):
+    """Validate analysis against the schema; returns (problems, figures).
+
+    With coerce=True fields are rewritten in place: ratings lower-cased,
+    single strings wrapped in lists. figures maps each number field to a
+    float, or None when the text holds no number.
+    """
+    problems = []
+    figures = {}
+    for path, parents, key, kind, required, summary, choices in COMPILED_SCHEMA:
+        if summary and not require_summary:
+            continue
+        container = analysis
+        for parent in parents:
+            container = container.get(parent)
+            if not isinstance(container, dict):
+                break
+        if not isinstance(container, dict):
+            continue  # reported against the parent
+
+        value = container.get(key)
+        if value is None or value == '' or value == []:
+            if required:
+                problems.append(f'{path} missing')
+            continue
+
+        if kind == 'object':
+            if not isinstance(value, dict):
+                problems.append(f'{path} must be an object')
+        elif kind == 'string':
+            if not isinstance(value, str):
+                problems.append(f'{path} must be a string')
+        elif kind == 'number':
+            figure = parse_figure(value) if isinstance(value, str) else value
+            if isinstance(figure, bool) or not isinstance(figure, (int, float)):
+                figure = None
+            figures[key] = None if figure is None else float(figure)
+            if figure is None and required:
+                problems.append(f'{path} is not a number')
+        elif kind == 'choice':
+            choice = str(value).strip().lower()
+            if choice not in choices:
+                problems.append(f'{path} invalid')
+            elif coerce:
+                container[key] = choice
+        elif kind == 'list':
+            items = as_text_list(value)
+            if items is None:
+                problems.append(f'{path} must be a list of strings')
+            elif not items and required:
+                problems.append(f'{path} missing')
+            elif coerce:
+                container[key] = items
+    return problems, figures
+
+def validate_analysis(analysis, require_summary=True):
+    """Problems that make an analysis unusable; an empty list means it passed"""
+    if not isinstance(analysis, dict):
+        return ['analysis is not an object']
+    if 'error' in analysis:
+        return [f"error: {analysis['error']}"]
+    return check_analysis(analysis, require_summary)[0]
+
+class ParsedReply:
+    """Outcome of parse_analysis.
+
+    analysis is None when the reply held no usable JSON object; problems
+    then say why. Otherwise problems are schema violations, repairs the
+    fixes the text needed and figures the parsed bill_summary numbers.
+    """
+
+    __slots__ = ('analysis', 'problems', 'repairs', 'figures')
+
+    def __init__(self, analysis, problems, repairs, figures=None):
+        self.analysis = analysis
+        self.problems = problems
+        self.repairs = repairs
+        self.figures = figures or {}
+
+    @property
+    def ok(self):
+        return self.analysis is not None and not self.problems
+
+@instrument()
+def parse_analysis(text, require_summary=True):
+    """Extract, repair, validate and coerce the analysis in a model reply"""
+    if not text or text.isspace():
+        return ParsedReply(None, ['empty reply'], [])
+    if '{' not in text:
+        return ParsedReply(None, ['no JSON object in reply'], [])
+
+    analysis, repairs = extract_json(text)
+    if analysis is None:
+        return ParsedReply(None, ['no parseable JSON object in reply'], repairs)
+    problems, figures = check_analysis(analysis, require_summary, coerce=True)
+    return ParsedReply(analysis, problems, repairs, figures)
+
+def summary_figures(bill_summary):
+    """Number fields of a bill_summary as floats (None where no number is found)"""
+    return {key: parse_figure(bill_summary.get(key))
+            for path, parents, key, kind, *_ in COMPILED_SCHEMA
+            if parents == ('bill_summary',) and kind == 'number' and key in bill_summary}
@@ -0,0 +1,83 @@
+"""Time the consumption anomaly scoring at scale.
+
+The scoring pass runs on --rows synthetic bills spread over --accounts
+accounts, generated straight into NumPy columns already sorted by account
+and month (the order load_columns returns). Loading is timed separately on
+a scratch database of --db-bills bills, since seeding 10M rows through
+SQLite takes far longer than the thing being measured.
+
+    python benchmarks/benchmark_analytics.py --rows 10000000 --accounts 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_database import percentiles, seed, time_reads
+
+def synthetic_columns(rows, accounts, anomaly_share, rng):
+    """Monthly bills per account with a summer peak and a few injected spikes"""
+    account = np.sort(rng.integers(0, accounts, rows))
+    starts = np.flatnonzero(np.r_[True, account[1:] != account[:-1]])
+    position = np.arange(rows) - np.repeat(starts, np.diff(np.r_[starts, rows]))
+    month = 2015 * 12 + position
+
+    base = rng.uniform(80, 600, accounts)[account]
+    season = 1 + 0.35 * np.cos((month % 12 - 5) * np.pi / 6)
+    units = base * season * rng.normal(1, 0.08, rows)
+    rate = rng.uniform(5, 9, accounts)[account]
+    spikes = rng.random(rows) < anomaly_share
+    units[spikes] *= rng.uniform(2.5, 5, spikes.sum())
+    amount = units * rate
+    amount[rng.random(rows) < anomaly_share] *= 4
+    units[rng.random(rows) < 0.01] = np.nan
+
+    return {
+        'bill_id': np.arange(1, rows + 1),
+        'account': account,
+        'month': month,
+        'amount': amount,
+        'units': units,
+        'accounts': [f'acct-{code}' for code in range(accounts)]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--accounts', type=int, default=100000)
+    parser.add_argument('--anomaly-share', type=float, default=0.002)
+    parser.add_argument('--db-bills', type=int, default=200000)
+    parser.add_argument('--reads', type=int, default=5)
+    args = parser.parse_args()
+
+    from consumption_analytics import ConsumptionAnalytics
+    from database_manager import BillDatabase
+
+    rng = np.random.default_rng(42)
+    started = time.perf_counter()
+    columns = synthetic_columns(args.rows, args.accounts, args.anomaly_share, rng)
+    print(f'Generated {args.rows:,} bills over {args.accounts:,} accounts in {time.perf_counter() - started:.1f} s')
+
+    analytics = ConsumptionAnalytics(None)
+    scores = analytics.compute(columns)
+    flags = scores['flags']
+    print(f'compute          : {percentiles(time_reads(lambda: analytics.compute(columns), args.reads))}')
+    print(f'  flagged {np.count_nonzero(flags):,} bills ({np.count_nonzero(flags) / args.rows:.2%}), '
+          f'{sum(array.nbytes for array in scores.values()) / 1e6:,.0f} MB of scores')
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='analytics-bench-'), 'bench.db')
+    db = BillDatabase(db_path)
+    print(f'\nSeeding {args.db_bills:,} bills into {db_path}')
+    seed(db, args.db_bills)
+    analytics = ConsumptionAnalytics(db)
+    print(f'load_columns     : {percentiles(time_reads(analytics.load_columns, args.reads))}')
+    print(f'cached anomalies : {percentiles(time_reads(lambda: analytics.get_anomalies(limit=100), args.reads * 20))}')
+    db.close()
+
+if __name__ == '__main__':
+    main()
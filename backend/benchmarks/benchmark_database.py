@@ -0,0 +1,184 @@
+"""Measure BillDatabase write throughput and dashboard read latency.
+
+Seeds a scratch database with --bills rows (three insights each, upload
+dates spread over two years), then times:
+
+  * /store-analysis writes per second, single thread and --threads threads
+  * /get-insights and /get-trends latency (p50/p95/p99)
+
+Requests go through the Flask test client so JSON handling is included;
+pass --direct to call BillDatabase methods instead.
+
+    python benchmarks/benchmark_database.py --bills 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE_ANALYSIS = {
+    'bill_summary': {
+        'billing_period': '01-01-2024 to 31-01-2024',
+        'total_amount': '₹1592.50',
+        'units_consumed': '245 kWh',
+        'rate_per_unit': '₹6.5/kWh'
+    },
+    'consumption_analysis': {'efficiency_rating': 'average'},
+    'recommendations': [
+        'Shift washing machine use to off-peak hours',
+        'Replace remaining incandescent bulbs with LEDs',
+        'Check the fixed charge against your sanctioned load'
+    ],
+    'anomalies': ['Fixed charge is higher than last month']
+}
+
+SAMPLE_TEXT = 'Billing Period: 01-01-2024 to 31-01-2024\nUnits Consumed: 245\nTotal Amount Payable: Rs. 1,592.50\n' * 20
+
+def seed(db, bills, batch_size=50000):
+    """Bulk-load bills and insights directly, bypassing store_bill_analysis.
+
+    The trends rollup is not maintained here; call rebuild_trends() afterwards.
+    """
+    from blob_store import store_blob
+
+    conn = db.get_connection()
+    start = datetime.now() - timedelta(days=730)
+    # Every seeded bill has the same payloads, so they are one blob each
+    with conn:
+        text_blob_id = store_blob(conn, SAMPLE_TEXT)
+        analysis_blob_id = store_blob(conn, json.dumps(SAMPLE_ANALYSIS))
+    ratings = ['poor', 'average', 'good', 'excellent']
+    next_id = (conn.execute('SELECT COALESCE(MAX(id), 0) FROM bills').fetchone()[0]) + 1
+    remaining = bills
+    while remaining > 0:
+        count = min(batch_size, remaining)
+        bill_rows = []
+        insight_rows = []
+        for bill_id in range(next_id, next_id + count):
+            uploaded = (start + timedelta(seconds=random.randint(0, 730 * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+            amount = round(random.uniform(300, 16000), 2)
+            bill_rows.append((bill_id, uploaded, 'https://example.com/bill.pdf', 'pdf', text_blob_id,
+                              analysis_blob_id, amount, round(amount / 6.5, 1), 'Jan 2024',
+                              random.choice(ratings)))
+            for text in SAMPLE_ANALYSIS['recommendations']:
+                insight_rows.append((bill_id, uploaded, 'recommendation', text))
+        with conn:
+            conn.executemany('''
+                INSERT INTO bills (id, upload_date, file_url, file_type, text_blob_id, analysis_blob_id,
+                                   total_amount, units_consumed, billing_period, efficiency_rating)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', bill_rows)
+            conn.executemany('INSERT INTO bills_fts (rowid, extracted_text) VALUES (?, ?)',
+                             [(row[0], SAMPLE_TEXT) for row in bill_rows])
+            conn.executemany('''
+                INSERT INTO insights (bill_id, insight_date, insight_type, insight_text)
+                VALUES (?, ?, ?, ?)
+            ''', insight_rows)
+        next_id += count
+        remaining -= count
+        print(f'  seeded {bills - remaining:,}/{bills:,} bills', end='\r', flush=True)
+    print()
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+    return f'p50 {pick(0.50):8.2f} ms  p95 {pick(0.95):8.2f} ms  p99 {pick(0.99):8.2f} ms'
+
+class Target:
+    """Run operations through Flask's test client or straight on BillDatabase"""
+
+    def __init__(self, db, direct):
+        self.db = db
+        self.client = None
+        if not direct:
+            import database_manager
+            database_manager.db = db
+            self.client = database_manager.app.test_client()
+
+    def store(self):
+        payload = {'file_url': 'https://example.com/bill.pdf', 'file_type': 'pdf',
+                   'extracted_text': SAMPLE_TEXT, 'analysis': SAMPLE_ANALYSIS}
+        if self.client:
+            response = self.client.post('/store-analysis', json=payload)
+            assert response.status_code == 200, response.data
+        else:
+            self.db.store_bill_analysis(payload['file_url'], payload['file_type'],
+                                        payload['extracted_text'], payload['analysis'])
+
+    def insights(self, limit):
+        if self.client:
+            response = self.client.get(f'/get-insights?limit={limit}')
+            assert response.status_code == 200, response.data
+        else:
+            self.db.get_recent_insights(limit)
+
+    def trends(self, months):
+        if self.client:
+            response = self.client.get(f'/get-trends?months={months}')
+            assert response.status_code == 200, response.data
+        else:
+            self.db.get_monthly_trends(months)
+
+def time_writes(target, writes, threads):
+    per_thread = max(1, writes // threads)
+
+    def worker():
+        for _ in range(per_thread):
+            target.store()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+def time_reads(operation, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bills', type=int, default=1000000)
+    parser.add_argument('--writes', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--db-path', default=None, help='reuse an existing scratch database')
+    parser.add_argument('--direct', action='store_true', help='skip the Flask test client')
+    args = parser.parse_args()
+
+    from database_manager import BillDatabase
+
+    db_path = args.db_path or os.path.join(tempfile.mkdtemp(prefix='bill-bench-'), 'bench.db')
+    db = BillDatabase(db_path)
+    existing = db.get_connection().execute('SELECT COUNT(*) FROM bills').fetchone()[0]
+    if existing < args.bills:
+        print(f'Seeding {args.bills - existing:,} bills into {db_path}')
+        seed(db, args.bills - existing)
+        db.rebuild_trends()
+    db.get_connection().execute('ANALYZE')
+
+    target = Target(db, args.direct)
+    print(f'\nDatabase: {db_path} ({os.path.getsize(db_path) / 1e6:,.0f} MB, {max(existing, args.bills):,} bills)')
+    print(f'/store-analysis  1 thread : {time_writes(target, args.writes, 1):8,.0f} writes/s')
+    print(f'/store-analysis  {args.threads} threads: {time_writes(target, args.writes, args.threads):8,.0f} writes/s')
+    print(f'/get-insights limit=10    : {percentiles(time_reads(lambda: target.insights(10), args.reads))}')
+    print(f'/get-insights limit=100   : {percentiles(time_reads(lambda: target.insights(100), args.reads))}')
+    print(f'/get-trends   months=12   : {percentiles(time_reads(lambda: target.trends(12), max(5, args.reads // 20)))}')
+    db.close()
+
+if __name__ == '__main__':
+    main()
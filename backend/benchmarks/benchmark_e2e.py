@@ -0,0 +1,332 @@
+"""End-to-end load test of the services against mock OpenAI and mock ERPNext.
+
+Starts mock_llm_server.py and mock_erpnext_server.py, plus the analyzer,
+database and ERPNext services. Each runs in its own process with its
+SQLite files in a temporary directory. At each --concurrency level the
+test drives, in order:
+
+  analyze   POST /analyze-bill with a distinct bill each time (no cache hits)
+  store     POST /store-analysis with those analyses
+  trends    GET /get-trends
+  insights  GET /get-insights?limit=50
+  post      POST /post-to-erpnext for the stored bills
+
+For each endpoint it reports throughput, p50/p95/p99 latency and errors.
+It also reports each service's current and peak RSS (from /proc; Linux
+only). --save-baseline writes the results as JSON. --baseline compares
+against a saved file and exits 1 on a regression: throughput down, or
+p95 latency or peak memory up, by more than --tolerance.
+
+    python benchmarks/benchmark_e2e.py --concurrency 1 4 16 --requests 100
+    python benchmarks/benchmark_e2e.py --baseline benchmarks/baselines/e2e.json
+    python benchmarks/benchmark_e2e.py --llm-latency 2 --erp-error-share 0.05 --save-baseline slow.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# module, port, extra setup run before app.run
+SERVICES = {
+    'mock_llm': ('mock_llm_server', 5105, ''),
+    'mock_erpnext': ('mock_erpnext_server', 5106, ''),
+    'analyzer': ('bill_analyzer', 5101, ''),
+    'database': ('database_manager', 5102, ''),
+    'erpnext': ('erpnext_integration', 5103, 'service.start_outbox_flusher()'),
+}
+# Without debug=True, so there is no reloader process and the pid is the server
+LAUNCH = '''import {module} as service
+{setup}
+service.app.run(host='127.0.0.1', port={port}, threaded=True)
+'''
+BILL = '''STATE ELECTRICITY DISTRIBUTION CO. LTD
+Consumer No: {consumer}
+Billing Period: 01-{month:02d}-{year} to 28-{month:02d}-{year}
+Units Consumed (kWh): {units}
+Rate per Unit: Rs. {rate:.2f}
+Total Amount Payable: Rs. {amount:,.2f}
+'''
+
+def make_bill(number):
+    units = 120 + (number * 37) % 380
+    rate = 5.5 + (number % 7) * 0.25
+    return BILL.format(consumer=4001200 + number, month=number % 12 + 1, year=2020 + number // 12 % 5,
+                       units=units, rate=rate, amount=units * rate)
+
+def url(name):
+    return f'http://127.0.0.1:{SERVICES[name][1]}'
+
+class Services:
+    """The mock and real services as subprocesses, logging to files in workdir"""
+
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.processes = {}
+
+    def environment(self):
+        env = dict(os.environ)
+        env.update({
+            'PYTHONPATH': BACKEND + os.pathsep + env.get('PYTHONPATH', ''),
+            'LLM_BACKEND': 'mock-server',
+            'LLM_BASE_URL': f"{url('mock_llm')}/v1",
+            'MOCK_LLM_LATENCY': str(self.args.llm_latency),
+            'MOCK_LLM_TOKEN_LATENCY': str(self.args.llm_token_latency),
+            'MOCK_LLM_ERROR_SHARE': str(self.args.llm_error_share),
+            'MOCK_ERPNEXT_LATENCY': str(self.args.erp_latency),
+            'MOCK_ERPNEXT_ERROR_SHARE': str(self.args.erp_error_share),
+            # The benchmark measures the services, not the OpenAI quota
+            'OPENAI_REQUESTS_PER_SECOND': '100000',
+            'OPENAI_BURST': '100000',
+            'SIMILAR_BILLS': '0',
+            'LOG_SAMPLE_RATE': '0'
+        })
+        return env
+
+    def start(self):
+        env = self.environment()
+        for name, (module, port, setup) in SERVICES.items():
+            log = open(os.path.join(self.workdir, f'{name}.log'), 'wb')
+            self.processes[name] = subprocess.Popen(
+                [sys.executable, '-c', LAUNCH.format(module=module, setup=setup, port=port)],
+                cwd=self.workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+        for name in SERVICES:
+            self.wait_ready(name)
+
+    def wait_ready(self, name, timeout=60):
+        path = '/health' if name.startswith('mock') else '/metrics'
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.processes[name].poll() is not None:
+                break
+            try:
+                if requests.get(url(name) + path, timeout=1).ok:
+                    return
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f'{name} did not start; see {os.path.join(self.workdir, name + ".log")}')
+
+    def memory(self):
+        return {name: memory_mb(process.pid) for name, process in self.processes.items()
+                if not name.startswith('mock')}
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def memory_mb(pid):
+    """Current and peak resident memory of a process, in MB"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            fields = dict(line.split(':', 1) for line in status if ':' in line)
+    except OSError:
+        return {'rss_mb': None, 'peak_mb': None}
+    to_mb = lambda key: round(int(fields[key].split()[0]) / 1024, 1) if key in fields else None
+    return {'rss_mb': to_mb('VmRSS'), 'peak_mb': to_mb('VmHWM')}
+
+_local = threading.local()
+
+def session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+def check(response):
+    """JSON body of a successful response; HTTP errors and error bodies raise"""
+    if response.status_code >= 400:
+        raise RuntimeError(f'HTTP {response.status_code}')
+    body = response.json()
+    error = body.get('error') or (body.get('analysis') or {}).get('error')
+    if error:
+        raise RuntimeError(str(error)[:200])
+    return body
+
+def percentile(ordered, share):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+def run_endpoint(name, concurrency, items, call):
+    """Call call(item) for every item from concurrency threads; returns (stats, results)"""
+    latencies = []
+    errors = []
+    results = [None] * len(items)
+    lock = threading.Lock()
+
+    def one(index):
+        started = time.perf_counter()
+        try:
+            results[index] = call(items[index])
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(len(items))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    stats = {
+        'endpoint': name,
+        'concurrency': concurrency,
+        'requests': len(items),
+        'errors': len(errors),
+        'throughput': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'sample_error': errors[0] if errors else None
+    }
+    return stats, results
+
+def run_level(concurrency, first_bill, args):
+    """All five endpoints at one concurrency level"""
+    timeout = args.timeout
+    bills = [make_bill(first_bill + index) for index in range(args.requests)]
+    level = []
+
+    stats, analyses = run_endpoint('analyze', concurrency, bills, lambda bill: check(session().post(
+        f"{url('analyzer')}/analyze-bill",
+        json={'bill_text': bill, 'openai_api_key': 'mock', 'mode': args.mode}, timeout=timeout
+    ))['analysis'])
+    level.append(stats)
+
+    stored = [(bill, analysis, index) for index, (bill, analysis) in enumerate(zip(bills, analyses)) if analysis]
+    stats, bill_ids = run_endpoint('store', concurrency, stored, lambda item: check(session().post(
+        f"{url('database')}/store-analysis",
+        json={'file_url': f'https://example.com/bills/{first_bill + item[2]}.pdf', 'file_type': 'pdf',
+              'extracted_text': item[0], 'analysis': item[1], 'account_id': f'ACME-{item[2] % 10:03d}'},
+        timeout=timeout
+    ))['bill_id'])
+    level.append(stats)
+
+    reads = range(args.requests)
+    stats, _ = run_endpoint('trends', concurrency, reads, lambda _: check(session().get(
+        f"{url('database')}/get-trends", timeout=timeout)))
+    level.append(stats)
+    stats, _ = run_endpoint('insights', concurrency, reads, lambda _: check(session().get(
+        f"{url('database')}/get-insights", params={'limit': 50}, timeout=timeout)))
+    level.append(stats)
+
+    posts = [(bill_id, item[1]) for bill_id, item in zip(bill_ids, stored) if bill_id]
+    stats, _ = run_endpoint('post', concurrency, posts, lambda item: check(session().post(
+        f"{url('erpnext')}/post-to-erpnext",
+        json={'erpnext_url': url('mock_erpnext'), 'api_key': 'bench', 'api_secret': 'bench',
+              'bill_id': item[0], 'analysis': item[1]}, timeout=timeout
+    )))
+    level.append(stats)
+    return level
+
+def compare(results, baseline, tolerance):
+    """Lines describing regressions against a baseline run"""
+    if baseline.get('settings') != results['settings']:
+        print('warning: baseline was recorded with different settings; comparing anyway')
+    if (baseline.get('environment') or {}).get('cpus') != results['environment']['cpus']:
+        print('warning: baseline was recorded on a machine with a different CPU count')
+    previous = {(row['endpoint'], row['concurrency']): row for row in baseline['results']}
+    regressions = []
+    for row in results['results']:
+        before = previous.get((row['endpoint'], row['concurrency']))
+        if not before:
+            continue
+        label = f"{row['endpoint']} @ {row['concurrency']}"
+        if before['throughput'] and row['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {before['throughput']} -> {row['throughput']} req/s")
+        # Ignore sub-millisecond changes; they are noise at these sizes
+        if (before['p95_ms'] and row['p95_ms'] and row['p95_ms'] > before['p95_ms'] * (1 + tolerance)
+                and row['p95_ms'] - before['p95_ms'] > 1):
+            regressions.append(f"{label}: p95 {before['p95_ms']} -> {row['p95_ms']} ms")
+        if row['errors'] > before['errors']:
+            regressions.append(f"{label}: errors {before['errors']} -> {row['errors']}")
+    for service, memory in results['memory'].items():
+        before = baseline.get('memory', {}).get(service) or {}
+        if before.get('peak_mb') and memory['peak_mb'] and memory['peak_mb'] > before['peak_mb'] * (1 + tolerance):
+            regressions.append(f"{service}: peak memory {before['peak_mb']} -> {memory['peak_mb']} MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint and level')
+    parser.add_argument('--mode', default='full', choices=['full', 'hybrid', 'fast'])
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--llm-token-latency', type=float, default=0.0)
+    parser.add_argument('--llm-error-share', type=float, default=0.0)
+    parser.add_argument('--erp-latency', type=float, default=0.05)
+    parser.add_argument('--erp-error-share', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--save-baseline', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file; exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    settings = {key: getattr(args, key) for key in ('requests', 'mode', 'llm_latency', 'llm_token_latency',
+                                                    'llm_error_share', 'erp_latency', 'erp_error_share')}
+    print(f"{args.requests} requests per endpoint, concurrency {args.concurrency}, mode {args.mode}, "
+          f"LLM latency {args.llm_latency} s, ERPNext latency {args.erp_latency} s, {os.cpu_count()} CPUs")
+
+    workdir = tempfile.mkdtemp(prefix='e2e-bench-')
+    services = Services(args, workdir)
+    rows = []
+    memory = {}
+    try:
+        services.start()
+        print(f"\n{'endpoint':<9} {'conc':>4} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for index, concurrency in enumerate(args.concurrency):
+            for row in run_level(concurrency, index * args.requests, args):
+                rows.append(row)
+                latency = ' '.join(f'{row[key]:9.1f}' if row[key] is not None else f"{'-':>9}"
+                                   for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+                print(f"{row['endpoint']:<9} {concurrency:>4} {row['throughput']:8.1f} {latency} {row['errors']:>7}"
+                      + (f"   e.g. {row['sample_error']}" if row['sample_error'] else ''))
+        memory = services.memory()
+    finally:
+        services.stop()
+
+    print(f"\n{'service':<9} {'rss MB':>8} {'peak MB':>8}")
+    for name, usage in memory.items():
+        print(f"{name:<9} {usage['rss_mb'] or '-':>8} {usage['peak_mb'] or '-':>8}")
+    print(f'\nservice logs and databases in {workdir}')
+
+    results = {
+        'settings': settings,
+        'environment': {'cpus': os.cpu_count(), 'python': platform.python_version(), 'platform': platform.platform()},
+        'results': [{key: value for key, value in row.items() if key != 'sample_error'} for row in rows],
+        'memory': memory
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as output:
+            json.dump(results, output, indent=2)
+            output.write('\n')
+        print(f'baseline written to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as source:
+            regressions = compare(results, json.load(source), args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print(f'\nno regressions beyond {args.tolerance:.0%} against {args.baseline}')
+
+if __name__ == '__main__':
+    main()
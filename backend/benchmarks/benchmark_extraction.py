@@ -0,0 +1,72 @@
+"""Time local PDF text extraction: one process vs a pool, and cache hits.
+
+Builds a --pages page PDF by repeating the pages of SampleElectricBill.pdf
+(with pypdfium2, which pdfplumber installs), then extracts it with
+TextExtractor at 1 worker and at --workers, and once more from the cache.
+Also reports how soon the first page is available when streaming.
+
+    python benchmarks/benchmark_extraction.py --pages 60 --workers 8
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'SampleElectricBill.pdf')
+
+def build_pdf(pages):
+    import pypdfium2
+
+    source = pypdfium2.PdfDocument(SAMPLE)
+    document = pypdfium2.PdfDocument.new()
+    while len(document) < pages:
+        document.import_pages(source, list(range(min(len(source), pages - len(document)))))
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+def run(label, extractor, data):
+    started = time.perf_counter()
+    first_page = None
+    pages = 0
+    for _, text in extractor.iter_pages(data, 'pdf'):
+        if first_page is None:
+            first_page = time.perf_counter() - started
+        pages += 1
+    total = time.perf_counter() - started
+    print(f'{label:<22} {pages} pages in {total:6.2f} s  ({pages / total:7.1f} pages/s)  '
+          f'first page after {first_page:.2f} s')
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=60)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--pages-per-task', type=int, default=4)
+    args = parser.parse_args()
+
+    from analysis_cache import AnalysisCache
+    from text_extractor import TextExtractor
+
+    data = build_pdf(args.pages)
+    print(f'{args.pages}-page PDF, {len(data) / 1024:.0f} KB, {os.cpu_count()} CPUs')
+
+    single = TextExtractor(workers=1, pages_per_task=args.pages)
+    serial = run('1 worker', single, data)
+    single.close()
+
+    cache = AnalysisCache(db_path=os.path.join(tempfile.mkdtemp(prefix='extract-bench-'), 'text_cache.db'))
+    pooled = TextExtractor(workers=args.workers, pages_per_task=args.pages_per_task, cache=cache)
+    # Start the worker processes outside the timed run
+    list(pooled.pool.map(abs, range(args.workers)))
+    parallel = run(f'{args.workers} workers', pooled, data)
+    run('cached', pooled, data)
+    pooled.close()
+    print(f'\npool took {parallel / serial:.0%} of the single-process time')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Compare local bill_summary extraction against the GPT-4 path.
+
+Builds synthetic PDF.co-style bill texts from the rows of Assets/E-Bill.xlsx
+(year, month, bill date, amount) in a few different layouts, then measures
+extraction latency and agreement with the known values. Pass
+--openai-api-key to also time the LLM path on the same samples.
+
+    python benchmarks/benchmark_extractor.py
+    python benchmarks/benchmark_extractor.py --openai-api-key sk-... --limit 5
+"""
+import argparse
+import calendar
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bill_extractor import extract_bill_summary, SUMMARY_FIELDS
+
+DEFAULT_WORKBOOK = os.path.join(os.path.dirname(__file__), '..', '..', 'Assets', 'E-Bill.xlsx')
+
+LAYOUTS = [
+    """STATE ELECTRICITY DISTRIBUTION CO. LTD
+Consumer No: 40012{index:03d}
+Bill Date: {bill_date:%d-%m-%Y}
+Billing Period: {start:%d-%m-%Y} to {end:%d-%m-%Y}
+Units Consumed (kWh): {units}
+Rate per Unit: Rs. {rate:.2f}
+Amount Due Date: {due:%d-%m-%Y}
+Total Amount Payable: Rs. {amount:,.2f}
+""",
+    """ELECTRICITY BILL
+Bill Period
+{start:%d %b %Y} - {end:%d %b %Y}
+Previous Reading
+{previous}
+Present Reading
+{present}
+Energy Charges @ {rate:.2f}
+Net Amount Payable
+₹ {amount:,.2f}
+""",
+    """Account Statement {index}
+Statement for {start:%b %d, %Y} - {end:%b %d, %Y}
+Total kWh used {units} kWh
+Amount Due {amount:.2f}
+Terms and conditions apply. Pay before {due:%d/%m/%Y} to avoid surcharge.
+"""
+]
+
+def excel_date(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime(1899, 12, 30) + timedelta(days=int(value))
+
+def load_samples(path):
+    from openpyxl import load_workbook
+
+    sheet = load_workbook(path, data_only=True).active
+    samples = []
+    for index, row in enumerate(sheet.iter_rows(min_row=2, max_col=4, values_only=True)):
+        year, month, bill_date, amount = row
+        if not (year and month and bill_date and amount):
+            continue
+        bill_date = excel_date(bill_date)
+        month_number = list(calendar.month_name).index(month)
+        start = datetime(int(year), month_number, 1)
+        end = datetime(int(year), month_number, calendar.monthrange(int(year), month_number)[1])
+        rate = 6.5 + (index % 4) * 0.75
+        units = int(round(float(amount) / rate))
+        previous = 10000 + index * 731
+        values = {
+            'index': index,
+            'bill_date': bill_date,
+            'due': bill_date + timedelta(days=15),
+            'start': start,
+            'end': end,
+            'units': units,
+            'rate': rate,
+            'amount': float(amount),
+            'previous': previous,
+            'present': previous + units
+        }
+        samples.append({
+            'text': LAYOUTS[index % len(LAYOUTS)].format(**values),
+            'expected': {
+                'billing_period': (start, end),
+                'total_amount': float(amount),
+                'units_consumed': float(units),
+                'rate_per_unit': rate
+            }
+        })
+    return samples
+
+def numeric(value):
+    numbers = re.findall(r'\d+(?:\.\d+)?', str(value or '').replace(',', ''))
+    return float(numbers[0]) if numbers else None
+
+def field_agrees(field, actual, expected):
+    if actual in (None, ''):
+        return False
+    if field == 'billing_period':
+        start, end = expected
+        text = str(actual)
+        return all(
+            any(token in text for token in (f'{d:%d-%m-%Y}', f'{d:%d %b %Y}', f'{d:%b %d, %Y}', f'{d:%B %Y}'))
+            for d in (start, end)
+        )
+    value = numeric(actual)
+    if value is None:
+        return False
+    tolerance = 0.02 if field == 'rate_per_unit' else 0.01
+    return abs(value - expected) <= tolerance * max(1.0, abs(expected))
+
+def score(samples, summaries):
+    agreement = {}
+    for field in SUMMARY_FIELDS:
+        matches = sum(
+            field_agrees(field, summary.get(field), sample['expected'][field])
+            for sample, summary in zip(samples, summaries)
+        )
+        agreement[field] = matches / len(samples) if samples else 0.0
+    return agreement
+
+def report(name, latencies, agreement):
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f'\n{name}')
+    print(f'  samples: {len(latencies)}  mean: {mean * 1000:.3f} ms  p95: {p95 * 1000:.3f} ms')
+    for field, rate in agreement.items():
+        print(f'  {field:<16} {rate * 100:6.1f}% agreement')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workbook', default=DEFAULT_WORKBOOK)
+    parser.add_argument('--openai-api-key', default=os.environ.get('OPENAI_API_KEY'))
+    parser.add_argument('--limit', type=int, default=None, help='only send this many samples to the LLM')
+    parser.add_argument('--repeat', type=int, default=100, help='repetitions per sample for local timing')
+    args = parser.parse_args()
+
+    samples = load_samples(args.workbook)
+    if not samples:
+        sys.exit(f'No bill rows found in {args.workbook}')
+
+    local_summaries = []
+    local_latencies = []
+    for sample in samples:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            summary = extract_bill_summary(sample['text'])
+        local_latencies.append((time.perf_counter() - start) / args.repeat)
+        local_summaries.append(summary)
+    report('Local extractor', local_latencies, score(samples, local_summaries))
+
+    if not args.openai_api_key:
+        print('\nSkipping LLM path (no --openai-api-key)')
+        return
+
+    from bill_analyzer import ElectricityBillAnalyzer
+
+    analyzer = ElectricityBillAnalyzer(args.openai_api_key)
+    llm_samples = samples[:args.limit] if args.limit else samples
+    llm_summaries = []
+    llm_latencies = []
+    for sample in llm_samples:
+        start = time.perf_counter()
+        analysis = analyzer.analyze_bill(sample['text'])
+        llm_latencies.append(time.perf_counter() - start)
+        llm_summaries.append(analysis.get('bill_summary', {}))
+    report('LLM path (gpt-4)', llm_latencies, score(llm_samples, llm_summaries))
+
+    agreement = {}
+    for field in SUMMARY_FIELDS:
+        same = 0
+        for local, llm in zip(local_summaries, llm_summaries):
+            if field == 'billing_period':
+                same += bool(local.get(field)) and set(re.findall(r'\d+', local.get(field, ''))) <= set(re.findall(r'\d+', str(llm.get(field, ''))))
+            else:
+                a, b = numeric(local.get(field)), numeric(llm.get(field))
+                same += a is not None and b is not None and abs(a - b) <= 0.02 * max(1.0, abs(b))
+        agreement[field] = same / len(llm_summaries)
+    print('\nLocal vs LLM field agreement')
+    for field, rate in agreement.items():
+        print(f'  {field:<16} {rate * 100:6.1f}%')
+
+    speedup = (sum(llm_latencies) / len(llm_latencies)) / (sum(local_latencies) / len(local_latencies))
+    print(f'\nLocal extraction is {speedup:,.0f}x faster per bill')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Compare the old regex parsing of LLM replies with analysis_parser.
+
+Runs every reply in malformed_responses.json through the analyzer's old
+greedy-regex parse, the old ERPNext ```json / <div> sniffing and
+parse_analysis, prints what each made of it, then times them over
+--iterations passes: extraction alone, and extraction plus validation and
+number parsing (the old path re-read amounts in the database instead,
+turning "1,234.50" into 1.0). --padding appends that many KB of prose after the
+JSON, as chatty models do. --no-orjson times the standard json module
+even when orjson is installed.
+
+    python benchmarks/benchmark_parser.py --iterations 2000 --padding 16
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'malformed_responses.json')
+
+def old_analyzer_parse(text):
+    """ElectricityBillAnalyzer.build_analysis before analysis_parser"""
+    try:
+        match = re.search(r'\{.*\}', text, re.DOTALL)
+        if match:
+            return json.loads(match.group()), 'ok'
+        return {'bill_summary': {'analysis_text': text[:500]}}, 'fallback'
+    except json.JSONDecodeError:
+        return {'bill_summary': {'analysis_text': text[:500]}}, 'fallback'
+
+def old_erpnext_parse(text):
+    """post_to_erpnext before analysis_parser"""
+    json_str = None
+    match = re.search(r"```json\s*(.*?)```", text, re.DOTALL)
+    if match:
+        json_str = match.group(1)
+    elif '<div' in text:
+        match = re.search(r"<div[^>]*>(.*?)</div>", text, re.DOTALL)
+        if match:
+            json_str = match.group(1)
+    if not json_str:
+        return None, 'raw text'
+    try:
+        return json.loads(json_str), 'ok'
+    except Exception:
+        return None, '400'
+
+def old_extract_numeric(value):
+    """BillDatabase.extract_numeric before analysis_parser ("1,234.50" -> 1.0)"""
+    numbers = re.findall(r'[\d.]+', str(value or ''))
+    return float(numbers[0]) if numbers else None
+
+def old_pipeline(text):
+    """Old parse plus the figures the database re-read from bill_summary"""
+    analysis, _ = old_analyzer_parse(text)
+    summary = analysis.get('bill_summary') or {}
+    return old_extract_numeric(summary.get('total_amount')), old_extract_numeric(summary.get('units_consumed'))
+
+def outcome(parsed):
+    if parsed.analysis is None:
+        return 'error'
+    if parsed.problems:
+        return 'problems'
+    return 'repaired' if parsed.repairs else 'ok'
+
+def time_parser(parse, texts, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            parse(text)
+    return (time.perf_counter() - started) / (iterations * len(texts)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--padding', type=int, default=16)
+    parser.add_argument('--no-orjson', action='store_true')
+    args = parser.parse_args()
+
+    import analysis_parser
+    from analysis_parser import extract_json, parse_analysis, validate_analysis
+    if args.no_orjson:
+        analysis_parser.orjson = None
+
+    with open(CORPUS, encoding='utf-8') as f:
+        cases = json.load(f)
+
+    print(f'{"reply":<24} {"old analyzer":<13} {"old erpnext":<12} {"parser":<10} expected')
+    mismatches = 0
+    clean = []
+    for case in cases:
+        old_analysis, old_outcome = old_analyzer_parse(case['text'])
+        if old_outcome == 'ok' and validate_analysis(old_analysis):
+            old_outcome = 'invalid'
+        if old_outcome != 'fallback':
+            clean.append(case['text'])
+        new_outcome = outcome(parse_analysis(case['text']))
+        expected = case['expect']
+        matched = new_outcome == expected or (new_outcome == 'repaired' and expected == 'ok')
+        mismatches += not matched
+        print(f'{case["name"]:<24} {old_outcome:<13} {old_erpnext_parse(case["text"])[1]:<12} '
+              f'{new_outcome:<10} {expected}{"" if matched else "  <-- unexpected"}')
+
+    prose = ('The figures above were read from the bill as provided. ' * 20 + '\n') * max(1, args.padding)
+    padded = [text + '\n\n' + prose[:args.padding * 1024] for text in clean]
+    print(f'\njson module: {"orjson" if analysis_parser.orjson is not None else "json"}')
+    for label, texts in ((f'{len(clean)} replies the old path could parse', clean),
+                         (f'the same with {args.padding} KB of prose after the JSON', padded),
+                         (f'all {len(cases)} replies', [case['text'] for case in cases])):
+        print(label)
+        for name, old, new in (('extract only', old_analyzer_parse, extract_json),
+                               ('with figures', old_pipeline, parse_analysis)):
+            old_time = time_parser(old, texts, args.iterations)
+            new_time = time_parser(new, texts, args.iterations)
+            print(f'  {name:<13} old {old_time:7.1f} us/reply  new {new_time:7.1f} us/reply')
+
+    if mismatches:
+        print(f'\n{mismatches} replies parsed differently than expected')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
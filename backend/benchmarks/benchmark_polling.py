@@ -0,0 +1,111 @@
+"""Simulate dashboards polling /get-insights and /get-trends.
+
+--clients threads each poll both endpoints in a loop for --duration seconds
+while a writer stores one bill every --write-interval seconds. Each poll
+set is run three ways:
+
+  plain       full payload every time (how the dashboard polls today)
+  etag        sends If-None-Match, so unchanged polls get an empty 304
+  projected   etag plus ?fields= to drop the large columns
+
+Reports polls/s, latency percentiles, the share answered with 304 and the
+bytes sent. Requests go through the Flask test client.
+
+    python benchmarks/benchmark_polling.py --bills 200000 --clients 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_database import SAMPLE_ANALYSIS, SAMPLE_TEXT, percentiles, seed
+
+MODES = {
+    'plain': {'etag': False, 'insights': '/get-insights?limit=50', 'trends': '/get-trends?months=24'},
+    'etag': {'etag': True, 'insights': '/get-insights?limit=50', 'trends': '/get-trends?months=24'},
+    'projected': {'etag': True, 'insights': '/get-insights?limit=50&fields=id,type,date,efficiency',
+                  'trends': '/get-trends?months=24&fields=month_year,avg_cost'}
+}
+
+def poll(client, mode, duration, results, lock):
+    etags = {}
+    samples = []
+    not_modified = 0
+    sent = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        for path in (mode['insights'], mode['trends']):
+            headers = {'If-None-Match': etags[path]} if mode['etag'] and path in etags else {}
+            started = time.perf_counter()
+            response = client.get(path, headers=headers)
+            samples.append(time.perf_counter() - started)
+            if response.status_code == 304:
+                not_modified += 1
+            else:
+                assert response.status_code == 200, response.data
+                etags[path] = response.headers.get('ETag', '').strip('"')
+            sent += len(response.data)
+    with lock:
+        results['samples'].extend(samples)
+        results['not_modified'] += not_modified
+        results['bytes'] += sent
+
+def write(db, stop, interval):
+    while not stop.wait(interval):
+        db.store_bill_analysis('https://example.com/bill.pdf', 'pdf', SAMPLE_TEXT, SAMPLE_ANALYSIS)
+
+def run(name, mode, database_manager, args):
+    results = {'samples': [], 'not_modified': 0, 'bytes': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+    writer = threading.Thread(target=write, args=(database_manager.db, stop, args.write_interval))
+    pollers = [
+        threading.Thread(target=poll, args=(database_manager.app.test_client(), mode, args.duration, results, lock))
+        for _ in range(args.clients)
+    ]
+    writer.start()
+    for thread in pollers:
+        thread.start()
+    for thread in pollers:
+        thread.join()
+    stop.set()
+    writer.join()
+
+    count = len(results['samples'])
+    print(f'{name:<10} {count / args.duration:9,.0f} req/s  {percentiles(results["samples"])}  '
+          f'304 {results["not_modified"] / count:6.1%}  {results["bytes"] / count / 1024:8.1f} KB/req')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bills', type=int, default=200000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--write-interval', type=float, default=1.0)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--db-path', default=None, help='reuse an existing scratch database')
+    args = parser.parse_args()
+
+    import database_manager
+    from database_manager import BillDatabase
+
+    db_path = args.db_path or os.path.join(tempfile.mkdtemp(prefix='poll-bench-'), 'bench.db')
+    db = BillDatabase(db_path)
+    existing = db.get_connection().execute('SELECT COUNT(*) FROM bills').fetchone()[0]
+    if existing < args.bills:
+        print(f'Seeding {args.bills - existing:,} bills into {db_path}')
+        seed(db, args.bills - existing)
+        db.rebuild_trends()
+    db.get_connection().execute('ANALYZE')
+    database_manager.db = db
+
+    print(f'\n{args.clients} pollers, one write every {args.write_interval}s, {args.duration}s per mode')
+    for name in args.modes:
+        run(name, MODES[name], database_manager, args)
+    db.close()
+
+if __name__ == '__main__':
+    main()
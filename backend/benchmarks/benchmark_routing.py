@@ -0,0 +1,89 @@
+"""Compare strong-model-only analysis with fast/strong model routing.
+
+Runs --bills synthetic bills through ElectricityBillAnalyzer on the
+in-process mock backend, once with every bill on --strong-model and once
+routed through ModelRouter. The mock charges --latency plus
+--token-latency per output token, scaled by --fast-speed for the fast
+model, and --invalid-share of fast replies fail validation and are
+escalated. --long-share of bills are long with figures the local
+extractor cannot read, so they go straight to the strong model.
+
+    python benchmarks/benchmark_routing.py --bills 200 --latency 0.2
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_database import percentiles
+
+def bill_text(units, long_bill):
+    if long_bill:
+        # Figures written so the local extractor cannot find them
+        lines = [f'Reading difference this cycle came to {units} units',
+                 f'Please pay {units * 6.5:.2f} rupees before the due date']
+        lines += [f'Slab {slab} tariff note: energy charges revised per regulation {slab}' for slab in range(400)]
+    else:
+        lines = [f'Consumer No: {random.randrange(100000000, 999999999)}',
+                 'Billing Period: March 2024',
+                 f'Units Consumed: {units} kWh',
+                 f'Total Amount Payable: Rs. {units * 6.5:.2f}',
+                 'Rate per unit: Rs. 6.5']
+    return '\n'.join(lines)
+
+def run(name, bills, backend, router, args):
+    from bill_analyzer import ElectricityBillAnalyzer
+    from llm_backends import backend_metrics
+
+    backend_metrics.clear()
+    analyzer = ElectricityBillAnalyzer('mock', model=args.strong_model, backend=backend, router=router)
+    samples = []
+    started = time.perf_counter()
+    for text in bills:
+        call_started = time.perf_counter()
+        analysis = analyzer.analyze_bill(text)
+        samples.append(time.perf_counter() - call_started)
+        assert 'error' not in analysis, analysis
+    total = time.perf_counter() - started
+
+    print(f'\n{name}: {len(bills)} bills in {total:.1f} s  {percentiles(samples)}')
+    for stats in backend_metrics.get_stats():
+        print(f'  {stats["model"]:<14} {stats["calls"]:5} calls  mean {stats["latency_mean"]:.3f} s  '
+              f'p95 {stats["latency_p95"]:.3f} s  errors {stats["error_rate"]:.1%}')
+    if router is not None:
+        routing = router.get_stats()
+        print(f'  routed {routing["routed"]}, escalated {routing["escalations"]} '
+              f'({routing["escalation_rate"]:.1%} of fast calls)')
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bills', type=int, default=200)
+    parser.add_argument('--long-share', type=float, default=0.2)
+    parser.add_argument('--strong-model', default='gpt-4')
+    parser.add_argument('--fast-model', default='gpt-4o-mini')
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--token-latency', type=float, default=0.002)
+    parser.add_argument('--fast-speed', type=float, default=0.3)
+    parser.add_argument('--invalid-share', type=float, default=0.1)
+    args = parser.parse_args()
+
+    # Plain analyzers: no caches, no rate limit
+    os.environ.setdefault('SIMILAR_BILLS', '0')
+    from llm_backends import MockBackend, ModelRouter
+
+    random.seed(3)
+    bills = [bill_text(random.randint(80, 600), random.random() < args.long_share) for _ in range(args.bills)]
+    backend = MockBackend(latency=args.latency, token_latency=args.token_latency,
+                          model_speeds={args.fast_model: args.fast_speed},
+                          invalid_share={args.fast_model: args.invalid_share})
+
+    strong = run('strong only', bills, backend, None, args)
+    routed = run('routed', bills, backend, ModelRouter(args.fast_model, args.strong_model), args)
+    print(f'\nrouting took {routed / strong:.0%} of the strong-only time')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Measure /search-insights latency against the LIKE scan it replaces.
+
+Seeds a scratch database with --bills bills (four insights each, drawn from
+a pool of recommendation/anomaly phrases so terms have realistic
+selectivity), then times for each query:
+
+  * FTS5 search, first page with facets
+  * the same search paging --pages deep through next_cursor
+  * the equivalent LIKE '%term%' query: first page, and the match count
+    that facets need (a full scan)
+
+    python benchmarks/benchmark_search.py --bills 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_database import percentiles, time_reads
+
+RECOMMENDATIONS = [
+    'Shift washing machine use to off-peak hours',
+    'Replace remaining incandescent bulbs with LEDs',
+    'Check the fixed charge against your sanctioned load',
+    'Service the air conditioner before summer',
+    'Consider a rooftop solar connection under net metering',
+    'Switch off geysers when not in use',
+    'Apply for the time-of-day tariff',
+    'Reduce standby consumption of televisions and set-top boxes',
+    'Pay before the due date to get the prompt payment rebate'
+]
+
+ANOMALIES = [
+    'Fixed charge is higher than last month',
+    'Units consumed doubled compared to the previous cycle',
+    'Meter reading marked as estimated',
+    'Arrears carried forward from the last bill',
+    'Fuel surcharge applied at a higher rate',
+    'Late payment surcharge included'
+]
+
+# Appears on about one bill in a thousand
+RARE_ANOMALY = 'Meter tampering suspected during inspection'
+
+QUERIES = [
+    ('rare phrase', {'query': '"meter tampering"'}),
+    ('frequent phrase', {'query': '"prompt payment rebate"'}),
+    ('common term', {'query': 'charge'}),
+    ('anomaly + rating', {'query': '"fixed charge"', 'insight_type': 'anomaly', 'efficiency_rating': 'poor'}),
+    ('term in one quarter', {'query': 'solar', 'date_from': None, 'date_to': None}),
+    ('facets only, no text', {'insight_type': 'anomaly'})
+]
+
+def seed(db, bills, batch_size=20000):
+    """Bulk-load bills and insights; insights are indexed by the FTS triggers,
+    bill text by inserting into bills_fts as store_bill_analysis does"""
+    from blob_store import store_blob
+
+    conn = db.get_connection()
+    start = datetime.now() - timedelta(days=730)
+    ratings = ['poor', 'average', 'good', 'excellent']
+    next_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM bills').fetchone()[0] + 1
+    remaining = bills
+    while remaining > 0:
+        count = min(batch_size, remaining)
+        bill_rows = []
+        bill_texts = []
+        insight_rows = []
+        for bill_id in range(next_id, next_id + count):
+            uploaded = (start + timedelta(seconds=random.randint(0, 730 * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+            amount = round(random.uniform(300, 16000), 2)
+            text = f'Units Consumed: {int(amount / 6.5)}\nTotal Amount Payable: Rs. {amount}\n' + \
+                   '\n'.join(random.sample(ANOMALIES, 2))
+            bill_texts.append((bill_id, text))
+            bill_rows.append([bill_id, uploaded, 'https://example.com/bill.pdf', 'pdf', None,
+                              amount, round(amount / 6.5, 1), random.choice(ratings)])
+            for recommendation in random.sample(RECOMMENDATIONS, 3):
+                insight_rows.append((bill_id, uploaded, 'recommendation', recommendation))
+            anomaly = RARE_ANOMALY if random.random() < 0.001 else random.choice(ANOMALIES)
+            insight_rows.append((bill_id, uploaded, 'anomaly', anomaly))
+        with conn:
+            for row, (_, text) in zip(bill_rows, bill_texts):
+                row[4] = store_blob(conn, text)
+            conn.executemany('''
+                INSERT INTO bills (id, upload_date, file_url, file_type, text_blob_id,
+                                   total_amount, units_consumed, efficiency_rating)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', bill_rows)
+            conn.executemany('INSERT INTO bills_fts (rowid, extracted_text) VALUES (?, ?)', bill_texts)
+            conn.executemany('''
+                INSERT INTO insights (bill_id, insight_date, insight_type, insight_text)
+                VALUES (?, ?, ?, ?)
+            ''', insight_rows)
+        next_id += count
+        remaining -= count
+        print(f'  seeded {bills - remaining:,}/{bills:,} bills', end='\r', flush=True)
+    print()
+
+def like_scan(db, query, count=False):
+    """What the same question costs without the index"""
+    term = query.strip('"').split('"')[0]
+    if count:
+        sql = 'SELECT COUNT(*) FROM insights WHERE insight_text LIKE ?'
+    else:
+        sql = '''
+            SELECT id, insight_text FROM insights
+            WHERE insight_text LIKE ?
+            ORDER BY insight_date DESC, id DESC
+            LIMIT 20
+        '''
+    return db.get_connection().execute(sql, (f'%{term}%',)).fetchall()
+
+def page_through(db, params, pages):
+    cursor = None
+    for _ in range(pages):
+        page = db.search_insights(limit=20, cursor=cursor, facets=False, **params)
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bills', type=int, default=1000000)
+    parser.add_argument('--reads', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--db-path', default=None, help='reuse an existing scratch database')
+    args = parser.parse_args()
+
+    from database_manager import BillDatabase
+
+    db_path = args.db_path or os.path.join(tempfile.mkdtemp(prefix='search-bench-'), 'bench.db')
+    db = BillDatabase(db_path)
+    existing = db.get_connection().execute('SELECT COUNT(*) FROM bills').fetchone()[0]
+    if existing < args.bills:
+        print(f'Seeding {args.bills - existing:,} bills into {db_path}')
+        seed(db, args.bills - existing)
+    db.get_connection().execute('ANALYZE')
+
+    quarter_start = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-01')
+    quarter_end = (datetime.now() - timedelta(days=275)).strftime('%Y-%m-01')
+    insights = db.get_connection().execute('SELECT COUNT(*) FROM insights').fetchone()[0]
+    print(f'\nDatabase: {db_path} ({os.path.getsize(db_path) / 1e6:,.0f} MB, {insights:,} insights)')
+
+    for name, params in QUERIES:
+        if 'date_from' in params:
+            params = dict(params, date_from=quarter_start, date_to=quarter_end)
+        total = db.search_insights(limit=1, **params)['total']
+        print(f'\n{name} ({total:,} matches)')
+        print(f'  search + facets   : {percentiles(time_reads(lambda: db.search_insights(**params), args.reads))}')
+        print(f'  search, no facets : '
+              f'{percentiles(time_reads(lambda: db.search_insights(facets=False, **params), args.reads))}')
+        print(f'  {args.pages} pages deep     : '
+              f'{percentiles(time_reads(lambda: page_through(db, params, args.pages), max(3, args.reads // 5)))}')
+        if params.get('query'):
+            print(f'  LIKE first page   : '
+                  f'{percentiles(time_reads(lambda: like_scan(db, params["query"]), max(3, args.reads // 5)))}')
+            print(f'  LIKE match count  : '
+                  f'{percentiles(time_reads(lambda: like_scan(db, params["query"], True), max(3, args.reads // 5)))}')
+    db.close()
+
+if __name__ == '__main__':
+    main()
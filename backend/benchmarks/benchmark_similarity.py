@@ -0,0 +1,104 @@
+"""Measure similar-bill lookups: hit rate, lookup latency and LLM time saved.
+
+Simulates --months of bills for --accounts consumers spread over --tariffs
+bill layouts. Each month's consumption drifts around the account's usual
+level, and --jump-share of bills jump far enough that the figures no
+longer match. Every bill goes through SimilarityIndex.plan() the way
+ElectricityBillAnalyzer uses it; misses and example calls are charged
+--full-latency / --example-latency seconds instead of calling an LLM.
+
+    python benchmarks/benchmark_similarity.py --accounts 2000 --months 12
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_database import percentiles
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+          'September', 'October', 'November', 'December']
+
+def tariff_layout(tariff):
+    """Static lines of one utility's bill layout"""
+    rng = random.Random(tariff)
+    company = f'{rng.choice(["NORTH", "SOUTH", "EAST", "WEST", "CENTRAL"])} {tariff} POWER DISTRIBUTION CO. LTD'
+    slabs = [f'Slab {slab}: {rng.choice(["domestic", "LT-1", "residential"])} energy charges' for slab in range(1, 6)]
+    notes = [f'{rng.choice(["Note", "Important", "Notice"])}: {rng.choice(["pay before due date", "surcharge applies after due date", "meter reading estimated if inaccessible", "fixed charges per connected load"])}'
+             for _ in range(12)]
+    return company, slabs, notes
+
+def bill_text(layout, consumer, month, units):
+    company, slabs, notes = layout
+    amount = units * 6.5 + 120
+    lines = [
+        company,
+        f'Consumer No: {consumer}',
+        f'Meter No: {consumer + 7000000}',
+        f'Billing Period: {MONTHS[month % 12]} {2023 + month // 12}',
+        f'Units Consumed: {units} kWh',
+        f'Total Amount Payable: Rs. {amount:.2f}',
+        f'Rate per unit: Rs. {amount / units:.2f}',
+        f'Due Date: {(month % 28) + 1:02d}-{(month % 12) + 1:02d}-{2023 + month // 12}'
+    ]
+    return '\n'.join(lines + slabs + notes)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=2000)
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--tariffs', type=int, default=20)
+    parser.add_argument('--jump-share', type=float, default=0.15)
+    parser.add_argument('--full-latency', type=float, default=8.0)
+    parser.add_argument('--example-latency', type=float, default=6.0)
+    args = parser.parse_args()
+
+    from bill_extractor import extract_bill_summary
+    from similarity_index import SimilarityIndex
+
+    random.seed(7)
+    layouts = [tariff_layout(tariff) for tariff in range(args.tariffs)]
+    accounts = [(random.randrange(100000000, 999999999), random.choice(layouts), random.uniform(80, 600))
+                for _ in range(args.accounts)]
+
+    index = SimilarityIndex(db_path=os.path.join(tempfile.mkdtemp(prefix='similar-bench-'), 'index.db'))
+    samples = []
+    previous = index.get_stats()
+    for month in range(args.months):
+        for consumer, layout, usual in accounts:
+            drift = random.uniform(1.5, 3) if random.random() < args.jump_share else random.uniform(0.95, 1.05)
+            text = bill_text(layout, consumer, month, round(usual * drift))
+            summary = extract_bill_summary(text)
+
+            started = time.perf_counter()
+            match = index.plan(text, 'gpt-4-bench', summary)
+            samples.append(time.perf_counter() - started)
+
+            if match['action'] == 'reuse':
+                index.record('reuse', samples[-1])
+                continue
+            latency = args.full_latency if match['action'] == 'miss' else args.example_latency
+            index.record(match['action'], latency)
+            index.add(text, 'gpt-4-bench', {'bill_summary': summary, 'recommendations': []})
+
+        stats = index.get_stats()
+        reused = (stats['reused'] - previous['reused']) / len(accounts)
+        examples = (stats['examples'] - previous['examples']) / len(accounts)
+        print(f'month {month + 1:2d}: {stats["entries"]:6,} indexed  reused {reused:6.1%}  '
+              f'example {examples:6.1%}  lookup {percentiles(samples[-len(accounts):])}')
+        previous = stats
+
+    stats = index.get_stats()
+    bills = stats['lookups']
+    full_cost = bills * args.full_latency
+    print(f'\n{bills:,} bills: {stats["reused"]:,} reused, {stats["examples"]:,} with an example, '
+          f'{stats["misses"]:,} full analyses')
+    print(f'LLM time {full_cost - stats["seconds_saved"]:,.0f} s instead of {full_cost:,.0f} s '
+          f'({stats["seconds_saved"] / full_cost:.1%} saved)')
+
+if __name__ == '__main__':
+    main()
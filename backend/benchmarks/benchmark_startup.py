@@ -0,0 +1,61 @@
+"""Measure cold-start time and memory of a service module.
+
+Each run imports the module in a fresh interpreter and reports wall time
+to finish the import plus peak RSS. --preload imports extra modules first,
+which reproduces the old pandas-at-import behaviour for a before/after
+comparison:
+
+    python benchmarks/benchmark_startup.py database_manager
+    python benchmarks/benchmark_startup.py database_manager --preload pandas
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, os, resource, sys, tempfile, time
+start = time.perf_counter()
+for name in sys.argv[2:]:
+    __import__(name)
+os.chdir(tempfile.mkdtemp())
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    rss //= 1024
+print(json.dumps({'seconds': elapsed, 'max_rss_kb': rss}))
+'''
+
+def measure(module, preload, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', PROBE, module] + preload,
+            cwd=BACKEND_DIR,
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get('PYTHONPATH')])))
+        )
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('module', nargs='?', default='database_manager')
+    parser.add_argument('--preload', nargs='*', default=[])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = measure(args.module, args.preload, args.runs)
+    seconds = [sample['seconds'] * 1000 for sample in samples]
+    rss = [sample['max_rss_kb'] / 1024 for sample in samples]
+    label = args.module + (f' (+ {", ".join(args.preload)})' if args.preload else '')
+    print(f'{label}: {args.runs} cold starts')
+    print(f'  import time  median {statistics.median(seconds):8.1f} ms   max {max(seconds):8.1f} ms')
+    print(f'  peak RSS     median {statistics.median(rss):8.1f} MB   max {max(rss):8.1f} MB')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Report file size and scan speed before and after the blob-store migration.
+
+Builds a database in the original layout (extracted_text and analysis_json
+inline in bills, raw_analysis inside the analysis) with --bills bills, of
+which --duplicate-share are re-uploads of an earlier bill. It then times
+the queries that scan bills, runs the schema migrations through
+BillDatabase, VACUUMs, and times them again.
+
+    python benchmarks/benchmark_storage.py --bills 200000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_database import SAMPLE_ANALYSIS, percentiles, time_reads
+
+# Schema as created before any migration ran
+LEGACY_SCHEMA = [
+    '''CREATE TABLE bills (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        file_url TEXT,
+        file_type TEXT,
+        extracted_text TEXT,
+        analysis_json TEXT,
+        total_amount REAL,
+        units_consumed REAL,
+        billing_period TEXT,
+        efficiency_rating TEXT
+    )''',
+    '''CREATE TABLE insights (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bill_id INTEGER,
+        insight_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        insight_type TEXT,
+        insight_text TEXT,
+        FOREIGN KEY (bill_id) REFERENCES bills (id)
+    )''',
+    '''CREATE TABLE trends (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        month_year TEXT,
+        total_consumption REAL,
+        total_cost REAL,
+        average_rate REAL,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )'''
+]
+
+SCAN_QUERIES = {
+    'trends full scan': '''
+        SELECT strftime('%Y-%m', upload_date), SUM(units_consumed), SUM(total_amount), COUNT(*)
+        FROM bills GROUP BY 1
+    ''',
+    'rating filter scan': "SELECT COUNT(*), AVG(total_amount) FROM bills WHERE efficiency_rating = 'poor'",
+    'insights join': '''
+        SELECT COUNT(*) FROM insights i JOIN bills b ON i.bill_id = b.id
+        WHERE b.total_amount > 5000
+    '''
+}
+
+def bill_text(amount, units):
+    """A few KB of bill text that differs per bill, like real extractions"""
+    lines = [
+        'STATE ELECTRICITY DISTRIBUTION CO. LTD',
+        f'Consumer No: {random.randint(1000000, 9999999)}',
+        f'Units Consumed (kWh): {units}',
+        f'Total Amount Payable: Rs. {amount}',
+        f'Meter Reading: {random.randint(1000, 90000)} / {random.randint(1000, 90000)}'
+    ]
+    lines += [f'Slab {slab}: {random.randint(1, 200)} units @ Rs. {slab + 2.5}' for slab in range(1, 6)]
+    lines += ['Terms and conditions apply. This is a computer generated bill.'] * 30
+    return '\n'.join(lines)
+
+def seed_legacy(conn, bills, duplicate_share, batch_size=20000):
+    start = datetime.now() - timedelta(days=730)
+    ratings = ['poor', 'average', 'good', 'excellent']
+    recent = []
+    remaining = bills
+    while remaining > 0:
+        count = min(batch_size, remaining)
+        bill_rows = []
+        insight_rows = []
+        for _ in range(count):
+            uploaded = (start + timedelta(seconds=random.randint(0, 730 * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+            if recent and random.random() < duplicate_share:
+                text, analysis_json, amount, units = random.choice(recent)
+            else:
+                amount = round(random.uniform(300, 16000), 2)
+                units = round(amount / 6.5, 1)
+                analysis = dict(SAMPLE_ANALYSIS, bill_summary=dict(SAMPLE_ANALYSIS['bill_summary'],
+                                                                   total_amount=f'₹{amount}'))
+                analysis['raw_analysis'] = json.dumps(analysis, indent=2)
+                text, analysis_json = bill_text(amount, units), json.dumps(analysis)
+                recent = (recent + [(text, analysis_json, amount, units)])[-100:]
+            bill_rows.append((uploaded, 'https://example.com/bill.pdf', 'pdf', text, analysis_json,
+                              amount, units, 'Jan 2024', random.choice(ratings)))
+        with conn:
+            first_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM bills').fetchone()[0] + 1
+            conn.executemany('''
+                INSERT INTO bills (upload_date, file_url, file_type, extracted_text, analysis_json,
+                                   total_amount, units_consumed, billing_period, efficiency_rating)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', bill_rows)
+            for offset, row in enumerate(bill_rows):
+                for text in SAMPLE_ANALYSIS['recommendations']:
+                    insight_rows.append((first_id + offset, row[0], 'recommendation', text))
+            conn.executemany('''
+                INSERT INTO insights (bill_id, insight_date, insight_type, insight_text)
+                VALUES (?, ?, ?, ?)
+            ''', insight_rows)
+        remaining -= count
+        print(f'  seeded {bills - remaining:,}/{bills:,} bills', end='\r', flush=True)
+    print()
+
+def table_bytes(conn, table):
+    """Bytes of pages owned by a table, via dbstat when SQLite has it"""
+    try:
+        return conn.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = ?', (table,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def report(label, conn, db_path, reads):
+    conn.execute('ANALYZE')
+    bills_bytes = table_bytes(conn, 'bills')
+    print(f'\n{label}: file {os.path.getsize(db_path) / 1e6:,.1f} MB'
+          + (f', bills table {bills_bytes / 1e6:,.1f} MB' if bills_bytes else ''))
+    for name, sql in SCAN_QUERIES.items():
+        print(f'  {name:<18}: {percentiles(time_reads(lambda: conn.execute(sql).fetchall(), reads))}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bills', type=int, default=200000)
+    parser.add_argument('--duplicate-share', type=float, default=0.1)
+    parser.add_argument('--reads', type=int, default=10)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='storage-bench-'), 'bench.db')
+    conn = sqlite3.connect(db_path)
+    for statement in LEGACY_SCHEMA:
+        conn.execute(statement)
+    print(f'Seeding {args.bills:,} bills in the original layout into {db_path}')
+    seed_legacy(conn, args.bills, args.duplicate_share)
+    report('Inline payloads', conn, db_path, args.reads)
+    conn.close()
+
+    from database_manager import BillDatabase
+
+    started = time.perf_counter()
+    db = BillDatabase(db_path)
+    migrated = time.perf_counter() - started
+    db.get_connection().execute('VACUUM')
+    stats = db.get_storage_stats()
+    print(f'\nMigrated in {migrated:,.1f} s; {stats["blob_references"]:,} payloads in {stats["blob_count"]:,} blobs, '
+          f'{stats["blob_raw_bytes"] / 1e6:,.1f} MB -> {stats["blob_stored_bytes"] / 1e6:,.1f} MB '
+          f'(x{stats["compression_ratio"]})')
+    report('Blob store', db.get_connection(), db_path, args.reads)
+    db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Compare the three-server setup against the single-process gateway.
+
+Scenarios (each run with --concurrency parallel clients for --requests bills):
+
+  legacy    POST analyze (5001) -> store (5002) -> post-to-erpnext (5003),
+            the way n8n drives the separate Flask dev servers today
+  gateway   the same three calls against the gateway, one process
+  pipeline  one POST /pipeline call to the gateway
+
+ERPNext posting is only included when --erpnext-url and credentials are
+given. mode=fast is the default so runs do not spend OpenAI credits; pass
+--mode full --openai-api-key ... (or point OpenAI at a mock) for LLM load.
+
+    python gateway.py &                         # or uvicorn gateway:app --workers 4
+    python bill_analyzer.py & python database_manager.py & python erpnext_integration.py &
+    python benchmarks/load_test.py --requests 500 --concurrency 16
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SAMPLE_BILL = '''STATE ELECTRICITY DISTRIBUTION CO. LTD
+Consumer No: 4001200
+Billing Period: 01-01-2024 to 31-01-2024
+Units Consumed (kWh): 245
+Rate per Unit: Rs. 6.50
+Total Amount Payable: Rs. 1,592.50
+'''
+
+_local = threading.local()
+
+def session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+def check(response):
+    response.raise_for_status()
+    return response.json()
+
+def three_hops(analyze_url, store_url, erp_url, args):
+    analyzed = check(session().post(f'{analyze_url}/analyze-bill', json={
+        'bill_text': SAMPLE_BILL, 'openai_api_key': args.openai_api_key or 'unused', 'mode': args.mode
+    }, timeout=args.timeout))
+    stored = check(session().post(f'{store_url}/store-analysis', json={
+        'file_url': 'https://example.com/bill.pdf', 'file_type': 'pdf',
+        'extracted_text': SAMPLE_BILL, 'analysis': analyzed['analysis']
+    }, timeout=args.timeout))
+    if args.erpnext_url:
+        check(session().post(f'{erp_url}/post-to-erpnext', json={
+            'erpnext_url': args.erpnext_url, 'api_key': args.erpnext_api_key,
+            'api_secret': args.erpnext_api_secret, 'bill_id': stored['bill_id'],
+            'analysis': analyzed['analysis']
+        }, timeout=args.timeout))
+
+def pipeline(gateway_url, args):
+    payload = {'bill_text': SAMPLE_BILL, 'mode': args.mode,
+               'file_url': 'https://example.com/bill.pdf', 'file_type': 'pdf'}
+    if args.openai_api_key:
+        payload['openai_api_key'] = args.openai_api_key
+    if args.erpnext_url:
+        payload.update({'erpnext_url': args.erpnext_url, 'erpnext_api_key': args.erpnext_api_key,
+                        'erpnext_api_secret': args.erpnext_api_secret})
+    check(session().post(f'{gateway_url}/pipeline', json=payload, timeout=args.timeout))
+
+def run(name, operation, args):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            operation()
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    if not latencies:
+        print(f'{name:<9} all {len(errors)} requests failed, e.g. {errors[0]}')
+        return
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'{name:<9} {len(latencies) / elapsed:8.1f} bills/s   '
+          f'p50 {statistics.median(latencies) * 1000:8.1f} ms   p99 {p99 * 1000:8.1f} ms   '
+          f'errors {len(errors)}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--gateway', default='http://localhost:5000')
+    parser.add_argument('--analyze', default='http://localhost:5001')
+    parser.add_argument('--store', default='http://localhost:5002')
+    parser.add_argument('--erpnext', default='http://localhost:5003')
+    parser.add_argument('--scenarios', nargs='+', default=['legacy', 'gateway', 'pipeline'])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--mode', default='fast', choices=['full', 'hybrid', 'fast'])
+    parser.add_argument('--openai-api-key', default=os.environ.get('OPENAI_API_KEY'))
+    parser.add_argument('--erpnext-url', default=None)
+    parser.add_argument('--erpnext-api-key', default=os.environ.get('ERP_API_KEY'))
+    parser.add_argument('--erpnext-api-secret', default=os.environ.get('ERP_API_SECRET'))
+    args = parser.parse_args()
+
+    print(f'{args.requests} bills, concurrency {args.concurrency}, mode {args.mode}, '
+          f'ERPNext {"on" if args.erpnext_url else "off"}')
+    scenarios = {
+        'legacy': lambda: three_hops(args.analyze, args.store, args.erpnext, args),
+        'gateway': lambda: three_hops(args.gateway, args.gateway, args.gateway, args),
+        'pipeline': lambda: pipeline(args.gateway, args)
+    }
+    for name in args.scenarios:
+        run(name, scenarios[name], args)
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,55 @@
-import openai
+import hashlib
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import re
+import textwrap
+from analysis_cache import AnalysisCache
+from client_registry import ClientRegistry
+from analysis_parser import IncrementalJSONParser, parse_analysis, summary_figures, validate_analysis
+from bill_extractor import extract_bill_summary, is_complete
+from instrumentation import init_app, instrument, metrics, timed
+from similarity_index import SimilarityIndex
+from llm_backends import ModelRouter, OpenAIBackend, backend_metrics, create_backend
+from prompt_compactor import PromptCompactor, count_tokens
+from rate_limiter import TokenBucket, is_rate_limit_error, backoff_delay
+from text_extractor import ExtractionError, TextExtractor, extract_xlsx_bills, file_type_for
 
 class ElectricityBillAnalyzer:
-    def __init__(self, api_key):
-        openai.api_key = api_key
-        self.analysis_prompt = """
+    # Bump whenever analysis_prompt changes so cached analyses are not reused
+    PROMPT_VERSION = "2"
+    # full: LLM fills every field; hybrid: bill_summary is read locally and the
+    # LLM only writes the narrative; fast: local extraction only, no LLM call
+    MODES = ("full", "hybrid", "fast")
+    # Bookkeeping keys that are only sent with the final streamed event
+    STREAM_SKIP_KEYS = ("error", "analysis_date", "raw_analysis", "figures", "validation_errors")
+
+    def __init__(self, api_key, model="gpt-4", temperature=0.3, cache=None,
+                 rate_limiter=None, max_retries=3, mode="full", token_budget=1500, similar=None,
+                 backend=None, router=None):
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {', '.join(self.MODES)}")
+        self.api_key = api_key
+        # Where completions are sent; see llm_backends.create_backend
+        self.backend = backend if backend is not None else OpenAIBackend(api_key)
+        # Optional ModelRouter: fast model first, strong model on failed validation
+        self.router = router
+        self.mode = mode
+        self.model = router.strong_model if router is not None else model
+        # Identifies which model(s) produce analyses, for cache keys
+        self.model_label = self.model if router is None else f"{router.fast_model}>{self.model}"
+        self.temperature = temperature
+        self.cache = cache
+        # SimilarityIndex of earlier analyses to reuse or show as an example;
+        # matches stay within one API key (stored hashed) and account
+        self.similar = similar
+        self.key_scope = hashlib.sha256((api_key or '').encode()).hexdigest()[:16]
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        # token_budget caps the bill text embedded in the prompt; 0 disables compaction
+        self.compactor = PromptCompactor(token_budget, model) if token_budget else None
+        self.analysis_prompt = textwrap.dedent("""
         You are an expert electricity bill analyzer. Analyze the following electricity bill data and provide comprehensive insights:
 
         BILL DATA:
@@ -49,70 +92,458 @@ class ElectricityBillAnalyzer:
         }}
         
         Make the analysis detailed, actionable, and easy to understand for homeowners.
-        """
+        """).strip()
+        self.insights_prompt = textwrap.dedent("""
+        You are an expert electricity bill analyzer. These bill figures were already extracted:
+        {bill_summary}
+
+        BILL DATA:
+        {bill_text}
+
+        Reply with JSON only, using these keys:
+        consumption_analysis (consumption_trend, peak_usage_period, efficiency_rating: poor/average/good/excellent),
+        cost_insights (cost_breakdown, hidden_charges, savings_potential),
+        recommendations (3 strings), anomalies (list of strings),
+        comparison_metrics (average_household_comparison, seasonal_factors),
+        action_items (list of strings).
+        """).strip()
+        self.example_prompt = textwrap.dedent("""
+        You are an expert electricity bill analyzer. This is the analysis of an earlier, similar bill:
+        {example}
+
+        Analyze the bill below the same way. Reply with JSON only, using the same keys, and update
+        every figure, rating and insight for this bill.
+
+        BILL DATA:
+        {bill_text}
+        """).strip()
     
-    def analyze_bill(self, bill_text):
-        """Analyze electricity bill using OpenAI GPT-4"""
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert electricity bill analyzer providing detailed insights."
-                    },
-                    {
-                        "role": "user",
-                        "content": self.analysis_prompt.format(bill_text=bill_text)
-                    }
-                ],
-                max_tokens=2000,
-                temperature=0.3
+    @instrument()
+    def analyze_bill(self, bill_text, account_id=None):
+        """Analyze electricity bill using OpenAI GPT-4; account_id scopes similar-bill matches"""
+        if self.mode == "fast":
+            return self.analyze_locally(bill_text)
+
+        cache_key, cached = self.lookup_cache(bill_text)
+        if cached is not None:
+            return cached
+
+        if self.similar is not None:
+            analysis = self.analyze_with_similar(bill_text, account_id)
+        elif self.mode == "hybrid":
+            analysis = self.request_hybrid_analysis(bill_text)
+        else:
+            analysis = self.request_analysis(bill_text)
+
+        if cache_key is not None and 'error' not in analysis:
+            self.cache.set(cache_key, analysis)
+
+        return analysis
+
+    def lookup_cache(self, bill_text):
+        """(cache key, cached analysis or None); both None without a cache.
+
+        A hit's usage reports no tokens or latency: the stored usage is that of
+        the call that produced the entry, and no call was made for this one.
+        """
+        if self.cache is None:
+            return None, None
+        cache_key = self.cache.make_key(bill_text, self.model_label,
+                                        f"{self.PROMPT_VERSION}-{self.mode}", self.temperature)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            usage = cached.get('usage') or {}
+            cached['usage'] = {
+                'cached': True,
+                'model': usage.get('model', self.model),
+                'backend': usage.get('backend'),
+                'tokens_in': 0,
+                'tokens_out': 0,
+                'latency_seconds': 0.0
+            }
+        return cache_key, cached
+
+    def similar_variant(self, account_id=None):
+        """Index partition for similar-bill matches.
+
+        Besides the model and prompt, it includes the API key and the account,
+        so one customer's analysis is never reused for, or shown as an example
+        to, another. Bills sent without an account_id match only each other.
+        """
+        return f"{self.model_label}-{self.PROMPT_VERSION}-{self.key_scope}-{account_id or ''}"
+
+    def analyze_with_similar(self, bill_text, account_id=None):
+        """Reuse, or prompt with, the nearest earlier analysis (see SimilarityIndex.plan)"""
+        started = time.perf_counter()
+        variant = self.similar_variant(account_id)
+        bill_summary = extract_bill_summary(bill_text)
+        match = self.similar.plan(bill_text, variant, bill_summary)
+
+        if match['action'] == 'reuse':
+            analysis = self.reuse_similar(match, bill_summary)
+            self.similar.record('reuse', time.perf_counter() - started)
+            return analysis
+
+        if match['action'] == 'example':
+            analysis = self.request_analysis(
+                bill_text, self.example_prompt, max_tokens=1500,
+                example=self.similar.example_json(match['analysis'])
             )
-            
-            analysis_text = response.choices[0].message.content
+            if 'error' not in analysis:
+                if self.mode == "hybrid" and is_complete(bill_summary):
+                    analysis['bill_summary'] = bill_summary
+                    analysis['figures'] = summary_figures(bill_summary)
+                analysis['analysis_source'] = 'example'
+                analysis['similar_to'] = {'entry_id': match['entry_id'], 'similarity': match['similarity']}
+        elif self.mode == "hybrid":
+            analysis = self.request_hybrid_analysis(bill_text)
+        else:
+            analysis = self.request_analysis(bill_text)
 
-            if "It seems like your message was empty" in analysis_text:
-                return {
-                    "error": "OpenAI did not return valid insights.",
-                    "raw_analysis": analysis_text,
-                    "analysis_date": datetime.now().isoformat()
-                }
-            
+        self.record_similar(match, bill_text, variant, analysis)
+        return analysis
+
+    def reuse_similar(self, match, bill_summary):
+        """The matched analysis with this bill's own figures"""
+        return dict(match['analysis'], bill_summary=bill_summary, figures=summary_figures(bill_summary),
+                    analysis_source='similar',
+                    similar_to={'entry_id': match['entry_id'], 'similarity': match['similarity']},
+                    analysis_date=datetime.now().isoformat())
+
+    def record_similar(self, match, bill_text, variant, analysis):
+        """Count the LLM call a plan() led to and index its analysis"""
+        usage = analysis.get('usage') or {}
+        self.similar.record(match['action'], usage.get('latency_seconds'), usage.get('tokens_in'))
+        if 'error' not in analysis:
+            self.similar.add(bill_text, variant, analysis)
+
+    def iter_analyze_bills(self, bill_texts, max_workers=4, account_ids=None):
+        """Analyze many bills concurrently, yielding (index, analysis) as each completes"""
+        bill_texts = list(bill_texts)
+        account_ids = account_ids or [None] * len(bill_texts)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {
+                executor.submit(self.analyze_bill, bill_text, account_id): index
+                for index, (bill_text, account_id) in enumerate(zip(bill_texts, account_ids))
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def analyze_bills(self, bill_texts, max_workers=4, account_ids=None):
+        """Analyze many bills concurrently and return analyses in input order"""
+        bill_texts = list(bill_texts)
+        results = [None] * len(bill_texts)
+        for index, analysis in self.iter_analyze_bills(bill_texts, max_workers, account_ids):
+            results[index] = analysis
+        return results
+
+    def create_completion(self, **kwargs):
+        """Rate-limited completion on the backend that retries 429s with jittered backoff"""
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
             try:
-                json_match = re.search(r'\{.*\}', analysis_text, re.DOTALL)
-                if json_match:
-                    analysis_json = json.loads(json_match.group())
-                else:
-                    analysis_json = self.parse_text_to_json(analysis_text)
-            except json.JSONDecodeError:
-                analysis_json = self.parse_text_to_json(analysis_text)
-            
-            analysis_json['analysis_date'] = datetime.now().isoformat()
-            analysis_json['raw_analysis'] = analysis_text
+                return self.backend.complete(**kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_rate_limit_error(e):
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+
+    def analyze_locally(self, bill_text):
+        """Fill bill_summary from the bill text without calling OpenAI"""
+        bill_summary = extract_bill_summary(bill_text)
+        if not bill_summary:
+            return {
+                'error': 'Could not extract bill fields locally.',
+                'analysis_date': datetime.now().isoformat()
+            }
+
+        return {
+            'bill_summary': bill_summary,
+            'figures': summary_figures(bill_summary),
+            'recommendations': [],
+            'anomalies': [],
+            'analysis_source': 'local',
+            'analysis_date': datetime.now().isoformat()
+        }
+
+    def request_hybrid_analysis(self, bill_text):
+        """Extract bill_summary locally and ask OpenAI only for the narrative insights"""
+        bill_summary = extract_bill_summary(bill_text)
+        if not is_complete(bill_summary):
+            return self.request_analysis(bill_text)
+
+        analysis = self.request_analysis(
+            bill_text, self.insights_prompt, max_tokens=1200,
+            bill_summary=json.dumps(bill_summary, ensure_ascii=False)
+        )
+        if 'error' not in analysis:
+            analysis['bill_summary'] = bill_summary
+            analysis['figures'] = summary_figures(bill_summary)
+            analysis['analysis_source'] = 'hybrid'
+        return analysis
+
+    def build_prompt(self, bill_text, template=None, **fields):
+        """Format a prompt around the compacted bill text; returns (prompt, compaction stats)"""
+        stats = {}
+        if self.compactor is not None:
+            bill_text, stats = self.compactor.compact(bill_text)
+        template = template or self.analysis_prompt
+        return template.format(bill_text=bill_text, **fields), stats
+
+    def request_analysis(self, bill_text, template=None, max_tokens=2000, model=None, **fields):
+        """Call the LLM backend for a fresh analysis, bypassing the cache.
+
+        Without an explicit model, a router (if any) picks one; see request_routed.
+        """
+        if model is None and self.router is not None:
+            return self.request_routed(bill_text, template, max_tokens, **fields)
+        model = model or self.model
+        prompt, compaction = self.build_prompt(bill_text, template, **fields)
+        try:
+            started = time.perf_counter()
+            with timed('llm_request', model=model):
+                response = self.create_completion(
+                    model=model,
+                    messages=self.build_messages(prompt),
+                    max_tokens=max_tokens,
+                    temperature=self.temperature
+                )
+            latency = time.perf_counter() - started
             
-            return analysis_json
+            analysis_text = response.choices[0].message.content
+            analysis = self.build_analysis(analysis_text, require_summary='bill_summary' not in fields)
+            analysis['usage'] = self.build_usage(
+                prompt, analysis_text, latency, compaction, getattr(response, 'usage', None), model
+            )
+            return analysis
             
         except Exception as e:
             return {
                 'error': str(e),
                 'analysis_date': datetime.now().isoformat()
             }
-    
-    def parse_text_to_json(self, text):
-        """Fallback method to structure text analysis"""
-        return {
-            'bill_summary': {
-                'analysis_text': text[:500] + '...' if len(text) > 500 else text
-            },
-            'recommendations': [
-                'Review the detailed analysis provided',
-                'Contact utility company for clarification if needed'
-            ],
-            'analysis_date': datetime.now().isoformat()
+
+    def request_routed(self, bill_text, template=None, max_tokens=2000, **fields):
+        """Try the router's model and fall back to the strong model if the reply fails validation"""
+        model = self.router.choose(bill_text)
+        analysis = self.request_analysis(bill_text, template, max_tokens, model=model, **fields)
+        return self.escalate_if_invalid(bill_text, model, analysis, template, max_tokens, **fields)
+
+    def escalate_if_invalid(self, bill_text, model, analysis, template=None, max_tokens=2000, **fields):
+        """analysis, or the strong model's redo of it if the router's model failed validation"""
+        if model == self.router.strong_model:
+            return analysis
+
+        # Hybrid prompts leave bill_summary to local extraction
+        problems = validate_analysis(analysis, require_summary='bill_summary' not in fields)
+        if not problems:
+            return analysis
+
+        self.router.record_escalation(problems)
+        escalated = self.request_analysis(bill_text, template, max_tokens, model=self.router.strong_model, **fields)
+        if 'usage' in escalated:
+            fast_usage = analysis.get('usage') or {}
+            escalated['usage']['escalated_from'] = {
+                'model': model,
+                'problems': problems,
+                'latency_seconds': fast_usage.get('latency_seconds'),
+                'tokens_in': fast_usage.get('tokens_in'),
+                'tokens_out': fast_usage.get('tokens_out')
+            }
+        return escalated
+
+    def build_usage(self, prompt, analysis_text, latency, compaction, api_usage=None, model=None):
+        """Tokens in/out and latency for one call; uses the API's counts when it sends them.
+
+        Also adds the call to the llm_tokens_* metrics.
+        """
+        field = lambda name: (api_usage.get(name) if isinstance(api_usage, dict)
+                              else getattr(api_usage, name, None))
+        tokens_in = field('prompt_tokens') if api_usage else None
+        tokens_out = field('completion_tokens') if api_usage else None
+        model = model or self.model
+        usage = {
+            'model': model,
+            'backend': getattr(self.backend, 'name', None),
+            'tokens_in': tokens_in if tokens_in is not None else count_tokens(prompt, model),
+            'tokens_out': tokens_out if tokens_out is not None else count_tokens(analysis_text or '', model),
+            'token_source': 'api' if tokens_in is not None else 'local',
+            'latency_seconds': round(latency, 3)
         }
+        usage.update(compaction)
+        metrics.inc('llm_tokens_total', usage['tokens_in'], model=model, direction='in')
+        metrics.inc('llm_tokens_total', usage['tokens_out'], model=model, direction='out')
+        metrics.set_gauge('llm_tokens_last_request', usage['tokens_in'] + usage['tokens_out'], model=model)
+        return usage
+
+    def build_messages(self, prompt):
+        return [
+            {
+                "role": "system",
+                "content": "You are an expert electricity bill analyzer providing detailed insights."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+    def build_analysis(self, analysis_text, require_summary=True):
+        """Turn the model's reply into the analysis dict.
+
+        Replies without a usable JSON object come back as an error with the
+        raw text attached; schema problems are listed in validation_errors.
+        """
+        if "It seems like your message was empty" in analysis_text:
+            return {
+                "error": "OpenAI did not return valid insights.",
+                "raw_analysis": analysis_text,
+                "analysis_date": datetime.now().isoformat()
+            }
+
+        parsed = parse_analysis(analysis_text, require_summary)
+        if parsed.analysis is None:
+            return {
+                "error": f"Could not parse the analysis: {'; '.join(parsed.problems)}",
+                "raw_analysis": analysis_text,
+                "analysis_date": datetime.now().isoformat()
+            }
+
+        analysis_json = parsed.analysis
+        if parsed.figures:
+            analysis_json['figures'] = parsed.figures
+        if parsed.problems:
+            analysis_json['validation_errors'] = parsed.problems
+        analysis_json['analysis_date'] = datetime.now().isoformat()
+        analysis_json['raw_analysis'] = analysis_text
+
+        return analysis_json
+
+    def analyze_bill_stream(self, bill_text, account_id=None):
+        """Stream the analysis, yielding each top-level section as soon as it is complete.
+
+        Takes the same path as analyze_bill: the cache, the similar-bill
+        index (a reused analysis is replayed without a call) and the router's
+        model choice. If the router's cheaper model fails validation, the
+        strong model redoes the analysis without streaming and its sections
+        are sent again.
+
+        Yields {'event': 'partial', 'key', 'value'} per section, then a final
+        {'event': 'complete' | 'error', 'analysis'}. Every event carries
+        'elapsed', seconds since the call started.
+        """
+        started = time.perf_counter()
+        event = lambda name, **fields: dict(fields, event=name, elapsed=round(time.perf_counter() - started, 3))
+        sections = lambda analysis: (event('partial', key=key, value=value) for key, value in analysis.items()
+                                     if key not in self.STREAM_SKIP_KEYS)
+
+        if self.mode == "fast":
+            analysis = self.analyze_locally(bill_text)
+            yield from sections(analysis)
+            yield event('error' if 'error' in analysis else 'complete', analysis=analysis)
+            return
+
+        cache_key, cached = self.lookup_cache(bill_text)
+        if cached is not None:
+            yield from sections(cached)
+            yield event('complete', analysis=cached)
+            return
+
+        local_summary = None
+        if self.similar is not None or self.mode == "hybrid":
+            local_summary = extract_bill_summary(bill_text)
+
+        match = None
+        if self.similar is not None:
+            variant = self.similar_variant(account_id)
+            match = self.similar.plan(bill_text, variant, local_summary)
+            if match['action'] == 'reuse':
+                analysis = self.reuse_similar(match, local_summary)
+                self.similar.record('reuse', time.perf_counter() - started)
+                if cache_key is not None:
+                    self.cache.set(cache_key, analysis)
+                yield from sections(analysis)
+                yield event('complete', analysis=analysis)
+                return
+
+        # The prompts analyze_with_similar and request_hybrid_analysis would use
+        bill_summary = local_summary if self.mode == "hybrid" and is_complete(local_summary) else None
+        template, fields, max_tokens = None, {}, 2000
+        if match is not None and match['action'] == 'example':
+            template, max_tokens = self.example_prompt, 1500
+            fields = {'example': self.similar.example_json(match['analysis'])}
+        elif bill_summary is not None:
+            template, max_tokens = self.insights_prompt, 1200
+            fields = {'bill_summary': json.dumps(bill_summary, ensure_ascii=False)}
+        if bill_summary is not None:
+            yield event('partial', key='bill_summary', value=bill_summary)
+
+        model = self.router.choose(bill_text) if self.router is not None else self.model
+        prompt, compaction = self.build_prompt(bill_text, template, **fields)
+        parser = IncrementalJSONParser()
+        chunks = []
+        try:
+            call_started = time.perf_counter()
+            stream = self.create_completion(
+                model=model,
+                messages=self.build_messages(prompt),
+                max_tokens=max_tokens,
+                temperature=self.temperature,
+                stream=True
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = getattr(chunk.choices[0].delta, 'content', None)
+                if not content:
+                    continue
+                chunks.append(content)
+                for key, value in parser.feed(content):
+                    if bill_summary is not None and key == 'bill_summary':
+                        continue
+                    yield event('partial', key=key, value=value)
+        except Exception as e:
+            analysis = {
+                'error': str(e),
+                'analysis_date': datetime.now().isoformat()
+            }
+            if match is not None:
+                self.record_similar(match, bill_text, variant, analysis)
+            yield event('error', analysis=analysis)
+            return
+
+        analysis_text = ''.join(chunks)
+        analysis = self.build_analysis(analysis_text, require_summary='bill_summary' not in fields)
+        analysis['usage'] = self.build_usage(
+            prompt, analysis_text, time.perf_counter() - call_started, compaction, model=model
+        )
+        if self.router is not None:
+            streamed = analysis
+            analysis = self.escalate_if_invalid(bill_text, model, analysis, template, max_tokens, **fields)
+            if analysis is not streamed:
+                yield from sections(analysis)
+        if 'error' not in analysis:
+            if bill_summary is not None:
+                analysis['bill_summary'] = bill_summary
+                analysis['figures'] = summary_figures(bill_summary)
+                analysis['analysis_source'] = 'hybrid'
+            if match is not None and match['action'] == 'example':
+                analysis['analysis_source'] = 'example'
+                analysis['similar_to'] = {'entry_id': match['entry_id'], 'similarity': match['similarity']}
+        if match is not None:
+            self.record_similar(match, bill_text, variant, analysis)
+        if cache_key is not None and 'error' not in analysis:
+            self.cache.set(cache_key, analysis)
+        yield event('error' if 'error' in analysis else 'complete', analysis=analysis)
     
-    def format_for_dashboard(self, analysis):
+    def close(self):
+        self.backend.close()
+
+    @staticmethod
+    def format_for_dashboard(analysis):
         """Format analysis for dashboard display"""
         if 'error' in analysis:
             return {
@@ -136,9 +567,47 @@ class ElectricityBillAnalyzer:
         
         return formatted
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 
 app = Flask(__name__)
+init_app(app, 'analyzer')
+analysis_cache = AnalysisCache()
+# Set SIMILAR_BILLS=1 to reuse earlier analyses of near-identical bills from
+# the same API key and account
+similarity_index = SimilarityIndex(
+    reuse_threshold=float(os.environ.get('SIMILAR_REUSE_THRESHOLD', 0.95)),
+    example_threshold=float(os.environ.get('SIMILAR_EXAMPLE_THRESHOLD', 0.75))
+) if os.environ.get('SIMILAR_BILLS', '0') != '0' else None
+openai_rate_limiter = TokenBucket(
+    rate=float(os.environ.get('OPENAI_REQUESTS_PER_SECOND', 2)),
+    capacity=float(os.environ.get('OPENAI_BURST', 5))
+)
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 8))
+# openai, openrouter, mock (in-process) or mock-server (mock_llm_server.py)
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'openai')
+LLM_BASE_URL = os.environ.get('LLM_BASE_URL') or None
+LLM_MODEL = os.environ.get('LLM_MODEL', 'gpt-4')
+# Set LLM_FAST_MODEL (e.g. gpt-4o-mini) to send short or simple bills there first
+model_router = ModelRouter(
+    os.environ['LLM_FAST_MODEL'], LLM_MODEL,
+    max_fast_tokens=int(os.environ.get('LLM_FAST_MAX_TOKENS', 1200))
+) if os.environ.get('LLM_FAST_MODEL') else None
+# Uploaded bills are read locally instead of through PDF.co; text is cached by file hash
+text_extractor = TextExtractor(
+    workers=int(os.environ.get('EXTRACT_WORKERS', 0)) or None,
+    cache=AnalysisCache(db_path='text_cache.db', max_entries=int(os.environ.get('TEXT_CACHE_SIZE', 5000)))
+)
+# One analyzer per (API key, mode), shared across requests and threads
+analyzer_registry = ClientRegistry(
+    lambda api_key, mode='full': ElectricityBillAnalyzer(
+        api_key, model=LLM_MODEL, cache=analysis_cache, rate_limiter=openai_rate_limiter, mode=mode,
+        similar=similarity_index, backend=create_backend(LLM_BACKEND, api_key, LLM_BASE_URL),
+        router=model_router
+    ),
+    max_size=int(os.environ.get('ANALYZER_REGISTRY_SIZE', 32)),
+    idle_timeout=int(os.environ.get('CLIENT_IDLE_TIMEOUT', 600)),
+    on_evict=lambda analyzer: analyzer.close()
+)
 
 @app.route('/analyze-bill', methods=['POST'])
 def analyze_bill_api():
@@ -146,22 +615,232 @@ def analyze_bill_api():
         data = request.json
         bill_text = data.get('bill_text')
         openai_api_key = data.get('openai_api_key')
+        mode = data.get('mode', 'full')
         
         if not bill_text or not openai_api_key:
             return jsonify({'error': 'bill_text and openai_api_key are required'}), 400
+        if mode not in ElectricityBillAnalyzer.MODES:
+            return jsonify({'error': f"mode must be one of {', '.join(ElectricityBillAnalyzer.MODES)}"}), 400
         
-        analyzer = ElectricityBillAnalyzer(openai_api_key)
-        analysis = analyzer.analyze_bill(bill_text)
-        formatted_analysis = analyzer.format_for_dashboard(analysis)
+        with analyzer_registry.hold(openai_api_key, mode=mode) as analyzer:
+            analysis = analyzer.analyze_bill(bill_text, data.get('account_id'))
+            formatted_analysis = analyzer.format_for_dashboard(analysis)
         
         return jsonify({
             'success': True,
             'analysis': analysis,
-            'formatted_analysis': formatted_analysis
+            'formatted_analysis': formatted_analysis,
+            'usage': analysis.get('usage'),
+            'cache': analysis_cache.get_stats()
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/analyze-bills', methods=['POST'])
+def analyze_bills_api():
+    """Stream one NDJSON line per bill as each analysis completes"""
+    try:
+        data = request.json
+        bills = data.get('bills')
+        openai_api_key = data.get('openai_api_key')
+        mode = data.get('mode', 'full')
+
+        if not bills or not openai_api_key:
+            return jsonify({'error': 'bills and openai_api_key are required'}), 400
+        if mode not in ElectricityBillAnalyzer.MODES:
+            return jsonify({'error': f"mode must be one of {', '.join(ElectricityBillAnalyzer.MODES)}"}), 400
+
+        bill_ids = []
+        bill_texts = []
+        account_ids = []
+        for index, bill in enumerate(bills):
+            if isinstance(bill, dict):
+                bill_ids.append(bill.get('bill_id', index))
+                bill_texts.append(bill.get('bill_text') or '')
+                account_ids.append(bill.get('account_id', data.get('account_id')))
+            else:
+                bill_ids.append(index)
+                bill_texts.append(bill)
+                account_ids.append(data.get('account_id'))
+
+        max_workers = min(int(data.get('max_workers', BATCH_MAX_WORKERS)), BATCH_MAX_WORKERS)
+
+        def generate():
+            # Held for the whole stream so eviction cannot close it mid-batch
+            with analyzer_registry.hold(openai_api_key, mode=mode) as analyzer:
+                for index, analysis in analyzer.iter_analyze_bills(bill_texts, max_workers, account_ids):
+                    yield json.dumps({
+                        'index': index,
+                        'bill_id': bill_ids[index],
+                        'success': 'error' not in analysis,
+                        'analysis': analysis,
+                        'formatted_analysis': analyzer.format_for_dashboard(analysis)
+                    }) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analyze-bill/stream', methods=['POST'])
+def analyze_bill_stream_api():
+    """Server-Sent Events: one event per analysis section, then 'complete'"""
+    try:
+        data = request.json
+        bill_text = data.get('bill_text')
+        openai_api_key = data.get('openai_api_key')
+        mode = data.get('mode', 'full')
+
+        if not bill_text or not openai_api_key:
+            return jsonify({'error': 'bill_text and openai_api_key are required'}), 400
+        if mode not in ElectricityBillAnalyzer.MODES:
+            return jsonify({'error': f"mode must be one of {', '.join(ElectricityBillAnalyzer.MODES)}"}), 400
+
+        def generate():
+            with analyzer_registry.hold(openai_api_key, mode=mode) as analyzer:
+                for event in analyzer.analyze_bill_stream(bill_text, data.get('account_id')):
+                    name = event.pop('event')
+                    if name == 'complete':
+                        event['formatted_analysis'] = analyzer.format_for_dashboard(event['analysis'])
+                    yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analyze-upload', methods=['POST'])
+def analyze_upload_api():
+    """Analyze an uploaded PDF, XLSX or text bill (multipart field 'file').
+
+    With stream=1 the response is Server-Sent Events: 'page' as each page
+    is extracted, bill_summary as soon as the pages so far contain it,
+    then the same events as /analyze-bill/stream.
+    """
+    try:
+        upload = request.files.get('file')
+        openai_api_key = request.form.get('openai_api_key')
+        mode = request.form.get('mode', 'full')
+        account_id = request.form.get('account_id')
+
+        if upload is None or not openai_api_key:
+            return jsonify({'error': 'file and openai_api_key are required'}), 400
+        if mode not in ElectricityBillAnalyzer.MODES:
+            return jsonify({'error': f"mode must be one of {', '.join(ElectricityBillAnalyzer.MODES)}"}), 400
+        file_type = request.form.get('file_type') or file_type_for(upload.filename, default=None)
+        if file_type not in TextExtractor.FILE_TYPES:
+            return jsonify({'error': f"file_type must be one of {', '.join(TextExtractor.FILE_TYPES)}"}), 400
+        data = upload.read()
+        if not data:
+            return jsonify({'error': 'file is empty'}), 400
+        if file_type == 'xlsx':
+            try:
+                bills = extract_xlsx_bills(data)
+            except ExtractionError as e:
+                return jsonify({'error': str(e)}), 422
+            if len(bills) > 1:
+                # Read as one bill, a history table would be stored as its grand total
+                return jsonify({'error': f'The workbook holds {len(bills)} bills, one per row; '
+                                         'ingest it with bulk_ingest.py'}), 422
+
+        if request.form.get('stream') != '1':
+            started = time.perf_counter()
+            try:
+                bill_text = text_extractor.extract(data, file_type)
+            except ExtractionError as e:
+                return jsonify({'error': str(e)}), 422
+            if not bill_text.strip():
+                return jsonify({'error': 'No text could be extracted from the file'}), 422
+            extraction = {
+                'file_type': file_type,
+                'chars': len(bill_text),
+                'seconds': round(time.perf_counter() - started, 3)
+            }
+            with analyzer_registry.hold(openai_api_key, mode=mode) as analyzer:
+                analysis = analyzer.analyze_bill(bill_text, account_id)
+                formatted_analysis = analyzer.format_for_dashboard(analysis)
+            return jsonify({
+                'success': 'error' not in analysis,
+                'analysis': analysis,
+                'formatted_analysis': formatted_analysis,
+                'usage': analysis.get('usage'),
+                'extraction': extraction,
+                'bill_text': bill_text
+            })
+
+        def generate():
+            started = time.perf_counter()
+            pages = []
+            summary_sent = False
+            try:
+                for number, text in text_extractor.iter_pages(data, file_type):
+                    pages.append(text)
+                    event = {'page': number + 1, 'chars': len(text), 'elapsed': round(time.perf_counter() - started, 3)}
+                    yield f"event: page\ndata: {json.dumps(event)}\n\n"
+                    if not summary_sent:
+                        # Totals are usually on the first page; show them before the rest is read
+                        bill_summary = extract_bill_summary('\n\n'.join(pages))
+                        if is_complete(bill_summary):
+                            summary_sent = True
+                            event = {'key': 'bill_summary', 'value': bill_summary, 'source': 'local',
+                                     'elapsed': round(time.perf_counter() - started, 3)}
+                            yield f"event: partial\ndata: {json.dumps(event)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'analysis': {'error': f'extraction failed: {e}'}})}\n\n"
+                return
+
+            bill_text = '\n\n'.join(pages)
+            if not bill_text.strip():
+                yield f"event: error\ndata: {json.dumps({'analysis': {'error': 'No text could be extracted from the file'}})}\n\n"
+                return
+            with analyzer_registry.hold(openai_api_key, mode=mode) as analyzer:
+                for event in analyzer.analyze_bill_stream(bill_text, account_id):
+                    name = event.pop('event')
+                    if name == 'complete':
+                        event['formatted_analysis'] = analyzer.format_for_dashboard(event['analysis'])
+                    yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    try:
+        return jsonify({
+            'cache': analysis_cache.get_stats(),
+            'similar': similarity_index.get_stats() if similarity_index is not None else None,
+            'extraction': text_extractor.get_stats(),
+            'clients': analyzer_registry.get_stats()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/llm-stats', methods=['GET'])
+def llm_stats():
+    """Per backend and model latency and error rate, plus routing counts"""
+    try:
+        return jsonify({
+            'backend': LLM_BACKEND,
+            'backends': backend_metrics.get_stats(),
+            'router': model_router.get_stats() if model_router is not None else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/cache-clear', methods=['POST'])
+def cache_clear():
+    try:
+        analysis_cache.clear()
+        if similarity_index is not None:
+            similarity_index.clear()
+        return jsonify({'success': True, 'message': 'Analysis cache and similar-bill index cleared'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
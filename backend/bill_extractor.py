@@ -0,0 +1,234 @@
+import calendar
+import re
+from datetime import date
+
+SUMMARY_FIELDS = ('billing_period', 'total_amount', 'units_consumed', 'rate_per_unit')
+
+NUMBER = r'(\d{1,3}(?:,\d{2,3})+(?:\.\d+)?|\d+(?:\.\d+)?)'
+CURRENCY = r'(?:₹|Rs\.?|INR|\$|€|£)'
+DATE = (
+    r'(?:\d{1,2}[-/.\s](?:\d{1,2}|[A-Za-z]{3,9})[-/.\s]\d{2,4}'
+    r'|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4}'
+    r'|\d{4}-\d{2}-\d{2})'
+)
+MONTH_YEAR = r'(?:[A-Za-z]{3,9}[-\s,]+\d{4}|\d{1,2}[-/]\d{4})'
+
+# Labels are tried in order, most specific first, so "Total Amount Payable"
+# wins over a "Total" line in the charges table.
+TOTAL_LABELS = [
+    r'total\s+amount\s+payable',
+    r'net\s+amount\s+payable',
+    r'amount\s+payable',
+    r'total\s+amount\s+due',
+    r'amount\s+due',
+    r'total\s+due',
+    r'net\s+payable',
+    r'bill\s+amount',
+    r'current\s+bill',
+    r'total\s+amount',
+    r'grand\s+total',
+    r'amount'
+]
+
+UNITS_LABELS = [
+    r'units?\s+consumed',
+    r'total\s+units',
+    r'net\s+units',
+    r'units?\s+billed',
+    r'energy\s+consumed',
+    r'consumption',
+    r'units'
+]
+
+RATE_LABELS = [
+    r'rate\s+per\s+unit',
+    r'per\s+unit\s+rate',
+    r'tariff\s+rate',
+    r'energy\s+charges?\s*@',
+    r'rate'
+]
+
+PERIOD_LABELS = [
+    r'billing\s+period',
+    r'bill\s+period',
+    r'billing\s+cycle',
+    r'period',
+    r'billing\s+month',
+    r'bill\s+month',
+    r'month'
+]
+
+def _lines(text):
+    return [line.strip() for line in (text or '').splitlines() if line.strip()]
+
+def _to_float(value):
+    try:
+        return float(value.replace(',', ''))
+    except (AttributeError, ValueError):
+        return None
+
+def _normalize_currency(symbol):
+    symbol = (symbol or '').strip()
+    if symbol.lower().startswith(('rs', 'inr')):
+        return '₹'
+    return symbol
+
+def _format_number(value):
+    return ('%.2f' % value).rstrip('0').rstrip('.')
+
+def _labelled_values(lines, labels, value_pattern):
+    """Yield values that follow a label on the same line or on the next line.
+
+    PDF.co text output often splits a label and its value into separate
+    columns, which come back as consecutive lines.
+    """
+    for label in labels:
+        label_re = re.compile(r'\b' + label + r'\b', re.IGNORECASE)
+        for index, line in enumerate(lines):
+            match = label_re.search(line)
+            if not match:
+                continue
+            rest = line[match.end():]
+            if re.match(r'\s*(?:date|no\b|number|#)', rest, re.IGNORECASE):
+                continue
+            value = re.search(value_pattern, rest, re.IGNORECASE)
+            if value:
+                yield value
+                continue
+            if index + 1 < len(lines):
+                value = re.match(r'\s*[:\-]?\s*' + value_pattern, lines[index + 1], re.IGNORECASE)
+                if value:
+                    yield value
+
+def extract_total_amount(lines):
+    pattern = r'[:\-\s]*(' + CURRENCY + r')?\s*' + NUMBER
+    for match in _labelled_values(lines, TOTAL_LABELS, pattern):
+        amount = _to_float(match.group(2))
+        if amount is not None:
+            return _normalize_currency(match.group(1)), amount
+    return None, None
+
+def extract_units(lines):
+    pattern = r'[:\-\s(]*(?:kwh\)?\s*[:\-]?\s*)?' + NUMBER + r'\s*(kwh|units?)?'
+    for match in _labelled_values(lines, UNITS_LABELS, pattern):
+        units = _to_float(match.group(1))
+        if units is not None:
+            return units
+
+    # Fall back to meter readings: present minus previous
+    present = next(_labelled_values(lines, [r'(?:present|current|closing)\s+reading'], r'[:\-\s]*' + NUMBER), None)
+    previous = next(_labelled_values(lines, [r'(?:previous|past|opening)\s+reading'], r'[:\-\s]*' + NUMBER), None)
+    if present and previous:
+        units = _to_float(present.group(1)) - _to_float(previous.group(1))
+        if units >= 0:
+            return units
+
+    for line in lines:
+        match = re.search(NUMBER + r'\s*kwh\b', line, re.IGNORECASE)
+        if match:
+            return _to_float(match.group(1))
+    return None
+
+def extract_rate(lines):
+    pattern = r'[:\-\s]*(?:' + CURRENCY + r')?\s*' + NUMBER
+    for match in _labelled_values(lines, RATE_LABELS, pattern):
+        rate = _to_float(match.group(1))
+        if rate is not None and rate < 1000:
+            return rate
+    return None
+
+def extract_billing_period(lines):
+    range_pattern = r'[:\-\s]*(?:from\s+)?(' + DATE + r')\s*(?:to|-|–|till|upto)\s*(' + DATE + r')'
+    for match in _labelled_values(lines, PERIOD_LABELS, range_pattern):
+        return '%s to %s' % (match.group(1).strip(), match.group(2).strip())
+
+    for line in lines:
+        match = re.search(r'(' + DATE + r')\s*(?:to|-|–)\s*(' + DATE + r')', line, re.IGNORECASE)
+        if match:
+            return '%s to %s' % (match.group(1).strip(), match.group(2).strip())
+
+    for match in _labelled_values(lines, PERIOD_LABELS, r'[:\-\s]*(' + MONTH_YEAR + r')'):
+        return match.group(1).strip()
+    return None
+
+def extract_bill_summary(bill_text):
+    """Read the bill_summary block directly from extracted bill text.
+
+    Returns only the fields that could be found; values are strings in the
+    same shape the LLM returns, e.g. {"total_amount": "₹1234.5"}.
+    """
+    lines = _lines(bill_text)
+    summary = {}
+
+    period = extract_billing_period(lines)
+    if period:
+        summary['billing_period'] = period
+
+    currency, amount = extract_total_amount(lines)
+    if amount is not None:
+        summary['total_amount'] = currency + _format_number(amount)
+
+    units = extract_units(lines)
+    if units is not None:
+        summary['units_consumed'] = _format_number(units) + ' kWh'
+
+    rate = extract_rate(lines)
+    if rate is None and amount is not None and units:
+        rate = amount / units
+    if rate is not None:
+        summary['rate_per_unit'] = (currency or '') + _format_number(rate) + '/kWh'
+
+    return summary
+
+def parse_figure(value):
+    """First number in a bill_summary value, e.g. "₹1,234.50" -> 1234.5"""
+    match = re.search(NUMBER, str(value or ''))
+    return _to_float(match.group(1)) if match else None
+
+# Dates inside a billing period, most specific first: 2024-03-31, 31-03-2024 /
+# 31 Mar 2024 (day first, as Indian bills print them), Mar 31, 2024
+PERIOD_DATES = [
+    (r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b', ('year', 'month', 'day')),
+    (r'\b(\d{1,2})[-/.\s](\d{1,2}|[A-Za-z]{3,9})\.?[-/.\s](\d{4}|\d{2})\b', ('day', 'month', 'year')),
+    (r'\b([A-Za-z]{3,9})\.?\s+(\d{1,2}),?\s+(\d{4})\b', ('month', 'day', 'year'))
+]
+PERIOD_MONTHS = [
+    (r'\b([A-Za-z]{3,9})[-\s,]+(\d{4})\b', ('month', 'year')),
+    (r'\b(\d{4})-(\d{1,2})\b', ('year', 'month')),
+    (r'\b(\d{1,2})[-/](\d{4})\b', ('month', 'year'))
+]
+MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(calendar.month_abbr) if name}
+
+def _period_parts(match, fields):
+    parts = dict(zip(fields, match.groups()))
+    month = parts['month']
+    month = int(month) if month.isdigit() else MONTH_NUMBERS.get(month[:3].lower())
+    year = int(parts['year'])
+    year += 2000 if year < 100 else 0
+    try:
+        return date(year, month, int(parts.get('day', 1)))
+    except (TypeError, ValueError):
+        return None
+
+def parse_billing_month(value):
+    """Month a billing_period covers, as year * 12 + month - 1, or None.
+
+    A range counts for the month of its midpoint, so 15 Mar - 14 Apr is
+    March and 01-04-2024 to 30-04-2024 is April.
+    """
+    text = str(value or '')
+    for pattern, fields in PERIOD_DATES:
+        dates = [day for day in (_period_parts(match, fields) for match in re.finditer(pattern, text)) if day]
+        if dates:
+            middle = date.fromordinal((dates[0].toordinal() + dates[-1].toordinal()) // 2)
+            return middle.year * 12 + middle.month - 1
+    for pattern, fields in PERIOD_MONTHS:
+        for match in re.finditer(pattern, text):
+            day = _period_parts(match, fields)
+            if day:
+                return day.year * 12 + day.month - 1
+    return None
+
+def is_complete(summary):
+    """True when every bill_summary field was extracted"""
+    return all(summary.get(field) for field in SUMMARY_FIELDS)
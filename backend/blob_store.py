@@ -0,0 +1,68 @@
+import hashlib
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed, content-addressed storage for the large text columns of bills.
+# Identical payloads (the same bill uploaded twice, repeated analyses) are
+# stored once; the codec is recorded per row so zlib and zstd rows can mix.
+BLOBS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS blobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hash TEXT UNIQUE,
+        codec TEXT,
+        raw_size INTEGER,
+        data BLOB
+    )
+'''
+
+DEFAULT_CODEC = 'zstd' if zstandard is not None else 'zlib'
+
+def compress(data, codec=DEFAULT_CODEC):
+    """Return (codec, payload); payloads that do not shrink are stored raw"""
+    if codec == 'zstd':
+        payload = zstandard.ZstdCompressor(level=6).compress(data)
+    elif codec == 'zlib':
+        payload = zlib.compress(data, 6)
+    else:
+        raise ValueError(f'Unknown codec {codec}')
+    if len(payload) >= len(data):
+        return 'raw', data
+    return codec, payload
+
+def decompress(codec, payload):
+    if codec == 'raw':
+        return bytes(payload)
+    if codec == 'zlib':
+        return zlib.decompress(payload)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('This blob is zstd-compressed; install zstandard to read it')
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f'Unknown codec {codec}')
+
+def store_blob(conn, text, codec=DEFAULT_CODEC):
+    """Store text once per distinct content and return its blob id (None for None)"""
+    if text is None:
+        return None
+    data = text.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    row = conn.execute('SELECT id FROM blobs WHERE hash = ?', (digest,)).fetchone()
+    if row:
+        return row[0]
+    used_codec, payload = compress(data, codec)
+    return conn.execute(
+        'INSERT INTO blobs (hash, codec, raw_size, data) VALUES (?, ?, ?, ?)',
+        (digest, used_codec, len(data), payload)
+    ).lastrowid
+
+def load_blob(conn, blob_id):
+    if blob_id is None:
+        return None
+    row = conn.execute('SELECT codec, data FROM blobs WHERE id = ?', (blob_id,)).fetchone()
+    if row is None:
+        return None
+    return decompress(row[0], row[1]).decode('utf-8')
@@ -0,0 +1,471 @@
+"""Submit many electricity bills to the pipeline at once, for customer backfills.
+
+Reads a manifest: a CSV or JSONL file with a file_url (or path) per bill
+and optional file_type and account_id, or a directory of bill files
+(PDF, XLSX, TXT, CSV). A local workbook holding a bill history (Year,
+Month and Amount columns, like Assets/E-Bill.xlsx) becomes one bill per
+row. Bills are validated concurrently through a bounded httpx pool and
+then submitted:
+
+- to the n8n webhook (--target n8n, the default), which is sent the file
+  URL like trigger_webhook.py, or
+- to the job queue (--target queue), which is sent the extracted text.
+  Local files can only go this way, and submission pauses while
+  --max-pending jobs are still waiting.
+
+Every outcome is recorded in --checkpoint, so an interrupted run can be
+started again with the same arguments and only sends what is left.
+
+    python bulk_ingest.py bills.csv --target queue --queue-url http://localhost:5004
+    python bulk_ingest.py ../Assets --target queue --account-id ACME-001
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from analysis_cache import AnalysisCache
+from instrumentation import TRACE_HEADER, new_trace_id
+from rate_limiter import backoff_delay
+from text_extractor import FILE_TYPES, TextExtractor, extract_xlsx_bills, file_type_for
+
+WEBHOOK_URL = 'https://electricity-insights.app.n8n.cloud/webhook-test/electricity-bill-upload'
+QUEUE_URL = 'http://localhost:5004'
+TARGETS = ('n8n', 'queue')
+# Manifest columns sent along with the bill
+PASS_THROUGH = ('account_id',)
+# Statuses worth retrying on submission; anything else 4xx is final
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def load_manifest(source, account_id=None):
+    """Bills to ingest from a CSV / JSONL manifest or a directory of bill files.
+
+    Each item has a key (its URL or absolute path, used for the checkpoint),
+    file_url or path, file_type and any PASS_THROUGH fields. Rows of a local
+    bill-history workbook are items of their own, keyed path#sheet!row,
+    with their bill_text and billing_period already filled in.
+    """
+    if os.path.isdir(source):
+        rows = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in FILE_TYPES and not name.startswith('~$'):
+                    rows.append({'path': os.path.join(root, name)})
+        rows.sort(key=lambda row: row['path'])
+    elif source.endswith('.jsonl'):
+        with open(source, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(source, newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.DictReader(f))
+
+    items = []
+    for number, row in enumerate(rows, 1):
+        file_url = (row.get('file_url') or '').strip()
+        path = (row.get('path') or '').strip()
+        if not file_url and not path:
+            raise ValueError(f'{source}: row {number} has neither file_url nor path')
+        if path:
+            path = os.path.abspath(path)
+        item = {
+            'key': file_url or path,
+            'file_url': file_url or None,
+            'path': path or None,
+            'file_type': (row.get('file_type') or '').strip().lower() or file_type_for(file_url or path)
+        }
+        for field in PASS_THROUGH:
+            value = row.get(field) or (account_id if field == 'account_id' else None)
+            if value:
+                item[field] = str(value)
+        items.extend(history_items(item) or [item])
+    return items
+
+def history_items(item):
+    """One item per bill of a local bill-history workbook; [] for anything else"""
+    if not item['path'] or item['file_type'] != 'xlsx' or not os.path.isfile(item['path']):
+        return []
+    try:
+        bills = extract_xlsx_bills(read_file(item['path']))
+    except Exception:
+        # Unreadable workbooks are reported by validation like any other bad file
+        return []
+    return [dict(item, key=f"{item['path']}#{bill['sheet']}!{bill['row']}", bill_text=bill['text'],
+                 billing_period=bill['billing_period'])
+            for bill in bills]
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+class IngestCheckpoint:
+    """Outcome of every bill already handled, keyed by URL or path.
+
+    submitted and invalid bills are skipped when a run is resumed; failed
+    ones are tried again.
+    """
+
+    def __init__(self, db_path='ingest_checkpoint.db'):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingested (
+                key TEXT PRIMARY KEY,
+                status TEXT,
+                job_id TEXT,
+                detail TEXT,
+                attempts INTEGER DEFAULT 0,
+                updated_at REAL
+            )
+        ''')
+        self.conn.commit()
+
+    def finished_keys(self, retry_invalid=False):
+        statuses = ('submitted',) if retry_invalid else ('submitted', 'invalid')
+        rows = self.conn.execute(
+            f"SELECT key FROM ingested WHERE status IN ({','.join('?' * len(statuses))})", statuses
+        )
+        return {row[0] for row in rows}
+
+    def record(self, key, status, job_id=None, detail=None):
+        with self.conn:
+            self.conn.execute('''
+                INSERT INTO ingested (key, status, job_id, detail, attempts, updated_at)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    status = excluded.status,
+                    job_id = excluded.job_id,
+                    detail = excluded.detail,
+                    attempts = attempts + 1,
+                    updated_at = excluded.updated_at
+            ''', (key, status, job_id, detail, time.time()))
+
+    def get_stats(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM ingested GROUP BY status').fetchall())
+
+    def close(self):
+        self.conn.close()
+
+class IngestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = Counter()
+        self.failures = Counter()
+        self.latencies = {'validate': [], 'submit': []}
+
+    def failed(self, status, reason):
+        self.counts[status] += 1
+        self.failures[reason] += 1
+
+    def processed(self):
+        return self.counts['submitted'] + self.counts['invalid'] + self.counts['failed']
+
+    def throughput(self):
+        return self.processed() / max(time.perf_counter() - self.started, 1e-9)
+
+    def progress_line(self, total):
+        return (f'{self.processed():,}/{total:,} bills  {self.throughput():.1f}/s  '
+                f'submitted {self.counts["submitted"]:,}  invalid {self.counts["invalid"]:,}  '
+                f'failed {self.counts["failed"]:,}  skipped {self.counts["skipped"]:,}')
+
+    def summary(self, total, top=10):
+        elapsed = time.perf_counter() - self.started
+        lines = [f'{self.processed():,} of {total:,} bills in {elapsed:.1f} s ({self.throughput():.1f}/s): '
+                 f'{self.counts["submitted"]:,} submitted, {self.counts["invalid"]:,} invalid, '
+                 f'{self.counts["failed"]:,} failed, {self.counts["skipped"]:,} already done']
+        for stage, samples in self.latencies.items():
+            if samples:
+                samples = sorted(samples)
+                pick = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))]
+                lines.append(f'{stage:<9} p50 {pick(0.50):.3f} s  p95 {pick(0.95):.3f} s  max {samples[-1]:.3f} s')
+        if self.failures:
+            lines.append('failures:')
+            lines += [f'{count:7,}  {reason}' for reason, count in self.failures.most_common(top)]
+        return '\n'.join(lines)
+
+class InvalidBill(Exception):
+    """The bill itself is unusable (bad URL, 404, no text); retrying will not help"""
+
+class BulkIngester:
+    """Validate and submit bills with bounded concurrency on both stages.
+
+    Validation and submission are joined by bounded queues, so a slow
+    target holds back validation instead of letting work pile up in memory.
+    """
+
+    def __init__(self, target='n8n', webhook_url=WEBHOOK_URL, queue_url=QUEUE_URL, checkpoint=None,
+                 validate_concurrency=32, submit_concurrency=4, max_pending=200, timeout=15,
+                 retries=3, max_bytes=20 * 1024 * 1024, mode=None, progress_interval=5.0, transport=None,
+                 extractor=None):
+        if target not in TARGETS:
+            raise ValueError(f"target must be one of {', '.join(TARGETS)}")
+        self.target = target
+        self.webhook_url = webhook_url
+        self.queue_url = queue_url.rstrip('/')
+        self.checkpoint = checkpoint
+        self.validate_concurrency = validate_concurrency
+        self.submit_concurrency = submit_concurrency
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retries = retries
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.progress_interval = progress_interval
+        self.transport = transport
+        self.extractor = extractor or TextExtractor()
+        self.stats = IngestStats()
+        # Job queue depth from the last poll, plus what was submitted since
+        self._pending = None
+        self._pending_lock = asyncio.Lock()
+
+    def run(self, items, retry_invalid=False):
+        return asyncio.run(self.ingest(items, retry_invalid))
+
+    async def ingest(self, items, retry_invalid=False):
+        finished = self.checkpoint.finished_keys(retry_invalid) if self.checkpoint else set()
+        to_validate = asyncio.Queue(maxsize=self.validate_concurrency * 2)
+        to_submit = asyncio.Queue(maxsize=self.submit_concurrency * 2)
+        limits = httpx.Limits(max_connections=self.validate_concurrency + self.submit_concurrency,
+                              max_keepalive_connections=self.validate_concurrency + self.submit_concurrency)
+
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout, follow_redirects=True,
+                                     transport=self.transport) as client:
+            validators = [asyncio.create_task(self.validate_worker(client, to_validate, to_submit))
+                          for _ in range(self.validate_concurrency)]
+            submitters = [asyncio.create_task(self.submit_worker(client, to_submit))
+                          for _ in range(self.submit_concurrency)]
+            reporter = asyncio.create_task(self.report(len(items)))
+            try:
+                for item in items:
+                    if item['key'] in finished:
+                        self.stats.counts['skipped'] += 1
+                        continue
+                    await to_validate.put(item)
+                for _ in validators:
+                    await to_validate.put(None)
+                await asyncio.gather(*validators)
+                for _ in submitters:
+                    await to_submit.put(None)
+                await asyncio.gather(*submitters)
+            finally:
+                reporter.cancel()
+                for task in validators + submitters:
+                    task.cancel()
+        return self.stats
+
+    async def report(self, total):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            print(self.stats.progress_line(total), flush=True)
+
+    def record(self, item, status, job_id=None, detail=None):
+        if self.checkpoint is not None:
+            self.checkpoint.record(item['key'], status, job_id, detail)
+
+    async def validate_worker(self, client, to_validate, to_submit):
+        while True:
+            item = await to_validate.get()
+            if item is None:
+                return
+            started = time.perf_counter()
+            try:
+                await self.validate(client, item)
+            except InvalidBill as e:
+                self.stats.failed('invalid', str(e))
+                self.record(item, 'invalid', detail=str(e))
+                continue
+            except Exception as e:
+                reason = f'{type(e).__name__}: {e}' if str(e) else type(e).__name__
+                self.stats.failed('failed', reason)
+                self.record(item, 'failed', detail=reason)
+                continue
+            finally:
+                self.stats.latencies['validate'].append(time.perf_counter() - started)
+            await to_submit.put(item)
+
+    async def validate(self, client, item):
+        """Check the bill can be fetched; for the queue target, also read its text"""
+        if item['path']:
+            if self.target != 'queue':
+                raise InvalidBill('local files need --target queue')
+            if item.get('bill_text'):
+                # A row of a bill-history workbook, read by load_manifest
+                return
+            if not os.path.isfile(item['path']):
+                raise InvalidBill('file not found')
+            if os.path.getsize(item['path']) > self.max_bytes:
+                raise InvalidBill('file too large')
+            data = await asyncio.to_thread(read_file, item['path'])
+        else:
+            if not item['file_url'].startswith(('http://', 'https://')):
+                raise InvalidBill('URL must start with http or https')
+            if self.target != 'queue':
+                await self.check_url(client, item['file_url'])
+                return
+            data = await self.download(client, item['file_url'])
+
+        if item['file_type'] == 'xlsx':
+            try:
+                bills = await asyncio.to_thread(extract_xlsx_bills, data)
+            except Exception as e:
+                raise InvalidBill(f'unreadable workbook: {e}')
+            if len(bills) > 1:
+                # Submitting the whole table as one bill would store its grand total
+                raise InvalidBill(f'workbook holds {len(bills)} bills, one per row; '
+                                  'download it and ingest the local file')
+            if bills:
+                item['bill_text'] = bills[0]['text']
+                return
+        try:
+            text = await asyncio.to_thread(self.extractor.extract, data, item['file_type'])
+        except ValueError as e:
+            raise InvalidBill(str(e))
+        if not text.strip():
+            raise InvalidBill('no text extracted')
+        item['bill_text'] = text
+
+    async def check_url(self, client, url):
+        response = await client.head(url)
+        if response.status_code in (403, 405, 501):
+            # Some file hosts refuse HEAD; ask for the first byte instead
+            async with client.stream('GET', url, headers={'Range': 'bytes=0-0'}) as response:
+                pass
+        if response.status_code >= 400:
+            raise InvalidBill(f'URL returned {response.status_code}')
+
+    async def download(self, client, url):
+        async with client.stream('GET', url) as response:
+            if response.status_code >= 400:
+                raise InvalidBill(f'URL returned {response.status_code}')
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise InvalidBill('file too large')
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    async def submit_worker(self, client, to_submit):
+        while True:
+            item = await to_submit.get()
+            if item is None:
+                return
+            started = time.perf_counter()
+            try:
+                job_id = await self.submit(client, item)
+            except Exception as e:
+                reason = f'{type(e).__name__}: {e}' if str(e) else type(e).__name__
+                self.stats.failed('failed', reason)
+                self.record(item, 'failed', detail=reason)
+            else:
+                self.stats.counts['submitted'] += 1
+                self.record(item, 'submitted', job_id)
+            finally:
+                self.stats.latencies['submit'].append(time.perf_counter() - started)
+                item.pop('bill_text', None)
+
+    async def submit(self, client, item):
+        """Send one bill, retrying rate limits and server errors; returns the job id if any"""
+        extra = {field: item[field] for field in PASS_THROUGH if item.get(field)}
+        if self.target == 'queue':
+            await self.wait_for_capacity(client)
+            url = f'{self.queue_url}/enqueue-bill'
+            payload = dict(extra, bill_text=item['bill_text'], file_url=item['file_url'] or item['path'],
+                           file_type=item['file_type'])
+            if item.get('billing_period'):
+                payload['billing_period'] = item['billing_period']
+            if self.mode:
+                payload['mode'] = self.mode
+        else:
+            url = self.webhook_url
+            payload = dict(extra, file_url=item['file_url'], file_type=item['file_type'])
+
+        # One trace id per bill, kept across retries, so its logs can be found later
+        headers = {TRACE_HEADER: new_trace_id()}
+        for attempt in range(self.retries + 1):
+            try:
+                response = await client.post(url, json=payload, headers=headers)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code < 300:
+                    if self.target == 'queue':
+                        self._pending = (self._pending or 0) + 1
+                    try:
+                        return response.json().get('job_id')
+                    except ValueError:
+                        return None
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    raise RuntimeError(f'{self.target} returned {response.status_code}')
+            await asyncio.sleep(backoff_delay(attempt))
+
+    async def wait_for_capacity(self, client, poll_interval=1.0):
+        """Hold submissions while the job queue has max_pending unfinished jobs"""
+        async with self._pending_lock:
+            while self._pending is None or self._pending >= self.max_pending:
+                response = await client.get(f'{self.queue_url}/jobs', params={'limit': 1})
+                response.raise_for_status()
+                counts = response.json().get('counts') or {}
+                self._pending = sum(counts.get(status, 0) for status in ('queued', 'retrying', 'running'))
+                if self._pending < self.max_pending:
+                    break
+                await asyncio.sleep(poll_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('manifest', help='CSV or JSONL manifest, or a directory of bill files')
+    parser.add_argument('--target', choices=TARGETS, default='n8n')
+    parser.add_argument('--webhook-url', default=os.environ.get('N8N_WEBHOOK_URL', WEBHOOK_URL))
+    parser.add_argument('--queue-url', default=os.environ.get('JOB_QUEUE_URL', QUEUE_URL))
+    parser.add_argument('--account-id', help='account_id for bills whose manifest row has none')
+    parser.add_argument('--mode', help='analysis mode for queued jobs (full, hybrid, fast)')
+    parser.add_argument('--checkpoint', default='ingest_checkpoint.db')
+    parser.add_argument('--retry-invalid', action='store_true', help='check bills marked invalid again')
+    parser.add_argument('--validate-concurrency', type=int, default=32)
+    parser.add_argument('--submit-concurrency', type=int, default=4)
+    parser.add_argument('--max-pending', type=int, default=200, help='job queue depth to wait at')
+    parser.add_argument('--timeout', type=float, default=15)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--progress-interval', type=float, default=5)
+    args = parser.parse_args()
+
+    items = load_manifest(args.manifest, args.account_id)
+    checkpoint = IngestCheckpoint(args.checkpoint)
+    ingester = BulkIngester(
+        target=args.target,
+        webhook_url=args.webhook_url,
+        queue_url=args.queue_url,
+        checkpoint=checkpoint,
+        validate_concurrency=args.validate_concurrency,
+        submit_concurrency=args.submit_concurrency,
+        max_pending=args.max_pending,
+        timeout=args.timeout,
+        retries=args.retries,
+        mode=args.mode,
+        progress_interval=args.progress_interval,
+        extractor=TextExtractor(cache=AnalysisCache(db_path='text_cache.db'))
+    )
+    print(f'{len(items):,} bills in {args.manifest}; checkpoint {args.checkpoint} {checkpoint.get_stats()}')
+    try:
+        stats = ingester.run(items, args.retry_invalid)
+    except KeyboardInterrupt:
+        print('\nInterrupted; run the same command again to resume.')
+        stats = ingester.stats
+    finally:
+        checkpoint.close()
+        ingester.extractor.close()
+    print(stats.summary(len(items)))
+    sys.exit(1 if stats.counts['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
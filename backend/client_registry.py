@@ -0,0 +1,136 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class ClientRegistry:
+    """Bounded, credential-keyed cache of long-lived client objects.
+
+    hold() yields the client built for the same arguments last time, so
+    requests that carry the same credentials share one instance (and its
+    HTTP connection pool). Clients are reference-counted while held: least
+    recently used clients are evicted once max_size is reached, and clients
+    unused for idle_timeout seconds are dropped on the next lookup, but only
+    when no caller holds them. on_evict is called with each evicted client,
+    e.g. to close its session.
+    """
+
+    def __init__(self, factory, max_size=32, idle_timeout=600, on_evict=None):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        # key -> [client, last used, users, detached by clear()]
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(args, kwargs):
+        # Hash so raw credentials are never kept as dictionary keys
+        material = json.dumps([args, sorted(kwargs.items())], default=str)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    @contextmanager
+    def hold(self, *args, **kwargs):
+        """The client for these arguments, kept open (not evicted) until the block ends"""
+        key = self.make_key(args, kwargs)
+        now = time.monotonic()
+        evicted = []
+
+        with self._lock:
+            evicted.extend(self._pop_idle(now))
+            entry = self._clients.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry[1] = now
+                entry[2] += 1
+                self._clients.move_to_end(key)
+            else:
+                self.misses += 1
+
+        if entry is None:
+            # Build outside the lock; if two threads race, the first one stored wins
+            new_client = self.factory(*args, **kwargs)
+            with self._lock:
+                entry = self._clients.get(key)
+                if entry is None:
+                    entry = self._clients[key] = [new_client, now, 1, False]
+                    evicted.extend(self._pop_unused())
+                else:
+                    entry[1] = now
+                    entry[2] += 1
+                    self._clients.move_to_end(key)
+                    evicted.append(new_client)
+
+        for stale in evicted:
+            self._evict(stale)
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] = time.monotonic()
+                entry[2] -= 1
+                evicted = self._pop_unused()
+                if entry[3] and entry[2] == 0:
+                    evicted.append(entry[0])
+            for stale in evicted:
+                self._evict(stale)
+
+    def _pop_unused(self):
+        """Drop least recently used clients nobody holds until max_size are left"""
+        evicted = []
+        for key in list(self._clients):
+            if len(self._clients) <= self.max_size:
+                break
+            if self._clients[key][2] == 0:
+                evicted.append(self._clients.pop(key)[0])
+        return evicted
+
+    def _pop_idle(self, now):
+        if not self.idle_timeout:
+            return []
+        idle = [key for key, (_, last_used, users, _) in self._clients.items()
+                if users == 0 and now - last_used > self.idle_timeout]
+        return [self._clients.pop(key)[0] for key in idle]
+
+    def _evict(self, client):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(client)
+            except Exception:
+                pass
+
+    def evict_idle(self):
+        with self._lock:
+            evicted = self._pop_idle(time.monotonic())
+        for client in evicted:
+            self._evict(client)
+        return len(evicted)
+
+    def clear(self):
+        """Forget every client; ones still held are evicted when their last holder is done"""
+        with self._lock:
+            evicted = []
+            for entry in self._clients.values():
+                if entry[2] == 0:
+                    evicted.append(entry[0])
+                else:
+                    entry[3] = True
+            self._clients.clear()
+        for client in evicted:
+            self._evict(client)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._clients),
+                'in_use': sum(1 for entry in self._clients.values() if entry[2]),
+                'max_size': self.max_size,
+                'idle_timeout': self.idle_timeout,
+                'hits': self.hits,
+                'misses': self.misses
+            }
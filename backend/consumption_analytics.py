@@ -0,0 +1,290 @@
+import threading
+
+import numpy as np
+
+# Bills ordered so each account's history is one contiguous, chronological
+# run; DENSE_RANK turns account ids into array-friendly integer codes. A bill's
+# month is the one its billing period covers, or its upload month when the
+# period could not be parsed
+LOAD_SQL = '''
+    SELECT id,
+           DENSE_RANK() OVER (ORDER BY account_id) - 1,
+           COALESCE(billing_month,
+                    CAST(strftime('%Y', upload_date) AS INTEGER) * 12
+                    + CAST(strftime('%m', upload_date) AS INTEGER) - 1) AS month,
+           total_amount,
+           units_consumed
+    FROM bills
+    ORDER BY account_id, month, id
+'''
+
+ACCOUNTS_SQL = 'SELECT DISTINCT account_id FROM bills ORDER BY account_id'
+
+FLAG_UNITS = 1
+FLAG_AMOUNT = 2
+FLAG_RATE = 4
+FLAG_SEASONAL = 8
+
+FLAG_REASONS = {
+    FLAG_UNITS: 'units',
+    FLAG_AMOUNT: 'amount',
+    FLAG_RATE: 'rate',
+    FLAG_SEASONAL: 'seasonal'
+}
+
+def group_starts(keys):
+    """For sorted keys, the index where each element's run of equal keys begins"""
+    starts = np.flatnonzero(np.diff(keys, prepend=keys[:1] - 1))
+    return np.repeat(starts, np.diff(starts, append=len(keys)))
+
+def prefix_sums(values, dtype=np.float64):
+    """Running totals with a leading zero, so sums[j] - sums[i] == values[i:j].sum()"""
+    sums = np.empty(len(values) + 1, dtype=dtype)
+    sums[0] = 0
+    np.cumsum(values, out=sums[1:])
+    return sums
+
+def trailing_stats(values, lo, hi=None):
+    """Mean, sample std and count of values[lo[i]:hi[i]] for every i, NaNs skipped.
+
+    Uses prefix sums, so all windows cost one pass whatever their length;
+    hi defaults to i itself (every earlier row of the window). Values are
+    shifted by their mean first to keep the sums of squares small.
+    """
+    missing = np.isnan(values)
+    shift = 0.0 if missing.all() else np.nanmean(values)
+    filled = values - shift
+    filled[missing] = 0.0
+    sums = prefix_sums(filled)
+    np.square(filled, out=filled)
+    squares = prefix_sums(filled)
+    np.logical_not(missing, out=missing)
+    counts = prefix_sums(missing, dtype=np.int64)
+
+    pick = (lambda sums: sums[:-1]) if hi is None else (lambda sums: sums[hi])
+    n = pick(counts) - counts[lo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = pick(sums) - sums[lo]
+        mean /= n
+        variance = pick(squares) - squares[lo]
+        variance -= n * mean * mean
+        variance /= n - 1
+        np.maximum(variance, 0.0, out=variance)
+    mean += shift
+    return mean, np.sqrt(variance, out=variance), n
+
+def robust_scores(values):
+    """Modified z-scores (median / MAD) against the whole population"""
+    valid = values[~np.isnan(values)]
+    if not len(valid):
+        return np.full(len(values), np.nan)
+    median = np.median(valid)
+    mad = np.median(np.abs(valid - median))
+    if mad == 0:
+        return np.zeros(len(values))
+    return 0.6745 * (values - median) / mad
+
+class ConsumptionAnalytics:
+    """Statistical anomaly flags for every stored bill, without an LLM call.
+
+    Bills are loaded once into contiguous NumPy columns and scored in a
+    single vectorized pass:
+
+      units / amount  z-score against the account's previous `window` bills
+      rate            modified z-score of log(amount / units) over all bills
+      seasonal        relative change against the account's earlier bills
+                      from the same calendar month
+
+    Bills are placed in the month their billing period covers, falling back
+    to the upload month. Bills without an account_id are scored together as
+    one account.
+    Results are cached until the database changes.
+    """
+
+    def __init__(self, db, window=6, min_history=3, z_threshold=3.0, rate_threshold=3.5,
+                 seasonal_threshold=0.5):
+        self.db = db
+        self.window = window
+        self.min_history = min_history
+        self.z_threshold = z_threshold
+        self.rate_threshold = rate_threshold
+        self.seasonal_threshold = seasonal_threshold
+        self._cache = None
+        self._cache_version = None
+        self._lock = threading.Lock()
+
+    def load_columns(self, chunk_size=200000):
+        """Columns of every bill; with a sharded database, each shard is read in parallel"""
+        parts = self.db.map_shards(lambda database: self.load_shard(database, chunk_size))
+        if len(parts) == 1:
+            return parts[0]
+
+        # Shards hold different accounts, so offsetting each shard's account
+        # codes keeps every account one contiguous, sorted run
+        offsets = np.cumsum([0] + [len(part['accounts']) for part in parts[:-1]])
+        join = lambda key: np.concatenate([part[key] for part in parts]) if parts else np.empty(0)
+        return {
+            'bill_id': join('bill_id').astype(np.int64),
+            'account': np.concatenate([part['account'] + offset for part, offset in zip(parts, offsets)])
+                       if parts else np.empty(0, dtype=np.int64),
+            'month': join('month').astype(np.int64),
+            'amount': join('amount'),
+            'units': join('units'),
+            'accounts': [account for part in parts for account in part['accounts']]
+        }
+
+    def load_shard(self, database, chunk_size=200000):
+        conn = database.get_connection()
+        with conn:
+            # One read transaction: the count, the rows and the account list
+            # come from the same snapshot even while bills are being stored
+            conn.execute('BEGIN')
+            total = conn.execute('SELECT COUNT(*) FROM bills').fetchone()[0]
+            numbers = np.empty((total, 5), dtype=np.float64)
+
+            cursor = conn.execute(LOAD_SQL)
+            filled = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                # None becomes NaN in a float array
+                numbers[filled:filled + len(rows)] = np.array(rows, dtype=np.float64)
+                filled += len(rows)
+            numbers = numbers[:filled]
+            accounts = [row[0] for row in conn.execute(ACCOUNTS_SQL)]
+
+        return {
+            'bill_id': numbers[:, 0].astype(np.int64),
+            'account': numbers[:, 1].astype(np.int64),
+            'month': numbers[:, 2].astype(np.int64),
+            'amount': numbers[:, 3].copy(),
+            'units': numbers[:, 4].copy(),
+            'accounts': accounts
+        }
+
+    def compute(self, columns):
+        """Score every bill; columns must be sorted by account, then month"""
+        account = columns['account']
+        month = columns['month']
+        amount = columns['amount']
+        units = columns['units']
+        index = np.arange(len(units))
+
+        starts = group_starts(account)
+        lo = np.maximum(starts, index - self.window)
+        units_mean, units_std, units_n = trailing_stats(units, lo)
+        amount_mean, amount_std, amount_n = trailing_stats(amount, lo)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            units_z = np.where((units_n >= self.min_history) & (units_std > 0),
+                               (units - units_mean) / units_std, np.nan)
+            amount_z = np.where((amount_n >= self.min_history) & (amount_std > 0),
+                                (amount - amount_mean) / amount_std, np.nan)
+            rate = np.where(units > 0, amount / units, np.nan)
+            rate_score = robust_scores(np.log(np.where(rate > 0, rate, np.nan)))
+
+        # Same calendar month in earlier years: regroup by (account, month of
+        # year) keeping chronological order, and stop each window before
+        # bills from the same billing month
+        season_key = account * 12 + month % 12
+        order = np.argsort(season_key, kind='stable')
+        sorted_key = season_key[order]
+        season_lo = group_starts(sorted_key)
+        season_hi = group_starts(sorted_key * (int(month.max(initial=0)) + 1) + month[order])
+        season_mean, _, season_n = trailing_stats(units[order], season_lo, season_hi)
+        seasonal_baseline = np.empty_like(units)
+        seasonal_baseline[order] = np.where(season_n > 0, season_mean, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            seasonal_deviation = np.where(seasonal_baseline > 0,
+                                          (units - seasonal_baseline) / seasonal_baseline, np.nan)
+
+        flags = np.zeros(len(units), dtype=np.int8)
+        with np.errstate(invalid='ignore'):
+            flags[np.abs(units_z) > self.z_threshold] |= FLAG_UNITS
+            flags[np.abs(amount_z) > self.z_threshold] |= FLAG_AMOUNT
+            flags[np.abs(rate_score) > self.rate_threshold] |= FLAG_RATE
+            flags[np.abs(seasonal_deviation) > self.seasonal_threshold] |= FLAG_SEASONAL
+
+        return {
+            'units_baseline': np.where(units_n > 0, units_mean, np.nan),
+            'units_z': units_z,
+            'amount_baseline': np.where(amount_n > 0, amount_mean, np.nan),
+            'amount_z': amount_z,
+            'rate': rate,
+            'rate_score': rate_score,
+            'seasonal_baseline': seasonal_baseline,
+            'seasonal_deviation': seasonal_deviation,
+            'flags': flags
+        }
+
+    def refresh(self):
+        """Columns and scores for the current data, recomputed only after writes"""
+        version = self.db.data_version()
+        with self._lock:
+            if self._cache is None or self._cache_version != version:
+                columns = self.load_columns()
+                self._cache = (columns, self.compute(columns))
+                self._cache_version = version
+            return self._cache
+
+    def describe(self, columns, scores, position):
+        value = lambda array: None if np.isnan(array[position]) else round(float(array[position]), 4)
+        flags = int(scores['flags'][position])
+        month = int(columns['month'][position])
+        return {
+            'bill_id': int(columns['bill_id'][position]),
+            'account_id': columns['accounts'][columns['account'][position]],
+            'month': f'{month // 12:04d}-{month % 12 + 1:02d}',
+            'units': value(columns['units']),
+            'amount': value(columns['amount']),
+            'rate': value(scores['rate']),
+            'units_baseline': value(scores['units_baseline']),
+            'units_z': value(scores['units_z']),
+            'amount_baseline': value(scores['amount_baseline']),
+            'amount_z': value(scores['amount_z']),
+            'rate_score': value(scores['rate_score']),
+            'seasonal_baseline': value(scores['seasonal_baseline']),
+            'seasonal_deviation': value(scores['seasonal_deviation']),
+            'reasons': [reason for flag, reason in FLAG_REASONS.items() if flags & flag]
+        }
+
+    def get_anomalies(self, account_id=None, reasons=None, limit=100):
+        """Flagged bills, most extreme first, optionally for one account or reasons"""
+        columns, scores = self.refresh()
+        mask = scores['flags'] != 0
+        if reasons:
+            wanted = 0
+            for flag, reason in FLAG_REASONS.items():
+                if reason in reasons:
+                    wanted |= flag
+            mask &= (scores['flags'] & wanted) != 0
+        if account_id is not None:
+            if account_id not in columns['accounts']:
+                return {'bills_scored': len(columns['bill_id']), 'flagged': 0, 'counts': {}, 'anomalies': []}
+            mask &= columns['account'] == columns['accounts'].index(account_id)
+
+        positions = np.flatnonzero(mask)
+        with np.errstate(invalid='ignore'):
+            severity = np.nanmax(np.abs(np.vstack([
+                scores['units_z'][positions] / self.z_threshold,
+                scores['amount_z'][positions] / self.z_threshold,
+                scores['rate_score'][positions] / self.rate_threshold,
+                scores['seasonal_deviation'][positions] / self.seasonal_threshold
+            ])), axis=0) if len(positions) else np.array([])
+        top = positions[np.argsort(-severity, kind='stable')[:limit]]
+
+        return {
+            'bills_scored': len(columns['bill_id']),
+            'flagged': len(positions),
+            'counts': {reason: int(np.count_nonzero(scores['flags'][positions] & flag))
+                       for flag, reason in FLAG_REASONS.items()},
+            'anomalies': [self.describe(columns, scores, position) for position in top]
+        }
+
+    def get_bill_scores(self, bill_id):
+        columns, scores = self.refresh()
+        positions = np.flatnonzero(columns['bill_id'] == bill_id)
+        if not len(positions):
+            return None
+        return self.describe(columns, scores, positions[0])
@@ -1,16 +1,369 @@
 import sqlite3
+import base64
+import hashlib
 import json
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-import pandas as pd
+from bill_extractor import parse_billing_month, parse_figure
+from blob_store import BLOBS_TABLE_SQL, load_blob, store_blob
+from instrumentation import init_app, instrument, traced
+
+# Full-scan aggregation that the trends rollup must always agree with;
+# bills without an account roll up under ''
+TRENDS_FULL_SCAN_SQL = '''
+    SELECT
+        COALESCE(account_id, '') as account_id,
+        strftime('%Y-%m', upload_date) as month_year,
+        COALESCE(SUM(units_consumed), 0) as total_consumption,
+        COALESCE(SUM(total_amount), 0) as total_cost,
+        COUNT(*) as bill_count,
+        COUNT(total_amount) as cost_count,
+        COUNT(units_consumed) as consumption_count
+    FROM bills
+    GROUP BY COALESCE(account_id, ''), strftime('%Y-%m', upload_date)
+'''
+
+TRENDS_REBUILD_SQL = '''
+    INSERT INTO trends (account_id, month_year, total_consumption, total_cost, bill_count,
+                        cost_count, consumption_count, average_rate)
+    SELECT account_id, month_year, total_consumption, total_cost, bill_count, cost_count, consumption_count,
+           total_cost / NULLIF(total_consumption, 0)
+    FROM ({})
+'''.format(TRENDS_FULL_SCAN_SQL)
+
+# The month-only rollup used by migrations 2 and 6, before trends had account_id
+MONTHLY_TRENDS_REBUILD_SQL = '''
+    INSERT INTO trends (month_year, total_consumption, total_cost, bill_count,
+                        cost_count, consumption_count, average_rate)
+    SELECT strftime('%Y-%m', upload_date),
+           COALESCE(SUM(units_consumed), 0), COALESCE(SUM(total_amount), 0), COUNT(*),
+           COUNT(total_amount), COUNT(units_consumed),
+           COALESCE(SUM(total_amount), 0) / NULLIF(COALESCE(SUM(units_consumed), 0), 0)
+    FROM bills
+    GROUP BY strftime('%Y-%m', upload_date)
+'''
+
+def move_payloads_to_blobs(conn, batch_size=2000):
+    """Migration step: copy extracted_text / analysis_json of every bill into
+    the blob store (raw_analysis split out of the analysis) and index the
+    text in the contentless bills_fts."""
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, extracted_text, analysis_json FROM bills
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        for bill_id, extracted_text, analysis_json in rows:
+            analysis = json.loads(analysis_json) if analysis_json else None
+            raw_analysis = analysis.pop('raw_analysis', None) if isinstance(analysis, dict) else None
+            conn.execute('''
+                UPDATE bills SET text_blob_id = ?, analysis_blob_id = ?, raw_analysis_blob_id = ?
+                WHERE id = ?
+            ''', (
+                store_blob(conn, extracted_text),
+                store_blob(conn, json.dumps(analysis)) if analysis is not None else None,
+                store_blob(conn, raw_analysis),
+                bill_id
+            ))
+            conn.execute('INSERT INTO bills_fts (rowid, extracted_text) VALUES (?, ?)',
+                         (bill_id, extracted_text or ''))
+        last_id = rows[-1][0]
+
+def drop_inline_payloads(conn):
+    """Migration step: drop the inline payload columns (SQLite 3.35+), or empty them on older SQLite"""
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        conn.execute('ALTER TABLE bills DROP COLUMN extracted_text')
+        conn.execute('ALTER TABLE bills DROP COLUMN analysis_json')
+    else:
+        conn.execute('UPDATE bills SET extracted_text = NULL, analysis_json = NULL')
+
+def reparse_bill_figures(conn, batch_size=2000):
+    """Migration step: re-read total_amount / units_consumed from each stored
+    analysis. Amounts with thousands separators ("1,234.50") used to be
+    stored as 1.0; the trends rollup is rebuilt from the corrected values."""
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, analysis_blob_id, total_amount, units_consumed FROM bills
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        for bill_id, analysis_blob_id, total_amount, units_consumed in rows:
+            analysis_json = load_blob(conn, analysis_blob_id)
+            analysis = json.loads(analysis_json) if analysis_json else None
+            summary = analysis.get('bill_summary') if isinstance(analysis, dict) else None
+            if not isinstance(summary, dict):
+                continue
+            figures = (parse_figure(summary.get('total_amount')), parse_figure(summary.get('units_consumed')))
+            if figures != (total_amount, units_consumed):
+                conn.execute('UPDATE bills SET total_amount = ?, units_consumed = ? WHERE id = ?',
+                             figures + (bill_id,))
+        last_id = rows[-1][0]
+
+def backfill_billing_months(conn, batch_size=2000):
+    """Migration step: fill billing_month from each stored billing_period"""
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, billing_period FROM bills
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        updates = [(parse_billing_month(period), bill_id) for bill_id, period in rows]
+        conn.executemany('UPDATE bills SET billing_month = ? WHERE id = ?',
+                         [update for update in updates if update[0] is not None])
+        last_id = rows[-1][0]
+
+# Applied in order on startup; PRAGMA user_version records the last one run.
+# A step is an SQL string or a callable taking the connection.
+SCHEMA_MIGRATIONS = [
+    (1, [
+        'CREATE INDEX IF NOT EXISTS idx_bills_upload_date ON bills (upload_date)',
+        'CREATE INDEX IF NOT EXISTS idx_insights_bill_id ON insights (bill_id)',
+        'CREATE INDEX IF NOT EXISTS idx_insights_insight_date ON insights (insight_date, id)'
+    ]),
+    (2, [
+        'ALTER TABLE trends ADD COLUMN bill_count INTEGER DEFAULT 0',
+        'ALTER TABLE trends ADD COLUMN cost_count INTEGER DEFAULT 0',
+        'ALTER TABLE trends ADD COLUMN consumption_count INTEGER DEFAULT 0',
+        'DELETE FROM trends',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_trends_month_year ON trends (month_year)',
+        MONTHLY_TRENDS_REBUILD_SQL
+    ]),
+    # Full-text indexes over insight and bill text. External content tables
+    # store only the index; triggers keep them in step with every write.
+    (3, [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS insights_fts USING fts5(
+            insight_text, content='insights', content_rowid='id', tokenize='porter unicode61'
+        )''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS bills_fts USING fts5(
+            extracted_text, content='bills', content_rowid='id', tokenize='porter unicode61'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS insights_fts_insert AFTER INSERT ON insights BEGIN
+            INSERT INTO insights_fts (rowid, insight_text) VALUES (new.id, new.insight_text);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS insights_fts_delete AFTER DELETE ON insights BEGIN
+            INSERT INTO insights_fts (insights_fts, rowid, insight_text) VALUES ('delete', old.id, old.insight_text);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS insights_fts_update AFTER UPDATE OF insight_text ON insights BEGIN
+            INSERT INTO insights_fts (insights_fts, rowid, insight_text) VALUES ('delete', old.id, old.insight_text);
+            INSERT INTO insights_fts (rowid, insight_text) VALUES (new.id, new.insight_text);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS bills_fts_insert AFTER INSERT ON bills BEGIN
+            INSERT INTO bills_fts (rowid, extracted_text) VALUES (new.id, new.extracted_text);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS bills_fts_delete AFTER DELETE ON bills BEGIN
+            INSERT INTO bills_fts (bills_fts, rowid, extracted_text) VALUES ('delete', old.id, old.extracted_text);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS bills_fts_update AFTER UPDATE OF extracted_text ON bills BEGIN
+            INSERT INTO bills_fts (bills_fts, rowid, extracted_text) VALUES ('delete', old.id, old.extracted_text);
+            INSERT INTO bills_fts (rowid, extracted_text) VALUES (new.id, new.extracted_text);
+        END''',
+        "INSERT INTO insights_fts (insights_fts) VALUES ('rebuild')",
+        "INSERT INTO bills_fts (bills_fts) VALUES ('rebuild')",
+        'CREATE INDEX IF NOT EXISTS idx_insights_type_date ON insights (insight_type, insight_date, id)'
+    ]),
+    # Keep bills narrow: the multi-KB text and analysis payloads move to the
+    # compressed blob store, and bills_fts becomes contentless so the text is
+    # not kept a second time. It is indexed from store_bill_analysis.
+    (4, [
+        BLOBS_TABLE_SQL,
+        'ALTER TABLE bills ADD COLUMN text_blob_id INTEGER',
+        'ALTER TABLE bills ADD COLUMN analysis_blob_id INTEGER',
+        'ALTER TABLE bills ADD COLUMN raw_analysis_blob_id INTEGER',
+        'DROP TRIGGER IF EXISTS bills_fts_insert',
+        'DROP TRIGGER IF EXISTS bills_fts_delete',
+        'DROP TRIGGER IF EXISTS bills_fts_update',
+        'DROP TABLE IF EXISTS bills_fts',
+        '''CREATE VIRTUAL TABLE bills_fts USING fts5(
+            extracted_text, content='', tokenize='porter unicode61'
+        )''',
+        move_payloads_to_blobs,
+        drop_inline_payloads
+    ]),
+    # Which customer/consumer a bill belongs to, so history can be compared
+    # per account. Existing bills stay unassigned (NULL).
+    (5, [
+        'ALTER TABLE bills ADD COLUMN account_id TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_bills_account_date ON bills (account_id, upload_date)'
+    ]),
+    (6, [
+        reparse_bill_figures,
+        'DELETE FROM trends',
+        MONTHLY_TRENDS_REBUILD_SQL
+    ]),
+    # account_id on insights and trends, so one tenant's dashboard reads only
+    # its own index range instead of filtering everyone's rows
+    (7, [
+        'ALTER TABLE insights ADD COLUMN account_id TEXT',
+        "UPDATE insights SET account_id = (SELECT COALESCE(account_id, '') FROM bills WHERE bills.id = insights.bill_id)",
+        'CREATE INDEX IF NOT EXISTS idx_insights_account_date ON insights (account_id, insight_date, id)',
+        "ALTER TABLE trends ADD COLUMN account_id TEXT NOT NULL DEFAULT ''",
+        'DROP INDEX IF EXISTS idx_trends_month_year',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_trends_account_month ON trends (account_id, month_year)',
+        'DELETE FROM trends',
+        TRENDS_REBUILD_SQL
+    ]),
+    # The job that stored a bill, so a retried store stage finds the bill an
+    # abandoned attempt already committed instead of inserting it again
+    (8, [
+        'ALTER TABLE bills ADD COLUMN job_id TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_job_id ON bills (job_id) WHERE job_id IS NOT NULL'
+    ]),
+    # Insights of bills without an account belong to '' like their trends do;
+    # migration 7 copied NULL for them
+    (9, [
+        "UPDATE insights SET account_id = '' WHERE account_id IS NULL"
+    ]),
+    # The month a bill's billing_period covers (year * 12 + month - 1), so
+    # consumption baselines follow the bill's own period, not when it arrived
+    (10, [
+        'ALTER TABLE bills ADD COLUMN billing_month INTEGER',
+        backfill_billing_months
+    ])
+]
+
+SEARCH_SCOPES = ('insights', 'bills', 'all')
+
+# Response field -> column, for ?fields= projection
+INSIGHT_FIELDS = {
+    'id': 'i.id',
+    'bill_id': 'i.bill_id',
+    'insight': 'i.insight_text',
+    'type': 'i.insight_type',
+    'date': 'i.insight_date',
+    'bill_amount': 'b.total_amount',
+    'efficiency': 'b.efficiency_rating'
+}
+DEFAULT_INSIGHT_FIELDS = ['insight', 'type', 'date', 'bill_amount', 'efficiency']
+
+TREND_FIELDS = {
+    'month_year': 'month_year',
+    'avg_cost': 'total_cost / NULLIF(cost_count, 0)',
+    'avg_consumption': 'total_consumption / NULLIF(consumption_count, 0)',
+    'bill_count': 'bill_count'
+}
+TREND_TOTALS = ['month_year', 'total_consumption', 'total_cost', 'bill_count', 'cost_count', 'consumption_count']
+# TREND_FIELDS computed in Python, for totals merged from several shards
+TREND_VALUES = {
+    'month_year': lambda totals: totals['month_year'],
+    'avg_cost': lambda totals: totals['total_cost'] / totals['cost_count'] if totals['cost_count'] else None,
+    'avg_consumption': lambda totals: (totals['total_consumption'] / totals['consumption_count']
+                                       if totals['consumption_count'] else None),
+    'bill_count': lambda totals: totals['bill_count']
+}
+
+MAX_PAGE_SIZE = 200
+
+CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -20000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456'
+]
+
+def file_version(path):
+    """mtime and size of a database file and its WAL, or '-' for a missing file"""
+    parts = []
+    for name in (path, path + '-wal'):
+        try:
+            stat = os.stat(name)
+            parts.append(f'{stat.st_mtime_ns}:{stat.st_size}')
+        except OSError:
+            parts.append('-')
+    return '/'.join(parts)
+
+class ThreadConnection:
+    """A thread's connection, held only by its threading.local slot.
+
+    The slot is dropped when the thread ends, and the finalizer set up in
+    get_connection then closes the connection.
+    """
+
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
+def close_thread_connection(connections, lock, conn):
+    with lock:
+        connections.discard(conn)
+    conn.close()
 
 class BillDatabase:
-    def __init__(self, db_path='electricity_bills.db'):
+    def __init__(self, db_path='electricity_bills.db', timeout=30, first_id=None):
         self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        # Bumped on every write from this process; part of data_version() so
+        # coarse file timestamps cannot hide a change made here
+        self.write_count = 0
         self.init_database()
+        if first_id is not None:
+            self.reserve_ids(first_id)
+
+    def get_connection(self):
+        """Return this thread's connection, opening it on first use.
+
+        It is closed when the thread ends, so the short-lived threads of the
+        threaded dev server and the gateway's threadpool do not each leave an
+        open WAL connection behind.
+        """
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            holder = ThreadConnection(conn)
+            self._local.holder = holder
+            with self._connections_lock:
+                self._connections.add(conn)
+            weakref.finalize(holder, close_thread_connection, self._connections, self._connections_lock, conn)
+        return holder.conn
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def migrate(self, conn):
+        """Run schema migrations newer than the database's user_version"""
+        for version, statements in SCHEMA_MIGRATIONS:
+            with conn:
+                # Explicit BEGIN so DDL is rolled back with the rest if a step
+                # fails; IMMEDIATE so another connection opening the same file
+                # (a second worker, or two threads opening one shard) waits and
+                # then sees the step as done instead of running it again
+                conn.execute('BEGIN IMMEDIATE')
+                if version <= conn.execute('PRAGMA user_version').fetchone()[0]:
+                    continue
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version}')
     
     def init_database(self):
         """Initialize database tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -51,114 +404,799 @@ class BillDatabase:
         ''')
         
         conn.commit()
-        conn.close()
+        self.migrate(conn)
+
+    def reserve_ids(self, first_id):
+        """Start bill and insight ids at first_id unless rows were already written.
+
+        Shards get disjoint id ranges this way, so a bill id is unique across
+        shard files and says which shard holds the bill.
+        """
+        conn = self.get_connection()
+        with conn:
+            for table in ('bills', 'insights'):
+                if conn.execute('SELECT 1 FROM sqlite_sequence WHERE name = ?', (table,)).fetchone() is None:
+                    conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, first_id - 1))
+
+    def map_shards(self, fn, account_ids=None):
+        """[fn(self)]; the single-file counterpart of ShardedBillDatabase.map_shards"""
+        return [fn(self)]
     
-    def store_bill_analysis(self, file_url, file_type, extracted_text, analysis):
-        """Store bill and its analysis in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @instrument()
+    def store_bill_analysis(self, file_url, file_type, extracted_text, analysis, account_id=None, job_id=None):
+        """Store bill and its analysis in database.
+
+        With a job_id the call is idempotent: a bill already stored for that
+        job is returned instead of being inserted a second time.
+        """
+        conn = self.get_connection()
         
         bill_summary = analysis.get('bill_summary', {})
         consumption_analysis = analysis.get('consumption_analysis', {})
+        # Parsed once by analysis_parser; older callers only send the bill_summary strings
+        figures = analysis.get('figures') or {}
         
-        cursor.execute('''
-            INSERT INTO bills (file_url, file_type, extracted_text, analysis_json, 
-                             total_amount, units_consumed, billing_period, efficiency_rating)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            file_url,
-            file_type,
-            extracted_text,
-            json.dumps(analysis),
-            self.extract_numeric(bill_summary.get('total_amount')),
-            self.extract_numeric(bill_summary.get('units_consumed')),
-            bill_summary.get('billing_period'),
-            consumption_analysis.get('efficiency_rating')
-        ))
-        
-        bill_id = cursor.lastrowid
+        insights = (
+            [('recommendation', text) for text in analysis.get('recommendations', [])] +
+            [('anomaly', text) for text in analysis.get('anomalies', [])]
+        )
         
-        for recommendation in analysis.get('recommendations', []):
-            cursor.execute('''
-                INSERT INTO insights (bill_id, insight_type, insight_text)
-                VALUES (?, ?, ?)
-            ''', (bill_id, 'recommendation', recommendation))
-        
-        for anomaly in analysis.get('anomalies', []):
-            cursor.execute('''
-                INSERT INTO insights (bill_id, insight_type, insight_text)
-                VALUES (?, ?, ?)
-            ''', (bill_id, 'anomaly', anomaly))
-        
-        conn.commit()
-        conn.close()
+        # raw_analysis repeats the parsed fields as text; it gets its own blob
+        stored_analysis = {k: v for k, v in analysis.items() if k != 'raw_analysis'}
         
+        with conn:
+            # Take the write lock before the lookup so two attempts of one job
+            # cannot both miss it
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            if job_id is not None:
+                row = conn.execute('SELECT id FROM bills WHERE job_id = ?', (job_id,)).fetchone()
+                if row is not None:
+                    return row[0]
+
+            cursor = conn.execute('''
+                INSERT INTO bills (account_id, job_id, file_url, file_type, text_blob_id, analysis_blob_id,
+                                 raw_analysis_blob_id, total_amount, units_consumed, billing_period,
+                                 billing_month, efficiency_rating)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                account_id,
+                job_id,
+                file_url,
+                file_type,
+                store_blob(conn, extracted_text),
+                store_blob(conn, json.dumps(stored_analysis)),
+                store_blob(conn, analysis.get('raw_analysis')),
+                figures['total_amount'] if 'total_amount' in figures
+                else self.extract_numeric(bill_summary.get('total_amount')),
+                figures['units_consumed'] if 'units_consumed' in figures
+                else self.extract_numeric(bill_summary.get('units_consumed')),
+                bill_summary.get('billing_period'),
+                parse_billing_month(bill_summary.get('billing_period')),
+                consumption_analysis.get('efficiency_rating')
+            ))
+            
+            bill_id = cursor.lastrowid
+            conn.execute('INSERT INTO bills_fts (rowid, extracted_text) VALUES (?, ?)',
+                         (bill_id, extracted_text or ''))
+            
+            conn.executemany('''
+                INSERT INTO insights (bill_id, account_id, insight_type, insight_text)
+                VALUES (?, ?, ?, ?)
+            ''', [(bill_id, account_id or '', insight_type, text) for insight_type, text in insights])
+
+            self.update_trends(conn, bill_id)
+
+        self.write_count += 1
         return bill_id
+
+    def get_bill(self, bill_id):
+        """A stored bill with its extracted text and full analysis, or None"""
+        conn = self.get_connection()
+        row = conn.execute('''
+            SELECT id, upload_date, file_url, file_type, total_amount, units_consumed,
+                   billing_period, efficiency_rating, text_blob_id, analysis_blob_id, raw_analysis_blob_id,
+                   account_id
+            FROM bills WHERE id = ?
+        ''', (bill_id,)).fetchone()
+        if row is None:
+            return None
+
+        analysis_json = load_blob(conn, row[9])
+        analysis = json.loads(analysis_json) if analysis_json else {}
+        raw_analysis = load_blob(conn, row[10])
+        if raw_analysis is not None:
+            analysis['raw_analysis'] = raw_analysis
+        return {
+            'id': row[0],
+            'account_id': row[11],
+            'upload_date': row[1],
+            'file_url': row[2],
+            'file_type': row[3],
+            'total_amount': row[4],
+            'units_consumed': row[5],
+            'billing_period': row[6],
+            'efficiency_rating': row[7],
+            'extracted_text': load_blob(conn, row[8]),
+            'analysis': analysis
+        }
+
+    def get_storage_stats(self):
+        """Page usage of the main tables and how well the blob store compresses"""
+        conn = self.get_connection()
+        blobs = conn.execute('SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blobs').fetchone()
+        references = conn.execute('''
+            SELECT COUNT(text_blob_id) + COUNT(analysis_blob_id) + COUNT(raw_analysis_blob_id) FROM bills
+        ''').fetchone()[0]
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        return {
+            'file_bytes': conn.execute('PRAGMA page_count').fetchone()[0] * page_size,
+            'free_bytes': conn.execute('PRAGMA freelist_count').fetchone()[0] * page_size,
+            'blob_count': blobs[0],
+            'blob_references': references,
+            'blob_raw_bytes': blobs[1],
+            'blob_stored_bytes': blobs[2],
+            'compression_ratio': round(blobs[1] / blobs[2], 2) if blobs[2] else None
+        }
+
+    def update_trends(self, conn, bill_id):
+        """Add one bill to the running totals for its account and month"""
+        conn.execute('''
+            INSERT INTO trends (account_id, month_year, total_consumption, total_cost, bill_count,
+                                cost_count, consumption_count, average_rate)
+            SELECT COALESCE(account_id, ''), strftime('%Y-%m', upload_date), COALESCE(units_consumed, 0),
+                   COALESCE(total_amount, 0), 1, total_amount IS NOT NULL, units_consumed IS NOT NULL,
+                   total_amount / NULLIF(units_consumed, 0)
+            FROM bills WHERE id = ?
+            ON CONFLICT (account_id, month_year) DO UPDATE SET
+                total_consumption = total_consumption + excluded.total_consumption,
+                total_cost = total_cost + excluded.total_cost,
+                bill_count = bill_count + excluded.bill_count,
+                cost_count = cost_count + excluded.cost_count,
+                consumption_count = consumption_count + excluded.consumption_count,
+                average_rate = (total_cost + excluded.total_cost) /
+                               NULLIF(total_consumption + excluded.total_consumption, 0)
+        ''', (bill_id,))
+
+    def rebuild_trends(self):
+        """Recompute the trends rollup from a full scan of bills (for backfills)"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute('DELETE FROM trends')
+            conn.execute(TRENDS_REBUILD_SQL)
+        self.write_count += 1
+        return conn.execute('SELECT COUNT(*) FROM trends').fetchone()[0]
+
+    def check_trends_consistency(self):
+        """Compare the trends rollup against a full scan of bills"""
+        conn = self.get_connection()
+        columns = ['total_consumption', 'total_cost', 'bill_count', 'cost_count', 'consumption_count']
+
+        expected = {row[:2]: row[2:] for row in conn.execute(TRENDS_FULL_SCAN_SQL)}
+        actual = {
+            row[:2]: row[2:]
+            for row in conn.execute('SELECT account_id, month_year, {} FROM trends'.format(', '.join(columns)))
+        }
+
+        mismatches = []
+        for account_id, month_year in sorted(set(expected) | set(actual)):
+            want = expected.get((account_id, month_year))
+            have = actual.get((account_id, month_year))
+            if want is None or have is None or any(
+                abs((a or 0) - (b or 0)) > 1e-6 for a, b in zip(want, have)
+            ):
+                mismatches.append({
+                    'account_id': account_id,
+                    'month_year': month_year,
+                    'expected': dict(zip(columns, want)) if want else None,
+                    'actual': dict(zip(columns, have)) if have else None
+                })
+
+        return {
+            'consistent': not mismatches,
+            'months_checked': len(set(expected) | set(actual)),
+            'mismatches': mismatches
+        }
     
     def extract_numeric(self, value):
-        """Extract numeric value from string"""
+        """Extract numeric value from string, e.g. "₹1,234.50" -> 1234.5"""
         if not value:
             return None
-        try:
-            import re
-            numbers = re.findall(r'[\d.]+', str(value))
-            return float(numbers[0]) if numbers else None
-        except:
-            return None
+        return parse_figure(value)
     
-    def get_monthly_trends(self, months=12):
-        """Get monthly consumption trends"""
-        conn = sqlite3.connect(self.db_path)
+    def get_monthly_trends(self, months=12, after=None, limit=None, fields=None, account_id=None):
+        """Get monthly consumption trends, optionally only months after a
+        month_year cursor, at most limit rows, only the given fields and only
+        one account (all accounts are summed by default)"""
+        conn = self.get_connection()
         
         query = '''
-            SELECT 
-                strftime('%Y-%m', upload_date) as month_year,
-                AVG(total_amount) as avg_cost,
-                AVG(units_consumed) as avg_consumption,
-                COUNT(*) as bill_count
-            FROM bills 
-            WHERE upload_date >= date('now', '-{} months')
-            GROUP BY strftime('%Y-%m', upload_date)
+            SELECT {}
+            FROM ({})
+            WHERE month_year > ?
             ORDER BY month_year
-        '''.format(months)
+            LIMIT ?
+        '''.format(self.project(TREND_FIELDS, fields), self.trend_totals_query(months, account_id))
         
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        params = ([account_id] if account_id is not None else []) + [after or '', limit if limit is not None else -1]
+        cursor = conn.execute(query, params)
+        columns = [column[0] for column in cursor.description]
         
-        return df.to_dict('records')
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    @staticmethod
+    def trend_totals_query(months, account_id=None):
+        return '''
+            SELECT month_year, SUM(total_consumption) AS total_consumption, SUM(total_cost) AS total_cost,
+                   SUM(bill_count) AS bill_count, SUM(cost_count) AS cost_count,
+                   SUM(consumption_count) AS consumption_count
+            FROM trends
+            WHERE month_year >= strftime('%Y-%m', 'now', '-{} months'){}
+            GROUP BY month_year
+        '''.format(int(months), ' AND account_id = ?' if account_id is not None else '')
+
+    def get_trend_totals(self, months=12, account_id=None):
+        """Summed trends columns per month (TREND_TOTALS), for merging across shards"""
+        conn = self.get_connection()
+        params = [account_id] if account_id is not None else []
+        return [dict(zip(TREND_TOTALS, row))
+                for row in conn.execute(self.trend_totals_query(months, account_id), params)]
+    
+    def get_trends_page(self, months=12, limit=None, cursor=None, fields=None, account_id=None):
+        """Trends oldest month first; with a limit, also the month_year cursor for the next page"""
+        fields = fields or list(TREND_FIELDS)
+        rows = self.get_monthly_trends(
+            months, after=cursor, limit=limit + 1 if limit else None,
+            fields=['month_year'] + [field for field in fields if field != 'month_year'],
+            account_id=account_id
+        )
+        return self.trends_page(rows, fields, limit)
+
+    @staticmethod
+    def trends_page(rows, fields, limit):
+        page = rows[:limit] if limit else rows
+        return {
+            'trends': [{field: row[field] for field in fields} for row in page],
+            'next_cursor': page[-1]['month_year'] if limit and len(rows) > limit else None
+        }
+    
+    def get_monthly_trends_frame(self, months=12, engine='pandas'):
+        """Monthly trends as a pandas DataFrame or pyarrow Table for analytics callers.
+
+        The dataframe libraries are imported here, not at module load, so the
+        API services never pay their import cost.
+        """
+        trends = self.get_monthly_trends(months)
+        if engine == 'pandas':
+            import pandas as pd
+            return pd.DataFrame.from_records(
+                trends, columns=['month_year', 'avg_cost', 'avg_consumption', 'bill_count']
+            )
+        if engine == 'arrow':
+            import pyarrow as pa
+            return pa.Table.from_pylist(trends)
+        raise ValueError("engine must be 'pandas' or 'arrow'")
     
-    def get_recent_insights(self, limit=10):
+    def get_recent_insights(self, limit=10, account_id=None):
         """Get recent insights for dashboard"""
-        conn = sqlite3.connect(self.db_path)
-        
+        return self.get_insights_page(limit, account_id=account_id)['insights']
+
+    @staticmethod
+    def project(available, fields):
+        """SELECT list for the requested fields (all by default)"""
+        fields = fields or list(available)
+        unknown = [field for field in fields if field not in available]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}; choose from {list(available)}")
+        return ', '.join(f'{available[field]} AS {field}' for field in fields)
+
+    def get_insights_page(self, limit=10, cursor=None, fields=None, account_id=None):
+        """One page of insights, newest first, plus the cursor for the next page.
+
+        The cursor is an (insight_date, id) keyset, so every page is an index
+        range scan whatever its depth. bills is only joined when a bill field
+        is requested.
+        """
+        fields = fields or DEFAULT_INSIGHT_FIELDS
+        rows = self.get_insight_rows(limit + 1, cursor, fields, account_id)
+        return self.insights_page(rows, fields, limit)
+
+    def get_insight_rows(self, limit, cursor=None, fields=None, account_id=None):
+        """(insight_date, id, *fields) tuples, newest first"""
+        conn = self.get_connection()
+        fields = fields or DEFAULT_INSIGHT_FIELDS
+        columns = self.project(INSIGHT_FIELDS, fields)
+        join = 'JOIN bills b ON i.bill_id = b.id' if any(
+            INSIGHT_FIELDS[field].startswith('b.') for field in fields
+        ) else ''
+
+        conditions = []
+        params = []
+        if account_id is not None:
+            conditions.append('i.account_id = ?')
+            params.append(account_id)
+        if cursor:
+            conditions.append('(i.insight_date, i.id) < (?, ?)')
+            params.extend(self.decode_cursor(cursor))
+
         query = '''
-            SELECT i.insight_text, i.insight_type, i.insight_date, b.total_amount, b.efficiency_rating
+            SELECT i.insight_date, i.id, {}
             FROM insights i
-            JOIN bills b ON i.bill_id = b.id
-            ORDER BY i.insight_date DESC
+            {}
+            {}
+            ORDER BY i.insight_date DESC, i.id DESC
             LIMIT ?
+        '''.format(columns, join, 'WHERE ' + ' AND '.join(conditions) if conditions else '')
+        return conn.execute(query, params + [limit]).fetchall()
+
+    @classmethod
+    def insights_page(cls, rows, fields, limit):
+        page = rows[:limit]
+        return {
+            'insights': [dict(zip(fields, row[2:])) for row in page],
+            'next_cursor': cls.encode_cursor(page[-1][0], page[-1][1]) if len(rows) > limit else None
+        }
+
+    def data_version(self, account_id=None):
+        """Cheap change marker from the database and WAL file stats.
+
+        Every committed write changes the WAL (or, after a checkpoint, the main
+        file), so an unchanged marker means unchanged data. No SQLite call is
+        made, so it can answer If-None-Match before a connection is touched.
+        account_id only narrows the marker for ShardedBillDatabase.
+        """
+        return f'{self.write_count}/{file_version(self.db_path)}'
+
+    @staticmethod
+    def to_match_query(text):
+        """Turn free text into an FTS5 query: quoted phrases stay phrases, every
+        other word must match, and a trailing * makes a word a prefix."""
+        terms = []
+        for phrase, word in re.findall(r'"([^"]+)"|(\S+)', text or ''):
+            if phrase:
+                terms.append('"{}"'.format(phrase))
+                continue
+            prefix = word.endswith('*')
+            word = re.sub(r'\W+', ' ', word).strip()
+            if word:
+                terms.append('"{}"{}'.format(word, '*' if prefix else ''))
+        return ' '.join(terms)
+
+    @staticmethod
+    def encode_cursor(insight_date, insight_id):
+        return base64.urlsafe_b64encode(json.dumps([insight_date, insight_id]).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            insight_date, insight_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return insight_date, int(insight_id)
+        except Exception:
+            raise ValueError('Invalid cursor')
+
+    def search_insights(self, query=None, insight_type=None, efficiency_rating=None, months=None,
+                        date_from=None, date_to=None, scope='insights', limit=20, cursor=None,
+                        facets=True, account_id=None):
+        """Search insights newest first, with optional facet counts.
+
+        query is matched against the insight text, the bill's extracted text
+        or both (scope). months is a list of 'YYYY-MM'; date_from/date_to
+        bound insight_date as [from, to); account_id keeps one account's. Pages chain through next_cursor, an
+        (insight_date, id) keyset, so deep pages cost the same as the first.
+        Facets count every match, not just the current page.
+        """
+        if scope not in SEARCH_SCOPES:
+            raise ValueError(f"scope must be one of {SEARCH_SCOPES}")
+
+        conditions = []
+        params = []
+        match = self.to_match_query(query)
+        if query and not match:
+            raise ValueError('query has no searchable terms')
+        if match:
+            searches = []
+            if scope in ('insights', 'all'):
+                searches.append('i.id IN (SELECT rowid FROM insights_fts WHERE insights_fts MATCH ?)')
+                params.append(match)
+            if scope in ('bills', 'all'):
+                searches.append('i.bill_id IN (SELECT rowid FROM bills_fts WHERE bills_fts MATCH ?)')
+                params.append(match)
+            conditions.append('(' + ' OR '.join(searches) + ')')
+        if account_id is not None:
+            conditions.append('i.account_id = ?')
+            params.append(account_id)
+        if insight_type:
+            conditions.append('i.insight_type = ?')
+            params.append(insight_type)
+        if efficiency_rating:
+            conditions.append('b.efficiency_rating = ? COLLATE NOCASE')
+            params.append(efficiency_rating)
+        if months:
+            ranges = []
+            for month in months:
+                start = datetime.strptime(month, '%Y-%m')
+                end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+                ranges.append('(i.insight_date >= ? AND i.insight_date < ?)')
+                params.extend([start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')])
+            conditions.append('(' + ' OR '.join(ranges) + ')')
+        if date_from:
+            conditions.append('i.insight_date >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('i.insight_date < ?')
+            params.append(date_to)
+
+        conn = self.get_connection()
+        source = '''
+            FROM insights i
+            JOIN bills b ON i.bill_id = b.id
+            WHERE {}
         '''
-        
-        cursor = conn.cursor()
-        cursor.execute(query, (limit,))
-        results = cursor.fetchall()
-        conn.close()
-        
-        return [
+
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if cursor:
+            page_conditions.append('(i.insight_date, i.id) < (?, ?)')
+            page_params.extend(self.decode_cursor(cursor))
+
+        rows = conn.execute('''
+            SELECT i.id, i.bill_id, i.insight_text, i.insight_type, i.insight_date,
+                   b.total_amount, b.efficiency_rating
+        ''' + source.format(' AND '.join(page_conditions) or '1') + '''
+            ORDER BY i.insight_date DESC, i.id DESC
+            LIMIT ?
+        ''', page_params + [limit + 1]).fetchall()
+
+        results = [
             {
-                'insight': row[0],
-                'type': row[1],
-                'date': row[2],
-                'bill_amount': row[3],
-                'efficiency': row[4]
+                'id': row[0],
+                'bill_id': row[1],
+                'insight': row[2],
+                'type': row[3],
+                'date': row[4],
+                'bill_amount': row[5],
+                'efficiency': row[6]
             }
-            for row in results
+            for row in rows[:limit]
         ]
+        response = {
+            'results': results,
+            'next_cursor': self.encode_cursor(results[-1]['date'], results[-1]['id'])
+                           if len(rows) > limit else None
+        }
+
+        if facets:
+            # One grouped pass over the matches; each facet is summed from it
+            counts = {'insight_type': {}, 'efficiency_rating': {}, 'month': {}}
+            total = 0
+            grouped = conn.execute('''
+                SELECT i.insight_type, b.efficiency_rating, strftime('%Y-%m', i.insight_date), COUNT(*)
+            ''' + source.format(' AND '.join(conditions) or '1') + '''
+                GROUP BY 1, 2, 3
+            ''', params)
+            for insight_type_value, rating, month, count in grouped:
+                total += count
+                for facet, value in (('insight_type', insight_type_value),
+                                     ('efficiency_rating', rating), ('month', month)):
+                    counts[facet][value] = counts[facet].get(value, 0) + count
+            response['total'] = total
+            response['facets'] = {
+                facet: [
+                    {'value': value, 'count': count}
+                    for value, count in sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+                ]
+                for facet, values in counts.items()
+            }
+
+        return response
+
+# Each shard's bills and insights are numbered from shard * BILL_IDS_PER_SHARD,
+# which keeps ids unique across files and below 2**53 for JavaScript clients
+BILL_IDS_PER_SHARD = 10 ** 9
+
+class ShardedBillDatabase:
+    """BillDatabase split into one SQLite file per account.
+
+    Each tenant's writes take only its own file's writer lock and its
+    dashboard reads scan only its own rows. shards.db in root_dir maps
+    account ids to shard numbers (bills without an account share the ''
+    shard); a bill id also encodes its shard, so get_bill needs no lookup.
+
+    At most max_open shard databases stay open; the least recently used one
+    that no thread is using is closed when another is needed. Queries
+    without an account_id run on every shard in parallel (map_shards) and
+    are merged here. The method signatures match BillDatabase.
+    """
+
+    def __init__(self, root_dir='shards', max_open=32, workers=8, timeout=30):
+        self.root_dir = root_dir
+        self.max_open = max_open
+        self.workers = workers
+        self.timeout = timeout
+        self.write_count = 0
+        self.hits = 0
+        self.misses = 0
+        self._open = OrderedDict()
+        self._numbers = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        os.makedirs(root_dir, exist_ok=True)
+        self.directory_path = os.path.join(root_dir, 'shards.db')
+        conn = self.connect_directory()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shards (
+                    shard INTEGER PRIMARY KEY AUTOINCREMENT,
+                    account_id TEXT NOT NULL UNIQUE,
+                    created_at REAL
+                )
+            ''')
+        finally:
+            conn.close()
+
+    def connect_directory(self):
+        conn = sqlite3.connect(self.directory_path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    def shard_path(self, number):
+        return os.path.join(self.root_dir, f'shard-{number:06d}.db')
+
+    def shard_number(self, account_id, create=False):
+        """The account's shard number; None for an unknown account unless create"""
+        account_id = account_id or ''
+        number = self._numbers.get(account_id)
+        if number is not None:
+            return number
+        conn = self.connect_directory()
+        try:
+            if create:
+                conn.execute('INSERT OR IGNORE INTO shards (account_id, created_at) VALUES (?, ?)',
+                             (account_id, time.time()))
+            row = conn.execute('SELECT shard FROM shards WHERE account_id = ?', (account_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        self._numbers[account_id] = row[0]
+        return row[0]
+
+    def shard_numbers(self, account_ids=None):
+        """Shard numbers for the given accounts (unknown ones skipped), or all shards"""
+        if account_ids is not None:
+            numbers = (self.shard_number(account_id) for account_id in account_ids)
+            return [number for number in numbers if number is not None]
+        conn = self.connect_directory()
+        try:
+            return [row[0] for row in conn.execute('SELECT shard FROM shards ORDER BY shard')]
+        finally:
+            conn.close()
+
+    def open_shard(self, number):
+        return BillDatabase(self.shard_path(number), timeout=self.timeout, first_id=number * BILL_IDS_PER_SHARD)
+
+    @contextmanager
+    def shard(self, number):
+        """The shard's BillDatabase, held open (not evicted) until the block ends"""
+        with self._lock:
+            entry = self._open.get(number)
+            if entry is not None:
+                self.hits += 1
+                entry[1] += 1
+                self._open.move_to_end(number)
+            else:
+                self.misses += 1
+
+        if entry is None:
+            # Open outside the lock; if two threads race, the first one stored wins
+            database = self.open_shard(number)
+            with self._lock:
+                entry = self._open.get(number)
+                if entry is None:
+                    entry = self._open[number] = [database, 1]
+                    database = None
+                else:
+                    entry[1] += 1
+                    self._open.move_to_end(number)
+            if database is not None:
+                database.close()
+
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                evicted = self._pop_unused()
+            for database in evicted:
+                database.close()
+
+    def _pop_unused(self):
+        """Drop least recently used shards nobody holds until max_open are left"""
+        evicted = []
+        for number in list(self._open):
+            if len(self._open) <= self.max_open:
+                break
+            database, users = self._open[number]
+            if users == 0:
+                del self._open[number]
+                evicted.append(database)
+        return evicted
+
+    def map_shards(self, fn, account_ids=None):
+        """[fn(shard database)] for every shard (or the accounts' shards), run in parallel"""
+        numbers = self.shard_numbers(account_ids)
+        if len(numbers) <= 1:
+            return [self.call_shard(number, fn) for number in numbers]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='shard-query')
+        return list(self._executor.map(traced(lambda number: self.call_shard(number, fn)), numbers))
+
+    def call_shard(self, number, fn):
+        with self.shard(number) as database:
+            return fn(database)
+
+    def store_bill_analysis(self, file_url, file_type, extracted_text, analysis, account_id=None, job_id=None):
+        """Store bill and its analysis in the account's shard, creating it on first use"""
+        number = self.shard_number(account_id, create=True)
+        with self.shard(number) as database:
+            bill_id = database.store_bill_analysis(file_url, file_type, extracted_text, analysis,
+                                                   account_id=account_id, job_id=job_id)
+        self.write_count += 1
+        return bill_id
+
+    def get_bill(self, bill_id):
+        number = int(bill_id) // BILL_IDS_PER_SHARD
+        if not os.path.exists(self.shard_path(number)):
+            return None
+        with self.shard(number) as database:
+            return database.get_bill(bill_id)
+
+    def accounts(self, account_id):
+        """map_shards argument: one account's shard, or None for all"""
+        return [account_id] if account_id is not None else None
+
+    def get_monthly_trends(self, months=12, after=None, limit=None, fields=None, account_id=None):
+        fields = fields or list(TREND_FIELDS)
+        unknown = [field for field in fields if field not in TREND_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}; choose from {list(TREND_FIELDS)}")
+
+        merged = {}
+        for totals in self.map_shards(lambda database: database.get_trend_totals(months, account_id),
+                                      self.accounts(account_id)):
+            for row in totals:
+                month = merged.setdefault(row['month_year'], dict.fromkeys(TREND_TOTALS, 0))
+                for column in TREND_TOTALS[1:]:
+                    month[column] += row[column] or 0
+                month['month_year'] = row['month_year']
+
+        rows = [merged[month_year] for month_year in sorted(merged) if month_year > (after or '')]
+        if limit is not None:
+            rows = rows[:limit]
+        return [{field: TREND_VALUES[field](row) for field in fields} for row in rows]
+
+    def get_trends_page(self, months=12, limit=None, cursor=None, fields=None, account_id=None):
+        fields = fields or list(TREND_FIELDS)
+        rows = self.get_monthly_trends(
+            months, after=cursor, limit=limit + 1 if limit else None,
+            fields=['month_year'] + [field for field in fields if field != 'month_year'],
+            account_id=account_id
+        )
+        return BillDatabase.trends_page(rows, fields, limit)
+
+    def get_recent_insights(self, limit=10, account_id=None):
+        return self.get_insights_page(limit, account_id=account_id)['insights']
+
+    def get_insights_page(self, limit=10, cursor=None, fields=None, account_id=None):
+        """Each shard's newest limit + 1 rows, merged by the (insight_date, id) keyset"""
+        fields = fields or DEFAULT_INSIGHT_FIELDS
+        BillDatabase.project(INSIGHT_FIELDS, fields)
+        rows = [row for shard_rows in self.map_shards(
+                    lambda database: database.get_insight_rows(limit + 1, cursor, fields, account_id),
+                    self.accounts(account_id))
+                for row in shard_rows]
+        rows.sort(key=lambda row: (row[0], row[1]), reverse=True)
+        return BillDatabase.insights_page(rows[:limit + 1], fields, limit)
+
+    def search_insights(self, query=None, insight_type=None, efficiency_rating=None, months=None,
+                        date_from=None, date_to=None, scope='insights', limit=20, cursor=None,
+                        facets=True, account_id=None):
+        """BillDatabase.search_insights over every shard, pages and facets merged"""
+        responses = self.map_shards(lambda database: database.search_insights(
+            query, insight_type, efficiency_rating, months, date_from, date_to, scope, limit, cursor,
+            facets, account_id
+        ), self.accounts(account_id))
+
+        results = sorted((result for response in responses for result in response['results']),
+                         key=lambda result: (result['date'], result['id']), reverse=True)
+        more = len(results) > limit or any(response['next_cursor'] for response in responses)
+        response = {
+            'results': results[:limit],
+            'next_cursor': BillDatabase.encode_cursor(results[limit - 1]['date'], results[limit - 1]['id'])
+                           if more and len(results) >= limit else None
+        }
+
+        if facets:
+            counts = {'insight_type': {}, 'efficiency_rating': {}, 'month': {}}
+            for shard_response in responses:
+                for facet, values in shard_response.get('facets', {}).items():
+                    for item in values:
+                        counts[facet][item['value']] = counts[facet].get(item['value'], 0) + item['count']
+            response['total'] = sum(shard_response.get('total', 0) for shard_response in responses)
+            response['facets'] = {
+                facet: [
+                    {'value': value, 'count': count}
+                    for value, count in sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+                ]
+                for facet, values in counts.items()
+            }
+
+        return response
+
+    def data_version(self, account_id=None):
+        """File stats of the account's shard, or of the directory and every shard"""
+        if account_id is not None:
+            number = self.shard_number(account_id)
+            paths = [self.shard_path(number)] if number is not None else []
+        else:
+            paths = [self.directory_path] + [self.shard_path(number) for number in self.shard_numbers()]
+        return '|'.join([str(self.write_count)] + [file_version(path) for path in paths])
+
+    def rebuild_trends(self):
+        months = self.map_shards(lambda database: database.rebuild_trends())
+        self.write_count += 1
+        return sum(months)
+
+    def check_trends_consistency(self):
+        reports = self.map_shards(lambda database: database.check_trends_consistency())
+        return {
+            'consistent': all(report['consistent'] for report in reports),
+            'months_checked': sum(report['months_checked'] for report in reports),
+            'mismatches': [mismatch for report in reports for mismatch in report['mismatches']]
+        }
+
+    def get_storage_stats(self):
+        stats = self.map_shards(lambda database: database.get_storage_stats())
+        totals = {key: sum(shard_stats[key] for shard_stats in stats)
+                  for key in ('file_bytes', 'free_bytes', 'blob_count', 'blob_references',
+                              'blob_raw_bytes', 'blob_stored_bytes')}
+        totals['compression_ratio'] = (round(totals['blob_raw_bytes'] / totals['blob_stored_bytes'], 2)
+                                       if totals['blob_stored_bytes'] else None)
+        totals['shards'] = self.get_shard_stats()
+        return totals
+
+    def get_shard_stats(self):
+        shards = len(self.shard_numbers())
+        with self._lock:
+            return {
+                'shards': shards,
+                'open': len(self._open),
+                'max_open': self.max_open,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def close(self):
+        with self._lock:
+            evicted = [database for database, _ in self._open.values()]
+            self._open.clear()
+            executor, self._executor = self._executor, None
+        for database in evicted:
+            database.close()
+        if executor is not None:
+            executor.shutdown()
 
 from flask import Flask, request, jsonify
 
 app = Flask(__name__)
-db = BillDatabase()
+init_app(app, 'database')
+# Set DB_SHARDS_DIR to keep each account in its own SQLite file
+db = ShardedBillDatabase(
+    os.environ['DB_SHARDS_DIR'],
+    max_open=int(os.environ.get('DB_SHARDS_OPEN', 32)),
+    workers=int(os.environ.get('DB_SHARD_WORKERS', 8))
+) if os.environ.get('DB_SHARDS_DIR') else BillDatabase()
 
 @app.route('/store-analysis', methods=['POST'])
 def store_analysis():
@@ -169,7 +1207,8 @@ def store_analysis():
         extracted_text = data.get('extracted_text')
         analysis = data.get('analysis')
         
-        bill_id = db.store_bill_analysis(file_url, file_type, extracted_text, analysis)
+        bill_id = db.store_bill_analysis(file_url, file_type, extracted_text, analysis,
+                                         account_id=data.get('account_id'))
         
         return jsonify({
             'success': True,
@@ -180,23 +1219,137 @@ def store_analysis():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def requested_fields():
+    fields = request.args.get('fields')
+    return [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+
+def conditional(extra=''):
+    """ETag for this request, and a 304 response if the client already has it.
+
+    The tag combines the database file stats with the full query string, so a
+    poll with unchanged data is answered without opening SQLite.
+    """
+    version = f"{db.data_version(request.args.get('account_id'))}|{request.full_path}|{extra}"
+    etag = hashlib.sha1(version.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return etag, response
+    return etag, None
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/get-trends', methods=['GET'])
 def get_trends():
     try:
-        months = request.args.get('months', 12, type=int)
-        trends = db.get_monthly_trends(months)
-        return jsonify({'trends': trends})
+        months = min(request.args.get('months', 12, type=int), 120)
+        limit = request.args.get('limit', type=int)
+        # Trends are relative to the current month, so a new month is new data
+        etag, not_modified = conditional(datetime.now().strftime('%Y-%m'))
+        if not_modified:
+            return not_modified
+
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        page = db.get_trends_page(months, limit, cursor=request.args.get('cursor'), fields=requested_fields(),
+                                  account_id=request.args.get('account_id'))
+        return with_etag(jsonify(page), etag)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get-insights', methods=['GET'])
 def get_insights():
     try:
-        limit = request.args.get('limit', 10, type=int)
-        insights = db.get_recent_insights(limit)
-        return jsonify({'insights': insights})
+        limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_PAGE_SIZE)
+        etag, not_modified = conditional()
+        if not_modified:
+            return not_modified
+
+        page = db.get_insights_page(limit, cursor=request.args.get('cursor'), fields=requested_fields(),
+                                    account_id=request.args.get('account_id'))
+        return with_etag(jsonify(page), etag)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search-insights', methods=['GET'])
+def search_insights():
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+        cursor = request.args.get('cursor')
+        months = [month for value in request.args.getlist('month') for month in value.split(',') if month]
+        results = db.search_insights(
+            query=request.args.get('q'),
+            insight_type=request.args.get('insight_type'),
+            efficiency_rating=request.args.get('efficiency_rating'),
+            months=months,
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            scope=request.args.get('scope', 'insights'),
+            limit=limit,
+            cursor=cursor,
+            # Facets describe the whole result set, so later pages skip them by default
+            facets=request.args.get('facets', '0' if cursor else '1') == '1',
+            account_id=request.args.get('account_id')
+        )
+        return jsonify(results)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+consumption_analytics = None
+
+def get_consumption_analytics():
+    # NumPy is only imported once analytics are first requested
+    global consumption_analytics
+    if consumption_analytics is None:
+        from consumption_analytics import ConsumptionAnalytics
+        consumption_analytics = ConsumptionAnalytics(db)
+    return consumption_analytics
+
+@app.route('/consumption-anomalies', methods=['GET'])
+def consumption_anomalies():
+    try:
+        analytics = get_consumption_analytics()
+        bill_id = request.args.get('bill_id', type=int)
+        if bill_id is not None:
+            scores = analytics.get_bill_scores(bill_id)
+            if scores is None:
+                return jsonify({'error': 'Bill not found'}), 404
+            return jsonify(scores)
+
+        reasons = request.args.get('reasons')
+        return jsonify(analytics.get_anomalies(
+            account_id=request.args.get('account_id'),
+            reasons=reasons.split(',') if reasons else None,
+            limit=min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        ))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'rebuild-trends':
+        print(f'Rebuilt trends for {db.rebuild_trends()} months')
+        print(json.dumps(db.check_trends_consistency(), indent=2))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'compact':
+        # Space freed by the blob migration is only returned to the OS by VACUUM
+        before = db.get_storage_stats()['file_bytes']
+        db.map_shards(lambda database: database.get_connection().execute('VACUUM'))
+        stats = db.get_storage_stats()
+        print(f"{before / 1e6:,.1f} MB -> {stats['file_bytes'] / 1e6:,.1f} MB")
+        print(json.dumps(stats, indent=2))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check-trends':
+        report = db.check_trends_consistency()
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report['consistent'] else 1)
+    else:
+        app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
@@ -1,18 +1,101 @@
 import requests
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bill_extractor import parse_figure
+from instrumentation import log_event, metrics, timed, trace_headers, traced
 
 class ERPNextIntegration:
-    def __init__(self, erpnext_url, api_key, api_secret):
+    # concurrent: one POST per ToDo, sent in parallel
+    # insert_many: all ToDos in a single frappe.client.insert_many call
+    BULK_MODES = (None, 'concurrent', 'insert_many')
+
+    def __init__(self, erpnext_url, api_key, api_secret, timeout=(5, 30),
+                 max_retries=3, pool_size=10, bulk_mode='concurrent'):
+        if bulk_mode not in self.BULK_MODES:
+            raise ValueError(f"bulk_mode must be one of {self.BULK_MODES}")
         self.base_url = erpnext_url.rstrip('/')
         self.api_key = api_key
         self.api_secret = api_secret
+        self.timeout = timeout
+        self.bulk_mode = bulk_mode
+        self.pool_size = pool_size
         self.headers = {
             'Authorization': f'token {api_key}:{api_secret}',
             'Content-Type': 'application/json'
         }
-
-    def create_communication(self, subject, content, reference_doctype=None, reference_name=None):
+        self.session = self.create_session(max_retries, pool_size)
+
+    def create_session(self, max_retries, pool_size):
+        """Keep-alive session with a connection pool sized for parallel posts.
+
+        POSTs are only retried when the connection could not be made or
+        ERPNext answered 429/503, i.e. when the document was not created.
+        """
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            status_forcelist=(429, 503),
+            allowed_methods=frozenset(['GET', 'POST']),
+            backoff_factor=0.5,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def post(self, path, data):
+        # Last path segment: the doctype, or the method for /api/method calls
+        endpoint = path.rsplit('/', 1)[-1]
+        with timed('erpnext_request', endpoint=endpoint, method='POST'):
+            response = self.session.post(f'{self.base_url}{path}', json=data, timeout=self.timeout,
+                                         headers=trace_headers())
+        metrics.inc('erpnext_responses_total', endpoint=endpoint, status=str(response.status_code))
+        return response
+
+    def create_document(self, doctype, data):
+        """POST one document. 'uncertain' marks failures where ERPNext may have
+        created it anyway (timeout, dropped connection)."""
+        try:
+            response = self.post(f'/api/resource/{doctype}', data)
+            if response.status_code == 200:
+                return {'success': True, 'data': response.json()}
+            else:
+                return {'success': False, 'error': response.text}
+        except Exception as e:
+            return {'success': False, 'error': str(e), 'uncertain': True}
+
+    def find_document(self, doctype, filters):
+        """Return the name of the first document matching filters, or None"""
+        with timed('erpnext_request', endpoint=doctype, method='GET'):
+            response = self.session.get(f'{self.base_url}/api/resource/{doctype}', params={
+                'filters': json.dumps(filters),
+                'fields': json.dumps(['name']),
+                'limit_page_length': 1
+            }, timeout=self.timeout, headers=trace_headers())
+        response.raise_for_status()
+        rows = response.json().get('data') or []
+        return rows[0]['name'] if rows else None
+
+    def build_communication(self, subject, content, reference_doctype=None, reference_name=None):
         data = {
             'doctype': 'Communication',
             'subject': subject,
@@ -24,17 +107,13 @@ class ERPNextIntegration:
         if reference_doctype and reference_name:
             data['reference_doctype'] = reference_doctype
             data['reference_name'] = reference_name
+        return data
 
-        try:
-            response = requests.post(f'{self.base_url}/api/resource/Communication', headers=self.headers, json=data)
-            if response.status_code == 200:
-                return {'success': True, 'data': response.json()}
-            else:
-                return {'success': False, 'error': response.text}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+    def create_communication(self, subject, content, reference_doctype=None, reference_name=None):
+        data = self.build_communication(subject, content, reference_doctype, reference_name)
+        return self.create_document('Communication', data)
 
-    def create_todo(self, description, priority='Medium', reference_type=None, reference_name=None):
+    def build_todo(self, description, priority='Medium', reference_type=None, reference_name=None):
         data = {
             'doctype': 'ToDo',
             'description': description,
@@ -44,50 +123,77 @@ class ERPNextIntegration:
         if reference_type and reference_name:
             data['reference_type'] = reference_type
             data['reference_name'] = reference_name
+        return data
 
-        try:
-            response = requests.post(f'{self.base_url}/api/resource/ToDo', headers=self.headers, json=data)
-            if response.status_code == 200:
-                return {'success': True, 'data': response.json()}
-            else:
-                return {'success': False, 'error': response.text}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+    def create_todo(self, description, priority='Medium', reference_type=None, reference_name=None):
+        data = self.build_todo(description, priority, reference_type, reference_name)
+        return self.create_document('ToDo', data)
+
+    def create_todos(self, descriptions, priority='Medium', reference_type=None, reference_name=None):
+        """Create several ToDos at once according to bulk_mode"""
+        if not descriptions:
+            return []
+
+        if self.bulk_mode == 'insert_many':
+            docs = [self.build_todo(description, priority, reference_type, reference_name)
+                    for description in descriptions]
+
+            try:
+                response = self.post('/api/method/frappe.client.insert_many', {'docs': docs})
+                if response.status_code == 200:
+                    names = response.json().get('message', [])
+                    return [{'success': True, 'data': {'data': {'name': name}}} for name in names]
+                return [{'success': False, 'error': response.text} for _ in descriptions]
+            except Exception as e:
+                return [{'success': False, 'error': str(e)} for _ in descriptions]
+
+        if self.bulk_mode == 'concurrent':
+            with ThreadPoolExecutor(max_workers=min(len(descriptions), self.pool_size)) as executor:
+                return list(executor.map(
+                    traced(lambda description: self.create_todo(description, priority, reference_type, reference_name)),
+                    descriptions
+                ))
+
+        return [self.create_todo(description, priority, reference_type, reference_name)
+                for description in descriptions]
+
+    def build_bill_insight(self, bill_id, analysis, communication_name=None):
+        # Parsed once by analysis_parser; older analyses without figures are
+        # parsed here the same way
+        figures = analysis.get("figures") or {}
+        total_amount = (figures["total_amount"] if "total_amount" in figures
+                        else parse_figure(analysis.get("bill_summary", {}).get("total_amount")))
+        return {
+            "linked_upload": bill_id,
+            "billing_period": analysis.get("bill_summary", {}).get("billing_period", ""),
+            "total_amount": total_amount if total_amount is not None else 0.0,
+            "units_consumed": analysis.get("bill_summary", {}).get("units_consumed", ""),
+            "rate_per_unit": analysis.get("bill_summary", {}).get("rate_per_unit", ""),
+            "efficiency_rating": analysis.get("consumption_analysis", {}).get("efficiency_rating", ""),
+            "consumption_trend": analysis.get("consumption_analysis", {}).get("consumption_trend", ""),
+            "peak_usage_period": analysis.get("consumption_analysis", {}).get("peak_usage_period", ""),
+            "anomalies": "\n".join(analysis.get("anomalies", [])),
+            "recommendations": "\n".join(analysis.get("recommendations", [])),
+            "analysis_date": analysis.get("analysis_date", datetime.now().strftime('%Y-%m-%d %H:%M')),
+            "communication_reference": communication_name
+        }
 
     def create_bill_insight(self, bill_id, analysis, communication_name=None):
-        print(f"[INFO] Called create_bill_insight for bill_id: {bill_id}")
         try:
-            insight_payload = {
-                "linked_upload": bill_id,
-                "billing_period": analysis.get("bill_summary", {}).get("billing_period", ""),
-                "total_amount": float(analysis.get("bill_summary", {}).get("total_amount", "0").replace("₹", "").strip()),
-                "units_consumed": analysis.get("bill_summary", {}).get("units_consumed", ""),
-                "rate_per_unit": analysis.get("bill_summary", {}).get("rate_per_unit", ""),
-                "efficiency_rating": analysis.get("consumption_analysis", {}).get("efficiency_rating", ""),
-                "consumption_trend": analysis.get("consumption_analysis", {}).get("consumption_trend", ""),
-                "peak_usage_period": analysis.get("consumption_analysis", {}).get("peak_usage_period", ""),
-                "anomalies": "\n".join(analysis.get("anomalies", [])),
-                "recommendations": "\n".join(analysis.get("recommendations", [])),
-                "analysis_date": analysis.get("analysis_date", datetime.now().strftime('%Y-%m-%d %H:%M')),
-                "communication_reference": communication_name
-            }
-
-            print(f"[DEBUG] Payload to Electricity Bill Insight:\n{json.dumps(insight_payload, indent=2)}")
-
-            create_response = requests.post(
-                f'{self.base_url}/api/resource/Electricity Bill Insight',
-                headers=self.headers,
-                json=insight_payload
-            )
-
-            print(f"[DEBUG] ERPNext responded with {create_response.status_code}:\n{create_response.text}")
+            insight_payload = self.build_bill_insight(bill_id, analysis, communication_name)
+            create_response = self.post('/api/resource/Electricity Bill Insight', insight_payload)
 
             if create_response.status_code == 200:
+                log_event('erpnext.insight_created', bill_id=bill_id, communication=communication_name)
                 return {'success': True, 'data': create_response.json(), 'created': True}
             else:
+                # The payload itself is not logged; the bill id is enough to find it
+                log_event('erpnext.insight_rejected', logging.WARNING, bill_id=bill_id,
+                          status=create_response.status_code, error=create_response.text[:500])
                 return {'success': False, 'error': create_response.text, 'created': False}
 
         except Exception as e:
+            log_event('erpnext.insight_failed', logging.WARNING, bill_id=bill_id, error=str(e))
             return {'success': False, 'error': str(e)}
 
     def post_electricity_bill_insights(self, analysis, bill_id):
@@ -98,17 +204,26 @@ class ERPNextIntegration:
 
             comm_name = comm_result['data']['data']['name'] if comm_result.get('success') else None
 
-            todo_results = []
-            for recommendation in analysis.get('recommendations', [])[:3]:
-                todo_result = self.create_todo(
-                    description=f"⚡ [Bill #{bill_id}] {recommendation}",
-                    priority='High',
-                    reference_type='Communication',
-                    reference_name=comm_name
-                )
-                todo_results.append(todo_result)
-
-            insight_result = self.create_bill_insight(bill_id, analysis, communication_name=comm_name)
+            descriptions = [
+                f"⚡ [Bill #{bill_id}] {recommendation}"
+                for recommendation in analysis.get('recommendations', [])[:3]
+            ]
+
+            if self.bulk_mode:
+                # ToDos and the insight only depend on the Communication name,
+                # so they go out together in a second round trip
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    todos_future = executor.submit(
+                        traced(self.create_todos), descriptions, 'High', 'Communication', comm_name
+                    )
+                    insight_future = executor.submit(
+                        traced(self.create_bill_insight), bill_id, analysis, comm_name
+                    )
+                    todo_results = todos_future.result()
+                    insight_result = insight_future.result()
+            else:
+                todo_results = self.create_todos(descriptions, 'High', 'Communication', comm_name)
+                insight_result = self.create_bill_insight(bill_id, analysis, communication_name=comm_name)
 
             return {
                 'success': True,
@@ -121,12 +236,16 @@ class ERPNextIntegration:
 
     def post_raw_text_insight(self, raw_text, bill_id):
         try:
-            subject = f"🔌 Electricity Bill Summary - Bill #{bill_id}"
-            content = f"<div style='font-family: monospace; white-space: pre-wrap;'>{raw_text}</div>"
+            subject, content = self.format_raw_text_insight(raw_text, bill_id)
             return self.create_communication(subject, content)
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    def format_raw_text_insight(self, raw_text, bill_id):
+        subject = f"🔌 Electricity Bill Summary - Bill #{bill_id}"
+        content = f"<div style='font-family: monospace; white-space: pre-wrap;'>{raw_text}</div>"
+        return subject, content
+
     def format_analysis_for_erpnext(self, analysis):
         content = f"""
 <div style="font-family: Arial, sans-serif;">
@@ -163,10 +282,30 @@ class ERPNextIntegration:
 
 from flask import Flask, request, jsonify
 import json
-import re
-from erpnext_integration import ERPNextIntegration
+import os
+from analysis_parser import parse_analysis
+from client_registry import ClientRegistry
+from erpnext_outbox import ERPNextOutbox, OutboxFlusher
+from instrumentation import init_app
 
 app = Flask(__name__)
+init_app(app, 'erpnext')
+# One pooled session per ERPNext site and credentials, shared across requests
+erpnext_clients = ClientRegistry(
+    ERPNextIntegration,
+    max_size=int(os.environ.get('ERPNEXT_REGISTRY_SIZE', 32)),
+    idle_timeout=int(os.environ.get('CLIENT_IDLE_TIMEOUT', 600)),
+    on_evict=lambda erp: erp.close()
+)
+erpnext_outbox = ERPNextOutbox(clients=erpnext_clients)
+outbox_flusher = None
+
+def start_outbox_flusher():
+    global outbox_flusher
+    if outbox_flusher is None:
+        outbox_flusher = OutboxFlusher(erpnext_outbox, interval=int(os.environ.get('OUTBOX_FLUSH_INTERVAL', 10)))
+        outbox_flusher.start()
+    return outbox_flusher
 
 @app.route('/post-to-erpnext', methods=['POST'])
 def post_to_erpnext():
@@ -182,40 +321,62 @@ def post_to_erpnext():
         if not all([erpnext_url, api_key, api_secret, bill_id]):
             return jsonify({'error': 'Missing required parameters'}), 400
 
-        erp = ERPNextIntegration(erpnext_url, api_key, api_secret)
+        bulk_mode = data.get('bulk_mode', 'concurrent')
+        if bulk_mode not in ERPNextIntegration.BULK_MODES:
+            return jsonify({'error': f'bulk_mode must be one of {ERPNextIntegration.BULK_MODES}'}), 400
 
-        if not analysis and raw_insight_text:
-            json_str = None
+        if not analysis and raw_insight_text and '{' in raw_insight_text:
+            # n8n sends the model reply as-is: fenced, wrapped in a <div> or with a preamble
+            parsed = parse_analysis(raw_insight_text)
+            if parsed.analysis is not None:
+                analysis = parsed.analysis
+            elif '```' in raw_insight_text or '<div' in raw_insight_text:
+                # Clearly meant to be JSON; posting it as plain text would hide the failure
+                return jsonify({'error': f"Failed to parse JSON: {'; '.join(parsed.problems)}"}), 400
 
-            match = re.search(r"```json\s*(.*?)```", raw_insight_text, re.DOTALL)
-            if match:
-                json_str = match.group(1)
+        if not analysis and not raw_insight_text:
+            return jsonify({'error': 'Either "analysis" or "raw_insight_text" must be provided.'}), 400
 
-            elif '<div' in raw_insight_text:
-                match = re.search(r"<div[^>]*>(.*?)</div>", raw_insight_text, re.DOTALL)
-                if match:
-                    json_str = match.group(1)
+        with erpnext_clients.hold(erpnext_url, api_key, api_secret, bulk_mode=bulk_mode) as erp:
+            if not data.get('idempotent', True):
+                if analysis:
+                    result = erp.post_electricity_bill_insights(analysis, bill_id)
+                else:
+                    result = erp.post_raw_text_insight(raw_insight_text, bill_id)
+                return jsonify(result)
+
+            # Retries of the same bill and analysis only send what is still missing;
+            # documents ERPNext did not accept are left for the outbox flusher
+            if analysis:
+                result = erpnext_outbox.post_bill(erp, bill_id, analysis)
+            else:
+                result = erpnext_outbox.post_raw_text(erp, bill_id, raw_insight_text)
 
-            if json_str:
-                try:
-                    analysis = json.loads(json_str)
-                except Exception as parse_err:
-                    return jsonify({'error': f'Failed to parse JSON: {parse_err}'}), 400
+        return jsonify(result), 202 if result.get('queued') else 200
 
-        if analysis:
-            result = erp.post_electricity_bill_insights(analysis, bill_id)
-        elif raw_insight_text:
-            result = erp.post_raw_text_insight(raw_insight_text, bill_id)
-        else:
-            return jsonify({'error': 'Either "analysis" or "raw_insight_text" must be provided.'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        return jsonify(result)
+@app.route('/outbox-stats', methods=['GET'])
+def outbox_stats():
+    try:
+        return jsonify(erpnext_outbox.get_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/outbox-flush', methods=['POST'])
+def outbox_flush():
+    try:
+        if request.args.get('requeue_dead') == '1':
+            erpnext_outbox.requeue_dead()
+        posted = erpnext_outbox.flush(request.args.get('batch_size', 50, type=int))
+        return jsonify({'posted': posted, **erpnext_outbox.get_stats()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5003, debug=True)
+    start_outbox_flusher()
+    app.run(host='0.0.0.0', port=5003, debug=True, use_reloader=False)
 
 
 
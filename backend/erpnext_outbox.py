@@ -0,0 +1,410 @@
+import sqlite3
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import log_event, traced, worker_id
+
+# Appended to Communication/ToDo HTML so a post with an unknown outcome can be
+# found in ERPNext again; HTML comments are not shown in the desk UI
+OUTBOX_MARKER = '<!-- outbox:{} -->'
+
+def content_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class ERPNextOutbox:
+    """Local record of the ERPNext documents created for each bill.
+
+    Every Communication, ToDo and Electricity Bill Insight is written here
+    first, keyed by (site, bill_id, record_type, content hash), and then sent.
+    Retries skip documents that were already posted, a post whose outcome is
+    unknown (timeout, crash mid-request) is looked up in ERPNext before it is
+    sent again, and anything ERPNext did not accept stays pending for flush().
+    API credentials are only held in memory; after a restart pending rows are
+    flushed with the ERP_URL / ERP_API_KEY / ERP_API_SECRET environment
+    variables or the next request for the same site.
+
+    A row being sent is leased to this outbox's process for lease_seconds,
+    which must outlast one lookup plus one POST. Other processes sharing the
+    file leave it alone until the lease expires, then check ERPNext for it
+    before sending it again.
+    """
+
+    def __init__(self, db_path='erpnext_outbox.db', clients=None, max_attempts=10,
+                 retry_backoff=30, timeout=30, lease_seconds=300):
+        self.db_path = db_path
+        self.clients = clients
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.lease_seconds = lease_seconds
+        self.owner = worker_id()
+        self._credentials = {}
+        self._credentials_lock = threading.Lock()
+        self.init_database()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def init_database(self):
+        """Initialize outbox table; rows left 'sending' by a crash are checked before resending"""
+        conn = self.connect()
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                site TEXT,
+                bill_id TEXT,
+                record_type TEXT,
+                content_hash TEXT,
+                doctype TEXT,
+                payload_json TEXT,
+                reference_json TEXT,
+                lookup_json TEXT,
+                depends_on INTEGER,
+                status TEXT,
+                erpnext_name TEXT,
+                needs_check INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                available_at REAL,
+                created_at REAL,
+                posted_at REAL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                UNIQUE (site, bill_id, record_type, content_hash)
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_status_available
+            ON outbox (status, available_at)
+        ''')
+        # Outboxes created before leases; sending rows without one count as expired
+        conn.execute('BEGIN IMMEDIATE')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(outbox)')}
+        for column, column_type in (('lease_owner', 'TEXT'), ('lease_expires_at', 'REAL')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE outbox ADD COLUMN {column} {column_type}')
+        conn.execute('COMMIT')
+
+        conn.close()
+
+    def remember(self, erp):
+        with self._credentials_lock:
+            self._credentials[erp.base_url] = (erp.api_key, erp.api_secret)
+
+    def record(self, conn, site, bill_id, record_type, source, doctype, payload,
+               reference=None, lookup=None, depends_on=None):
+        """Insert a row unless the same document was recorded before; return its id"""
+        digest = content_hash(source)
+        now = time.time()
+        conn.execute('''
+            INSERT OR IGNORE INTO outbox (site, bill_id, record_type, content_hash, doctype,
+                                          payload_json, reference_json, lookup_json, depends_on,
+                                          status, available_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+        ''', (site, str(bill_id), record_type, digest, doctype, json.dumps(payload),
+              json.dumps(reference or {}), json.dumps(lookup or []), depends_on, now, now))
+        return conn.execute('''
+            SELECT id FROM outbox
+            WHERE site = ? AND bill_id = ? AND record_type = ? AND content_hash = ?
+        ''', (site, str(bill_id), record_type, digest)).fetchone()[0]
+
+    def record_bill(self, erp, bill_id, analysis):
+        """Record the Communication, ToDos and insight for an analysis; return their row ids"""
+        site = erp.base_url
+        key = content_hash([site, str(bill_id), analysis])[:16]
+        marker = OUTBOX_MARKER.format(key)
+        subject = f"🔌 Electricity Bill Analysis - Bill #{bill_id}"
+        content = erp.format_analysis_for_erpnext(analysis) + marker
+        try:
+            insight = erp.build_bill_insight(bill_id, analysis)
+            insight_error = None
+        except Exception as e:
+            insight, insight_error = None, str(e)
+
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            comm_id = self.record(
+                conn, site, bill_id, 'communication', analysis, 'Communication',
+                erp.build_communication(subject, content),
+                lookup=[['subject', '=', subject], ['content', 'like', f'%{marker}%']]
+            )
+            todo_ids = []
+            for recommendation in analysis.get('recommendations', [])[:3]:
+                description = f"⚡ [Bill #{bill_id}] {recommendation}"
+                todo_marker = OUTBOX_MARKER.format(content_hash([key, description])[:16])
+                todo_ids.append(self.record(
+                    conn, site, bill_id, 'todo', description, 'ToDo',
+                    erp.build_todo(description + todo_marker, 'High'),
+                    reference={'reference_type': 'Communication', 'reference_name': None},
+                    lookup=[['description', 'like', f'%{todo_marker}%']],
+                    depends_on=comm_id
+                ))
+            insight_id = None
+            if insight is not None:
+                insight_id = self.record(
+                    conn, site, bill_id, 'insight', analysis, 'Electricity Bill Insight', insight,
+                    reference={'communication_reference': None},
+                    lookup=[['linked_upload', '=', insight['linked_upload']],
+                            ['analysis_date', '=', insight['analysis_date']]],
+                    depends_on=comm_id
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        return comm_id, todo_ids, insight_id, insight_error
+
+    def record_raw_text(self, erp, bill_id, raw_text):
+        site = erp.base_url
+        marker = OUTBOX_MARKER.format(content_hash([site, str(bill_id), raw_text])[:16])
+        subject, content = erp.format_raw_text_insight(raw_text, bill_id)
+        conn = self.connect()
+        try:
+            return self.record(
+                conn, site, bill_id, 'raw_text', raw_text, 'Communication',
+                erp.build_communication(subject, content + marker),
+                lookup=[['subject', '=', subject], ['content', 'like', f'%{marker}%']]
+            )
+        finally:
+            conn.close()
+
+    def post_bill(self, erp, bill_id, analysis):
+        """Exactly-once replacement for erp.post_electricity_bill_insights"""
+        self.remember(erp)
+        comm_id, todo_ids, insight_id, insight_error = self.record_bill(erp, bill_id, analysis)
+        row_ids = [comm_id] + todo_ids + ([insight_id] if insight_id else [])
+        results = self.deliver(erp, row_ids)
+        return {
+            'success': True,
+            'queued': any(result['status'] != 'posted' for result in results.values()),
+            'communication': results[comm_id],
+            'todos': [results[row_id] for row_id in todo_ids],
+            'insight': results[insight_id] if insight_id else {'success': False, 'error': insight_error}
+        }
+
+    def post_raw_text(self, erp, bill_id, raw_text):
+        self.remember(erp)
+        row_id = self.record_raw_text(erp, bill_id, raw_text)
+        result = self.deliver(erp, [row_id])[row_id]
+        result['queued'] = result['status'] != 'posted'
+        return result
+
+    def get_rows(self, row_ids):
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                f"SELECT * FROM outbox WHERE id IN ({','.join('?' * len(row_ids))})", list(row_ids)
+            ).fetchall()
+            return {row['id']: dict(row) for row in rows}
+        finally:
+            conn.close()
+
+    def deliver(self, erp, row_ids):
+        """Send the given rows: parents first, then their dependents together"""
+        rows = self.get_rows(row_ids)
+        parents = [row for row in rows.values() if row['depends_on'] is None]
+        children = [row for row in rows.values() if row['depends_on'] is not None]
+
+        results = {row['id']: self.send(erp, row) for row in parents}
+        if children:
+            if erp.bulk_mode:
+                with ThreadPoolExecutor(max_workers=min(len(children), erp.pool_size)) as executor:
+                    sent = list(executor.map(traced(lambda row: self.send(erp, row)), children))
+            else:
+                sent = [self.send(erp, row) for row in children]
+            results.update((row['id'], result) for row, result in zip(children, sent))
+        return results
+
+    def send(self, erp, row):
+        """Post one row unless it is already posted, claimed elsewhere or waiting on its parent"""
+        # Left 'sending' by a process that died mid-request: it may have been created
+        abandoned = row['status'] == 'sending' and (row['lease_expires_at'] or 0) < time.time()
+        if row['status'] != 'pending' and not abandoned:
+            return self.describe(row, deduplicated=row['status'] == 'posted')
+
+        payload = json.loads(row['payload_json'])
+        if row['depends_on'] is not None:
+            parent = self.get_rows([row['depends_on']])[row['depends_on']]
+            if parent['status'] == 'posted':
+                payload.update({field: value or parent['erpnext_name']
+                                for field, value in json.loads(row['reference_json']).items()})
+            elif parent['status'] != 'dead':
+                # Link to the Communication once it exists rather than post unlinked
+                return self.describe(row, error='waiting for communication')
+
+        if not self.claim(row['id']):
+            return self.describe(self.get_rows([row['id']])[row['id']])
+
+        if row['needs_check'] or abandoned:
+            try:
+                name = erp.find_document(row['doctype'], json.loads(row['lookup_json']))
+            except Exception as e:
+                return self.describe(self.release(row['id'], f'lookup failed: {e}', uncertain=True))
+            if name:
+                return self.describe(self.mark_posted(row['id'], name))
+
+        result = erp.create_document(row['doctype'], payload)
+        if result.get('success'):
+            return self.describe(self.mark_posted(row['id'], result['data']['data']['name']))
+        return self.describe(self.release(row['id'], result.get('error'), result.get('uncertain', False)))
+
+    def claim(self, row_id):
+        """Lease a pending row, or one whose sender's lease expired, for sending"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            cursor = conn.execute('''
+                UPDATE outbox SET needs_check = MAX(needs_check, status = 'sending'), status = 'sending',
+                                  attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?
+                WHERE id = ? AND (status = 'pending' OR (status = 'sending' AND COALESCE(lease_expires_at, 0) < ?))
+            ''', (self.owner, now + self.lease_seconds, row_id, now))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def mark_posted(self, row_id, name):
+        conn = self.connect()
+        try:
+            conn.execute('''
+                UPDATE outbox SET status = 'posted', erpnext_name = ?, error = NULL,
+                                  needs_check = 0, posted_at = ?, lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ?
+            ''', (name, time.time(), row_id))
+        finally:
+            conn.close()
+        return self.get_rows([row_id])[row_id]
+
+    def release(self, row_id, error, uncertain=False):
+        """Put a failed row back as pending with backoff, or 'dead' once attempts run out"""
+        conn = self.connect()
+        try:
+            attempts = conn.execute('SELECT attempts FROM outbox WHERE id = ?', (row_id,)).fetchone()[0]
+            status = 'dead' if attempts >= self.max_attempts else 'pending'
+            conn.execute('''
+                UPDATE outbox SET status = ?, error = ?, needs_check = MAX(needs_check, ?),
+                                  available_at = ?, lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ?
+            ''', (status, error, int(uncertain), time.time() + self.retry_backoff * attempts, row_id))
+        finally:
+            conn.close()
+        if status == 'dead':
+            log_event('outbox.dead', logging.WARNING, row_id=row_id, attempts=attempts, error=error)
+        return self.get_rows([row_id])[row_id]
+
+    def describe(self, row, deduplicated=False, error=None):
+        result = {
+            'success': row['status'] == 'posted',
+            'status': row['status'],
+            'record_type': row['record_type'],
+            'attempts': row['attempts']
+        }
+        if row['erpnext_name']:
+            result['data'] = {'data': {'name': row['erpnext_name']}}
+        if deduplicated:
+            result['deduplicated'] = True
+        if error or row['error']:
+            result['error'] = error or row['error']
+        return result
+
+    def credentials_for(self, site):
+        with self._credentials_lock:
+            credentials = self._credentials.get(site)
+        if credentials is None and (os.environ.get('ERP_URL') or '').rstrip('/') == site:
+            credentials = (os.environ.get('ERP_API_KEY'), os.environ.get('ERP_API_SECRET'))
+        if not credentials or not all(credentials) or self.clients is None:
+            return None
+        return credentials
+
+    def flush(self, batch_size=50):
+        """Send one batch of due pending rows, grouped per bill; return how many were posted"""
+        conn = self.connect()
+        try:
+            now = time.time()
+            rows = conn.execute('''
+                SELECT id, site, bill_id FROM outbox
+                WHERE (status = 'pending' AND available_at <= ?)
+                   OR (status = 'sending' AND COALESCE(lease_expires_at, 0) < ?)
+                ORDER BY id
+                LIMIT ?
+            ''', (now, now, batch_size)).fetchall()
+        finally:
+            conn.close()
+
+        groups = {}
+        for row in rows:
+            groups.setdefault((row['site'], row['bill_id']), []).append(row['id'])
+
+        posted = 0
+        for (site, _), row_ids in groups.items():
+            credentials = self.credentials_for(site)
+            if credentials is None:
+                continue
+            with self.clients.hold(site, *credentials, bulk_mode='concurrent') as erp:
+                results = self.deliver(erp, row_ids)
+            posted += sum(1 for result in results.values() if result['status'] == 'posted')
+        return posted
+
+    def requeue_dead(self):
+        conn = self.connect()
+        try:
+            return conn.execute('''
+                UPDATE outbox SET status = 'pending', attempts = 0, available_at = ?
+                WHERE status = 'dead'
+            ''', (time.time(),)).rowcount
+        finally:
+            conn.close()
+
+    def get_stats(self):
+        conn = self.connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+            oldest = conn.execute("SELECT MIN(created_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'counts': counts,
+            'oldest_pending_age': round(time.time() - oldest, 1) if oldest else None
+        }
+
+class OutboxFlusher:
+    """Background thread that drains the outbox while ERPNext is reachable"""
+
+    def __init__(self, outbox, interval=10, batch_size=50):
+        self.outbox = outbox
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='erpnext-outbox-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                # Keep going while full batches are being posted
+                while self.outbox.flush(self.batch_size) >= self.batch_size:
+                    pass
+            except Exception as e:
+                log_event('outbox.flush_failed', logging.WARNING, error=str(e))
+            self._stop.wait(self.interval)
@@ -0,0 +1,130 @@
+"""Single-process entry point for all backend services.
+
+Mounts the analyzer, database, ERPNext and job-queue route sets in one ASGI
+app so they share the analysis cache, BillDatabase and rate limiter, and adds
+an in-process /pipeline endpoint that runs analyze -> store -> post without
+HTTP hops between services.
+
+    uvicorn gateway:app --host 0.0.0.0 --port 5000 --workers 4
+"""
+import os
+import time
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import bill_analyzer
+from instrumentation import TRACE_HEADER, metrics, service_name, trace
+import database_manager
+import erpnext_integration
+import job_queue
+
+class FlaskDispatcher:
+    """WSGI app that hands each request to the first Flask app with a matching route"""
+
+    def __init__(self, apps):
+        self.apps = apps
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO') or '/'
+        method = environ.get('REQUEST_METHOD', 'GET')
+        for flask_app in self.apps:
+            if flask_app.url_map.bind('localhost').test(path, method):
+                return flask_app(environ, start_response)
+        # Let the first app produce its 404/405 response
+        return self.apps[0](environ, start_response)
+
+# Each mounted app logs its requests under its own name; events outside a
+# request (job workers, the outbox flusher) are the gateway's
+service_name['name'] = os.environ.get('SERVICE_NAME') or 'gateway'
+
+flask_apps = FlaskDispatcher([
+    bill_analyzer.app,
+    database_manager.app,
+    erpnext_integration.app,
+    job_queue.app
+])
+
+pipeline = job_queue.BillPipeline(
+    database_manager.db,
+    analyzers=bill_analyzer.analyzer_registry,
+    erpnext_clients=erpnext_integration.erpnext_clients,
+    outbox=erpnext_integration.erpnext_outbox
+)
+
+async def run_pipeline(request):
+    """Run analyze -> store -> post in process and return every stage's result"""
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse({'error': 'Request body must be JSON'}, status_code=400)
+    if not payload or not payload.get('bill_text'):
+        return JSONResponse({'error': 'bill_text is required'}, status_code=400)
+
+    # Task-local; run_in_threadpool copies it into the stage threads
+    with trace(request.headers.get(TRACE_HEADER)) as trace_id:
+        headers = {TRACE_HEADER: trace_id}
+        state = {}
+        stage_timings = {}
+        for stage, handler in pipeline.stages:
+            started = time.perf_counter()
+            try:
+                await run_in_threadpool(handler, payload, state)
+            except Exception as e:
+                stage_timings[stage] = round(time.perf_counter() - started, 4)
+                metrics.observe('pipeline_stage_seconds', stage_timings[stage], stage=stage, runner='gateway',
+                                outcome='error')
+                return JSONResponse({
+                    'success': False,
+                    'failed_stage': stage,
+                    'error': str(e),
+                    'bill_id': state.get('bill_id'),
+                    'stage_timings': stage_timings
+                }, status_code=502 if stage == 'post' else 500, headers=headers)
+            stage_timings[stage] = round(time.perf_counter() - started, 4)
+            metrics.observe('pipeline_stage_seconds', stage_timings[stage], stage=stage, runner='gateway', outcome='ok')
+
+        analysis = state['analysis']
+        return JSONResponse({
+            'success': True,
+            'bill_id': state['bill_id'],
+            'analysis': analysis,
+            'formatted_analysis': bill_analyzer.ElectricityBillAnalyzer.format_for_dashboard(analysis),
+            'erpnext': state.get('erpnext'),
+            'stage_timings': stage_timings
+        }, headers=headers)
+
+async def health(request):
+    return JSONResponse({'status': 'ok'})
+
+@asynccontextmanager
+async def lifespan(app):
+    if os.environ.get('GATEWAY_JOB_WORKERS', '1') != '0':
+        job_queue.start_workers()
+    erpnext_integration.start_outbox_flusher()
+    yield
+    if job_queue.workers is not None:
+        job_queue.workers.stop(timeout=5)
+    erpnext_integration.outbox_flusher.stop(timeout=5)
+
+app = Starlette(
+    routes=[
+        Route('/pipeline', run_pipeline, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_apps))
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
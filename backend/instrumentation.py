@@ -0,0 +1,285 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+# n8n sets this header on its HTTP Request nodes; every service echoes it back
+# and forwards it, so one bill can be followed through every hop
+TRACE_HEADER = 'X-Trace-Id'
+# Seconds; covers SQLite writes (ms) up to slow GPT-4 calls (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Share of traces whose info-level events are logged; warnings and errors always are
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
+
+current_trace = contextvars.ContextVar('trace_id', default=None)
+# Set per request, so apps mounted together under the gateway each log under
+# their own name; service_name covers events outside a request
+current_service = contextvars.ContextVar('service', default=None)
+logger = logging.getLogger('electricity')
+service_name = {'name': os.environ.get('SERVICE_NAME')}
+
+def worker_id():
+    """host:pid plus a random suffix; names the lease holder of queued work"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+def get_trace_id():
+    return current_trace.get()
+
+def trace_headers():
+    """Headers that carry the current trace to the next service"""
+    trace_id = current_trace.get()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+@contextmanager
+def trace(trace_id=None):
+    """Run the block under trace_id (a new one if None)"""
+    token = current_trace.set(trace_id or new_trace_id())
+    try:
+        yield current_trace.get()
+    finally:
+        current_trace.reset(token)
+
+def traced(fn):
+    """fn bound to the current trace id, for running on another thread.
+
+    Executor threads do not inherit context variables; each call gets its
+    own context so the wrapper is safe to map across a pool.
+    """
+    trace_id = current_trace.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = current_trace.set(trace_id)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_trace.reset(token)
+    return run
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class MetricsRegistry:
+    """Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Series are keyed by metric name plus sorted labels; one registry is
+    shared by every service in the process, so the gateway's /metrics
+    covers all of them.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = {'buckets': buckets, 'counts': [0] * (len(buckets) + 1),
+                                                  'sum': 0.0, 'count': 0}
+            series['counts'][bisect.bisect_left(series['buckets'], value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, dict(series, counts=list(series['counts'])))
+                                for key, series in self._histograms.items())
+
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        for (name, labels), value in gauges:
+            header(name, 'gauge')
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        for (name, labels), series in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(list(series['buckets']) + [float('inf')], series['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels, ("le", format_value(bound)))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(series["sum"])}')
+            lines.append(f'{name}_count{format_labels(labels)} {series["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+metrics = MetricsRegistry()
+metrics.describe('http_request_duration_seconds', 'Time to the response headers, by service and route')
+metrics.describe('operation_duration_seconds', 'Time spent in an instrumented operation')
+metrics.describe('operation_errors_total', 'Instrumented operations that raised')
+metrics.describe('llm_tokens_total', 'Tokens sent to and received from the LLM backend')
+metrics.describe('llm_tokens_last_request', 'Tokens (in + out) of the most recent LLM request')
+metrics.describe('pipeline_stage_seconds', 'Duration of each analyze / store / post stage')
+
+def sampled(trace_id=None):
+    """Whether this trace's info-level events are logged; decided once per trace"""
+    if LOG_SAMPLE_RATE >= 1:
+        return True
+    if trace_id:
+        return zlib.crc32(trace_id.encode('utf-8')) / 2 ** 32 < LOG_SAMPLE_RATE
+    return random.random() < LOG_SAMPLE_RATE
+
+def should_log(level):
+    return logger.isEnabledFor(level) and (level >= logging.WARNING or sampled(current_trace.get()))
+
+def log_event(event, level=logging.INFO, **fields):
+    """Write one JSON log line tagged with the service and trace id"""
+    if should_log(level):
+        write_event(event, level, fields)
+
+def write_event(event, level, fields):
+    record = {
+        'ts': round(time.time(), 3),
+        'level': logging.getLevelName(level).lower(),
+        'event': event,
+        'service': current_service.get() or service_name['name'],
+        'trace_id': current_trace.get()
+    }
+    record.update(fields)
+    logger.log(level, json.dumps(record, default=str, ensure_ascii=False))
+
+def configure_logging():
+    """JSON lines on stderr unless the application configured the logger itself"""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+        logger.propagate = False
+
+class timed:
+    """Record the block's duration in operation_duration_seconds{operation=...}.
+
+    A plain class rather than @contextmanager: it wraps hot paths such as
+    parse_analysis, where the generator machinery costs more than the timing.
+    """
+
+    __slots__ = ('operation', 'labels', 'started')
+
+    def __init__(self, operation, **labels):
+        self.operation = operation
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        if exc_type is not None and issubclass(exc_type, Exception):
+            metrics.inc('operation_errors_total', operation=self.operation, **self.labels)
+        metrics.observe('operation_duration_seconds', elapsed, operation=self.operation, **self.labels)
+        # Checked first so unsampled traces do not pay for building the record
+        if should_log(logging.INFO):
+            write_event('span', logging.INFO, dict(self.labels, operation=self.operation, seconds=round(elapsed, 4),
+                                                   status='ok' if exc_type is None else 'error'))
+        return False
+
+def instrument(operation=None, **labels):
+    """Decorator form of timed(); operation defaults to the function name"""
+    def decorate(fn):
+        name = operation or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def init_app(app, service):
+    """Trace ids, request metrics, error logging and GET /metrics for a Flask app"""
+    from flask import Response, g, request
+
+    service_name['name'] = service_name['name'] or service
+    configure_logging()
+
+    @app.before_request
+    def start_trace():
+        g.trace_token = current_trace.set(request.headers.get(TRACE_HEADER) or new_trace_id())
+        g.service_token = current_service.set(os.environ.get('SERVICE_NAME') or service)
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_trace(response):
+        started = g.get('request_started')
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        response.headers[TRACE_HEADER] = current_trace.get() or ''
+        if started is not None and route != '/metrics':
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - started, service=service,
+                            route=route, method=request.method, status=str(response.status_code))
+        if response.status_code >= 500:
+            log_event('http.error', logging.ERROR, route=route, status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def end_trace(error=None):
+        token = g.pop('service_token', None)
+        if token is not None:
+            current_service.reset(token)
+        token = g.pop('trace_token', None)
+        if token is not None:
+            current_trace.reset(token)
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
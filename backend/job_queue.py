@@ -0,0 +1,478 @@
+import sqlite3
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as StageTimeout
+from datetime import datetime
+
+from instrumentation import get_trace_id, init_app, log_event, metrics, new_trace_id, trace, traced, worker_id
+
+# Payload keys that are never written to disk. They are kept in memory for the
+# lifetime of the process; after a restart workers fall back to the
+# OPENAI_API_KEY / ERP_* environment variables.
+SECRET_KEYS = ('openai_api_key', 'erpnext_api_key', 'erpnext_api_secret')
+
+class JobQueue:
+    def __init__(self, db_path='jobs.db', max_attempts=3, retry_backoff=5, timeout=30, lease_seconds=60):
+        """A claimed job is leased to this queue's owner for lease_seconds and
+        renewed by the worker pool's heartbeat; another process only takes
+        it over once the lease has expired."""
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.lease_seconds = lease_seconds
+        self.owner = worker_id()
+        self._secrets = {}
+        self._secrets_lock = threading.Lock()
+        self.init_database()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def init_database(self):
+        """Initialize job table; jobs left running by a crash are reclaimed once their lease expires"""
+        conn = self.connect()
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT,
+                payload_json TEXT,
+                state_json TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER,
+                current_stage TEXT,
+                stage_timings_json TEXT,
+                available_at REAL,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                lease_owner TEXT,
+                lease_expires_at REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_available
+            ON jobs (status, available_at)
+        ''')
+        # Job tables created before leases; running rows without one count as expired
+        conn.execute('BEGIN IMMEDIATE')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in (('lease_owner', 'TEXT'), ('lease_expires_at', 'REAL')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        conn.execute('COMMIT')
+
+        conn.close()
+
+    def enqueue(self, payload):
+        """Persist a job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        stored_payload = {k: v for k, v in payload.items() if k not in SECRET_KEYS}
+        # Workers pick the trace back up, so queued work logs under the caller's trace id
+        stored_payload['trace_id'] = payload.get('trace_id') or get_trace_id() or new_trace_id()
+        secrets = {k: payload[k] for k in SECRET_KEYS if payload.get(k)}
+
+        if secrets:
+            with self._secrets_lock:
+                self._secrets[job_id] = secrets
+
+        conn = self.connect()
+        conn.execute('''
+            INSERT INTO jobs (id, status, payload_json, state_json, attempts, max_attempts,
+                              stage_timings_json, available_at, created_at)
+            VALUES (?, 'queued', ?, '{}', 0, ?, '{}', ?, ?)
+        ''', (job_id, json.dumps(stored_payload), self.max_attempts, now, now))
+        conn.close()
+
+        return job_id
+
+    def claim(self):
+        """Atomically lease the oldest runnable job, or return None.
+
+        Runnable means queued or retrying and due, or running under a lease
+        that was not renewed in time because its worker process died.
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('''
+                SELECT id FROM jobs
+                WHERE (status IN ('queued', 'retrying') AND available_at <= ?)
+                   OR (status = 'running' AND COALESCE(lease_expires_at, 0) < ?)
+                ORDER BY available_at
+                LIMIT 1
+            ''', (now, now)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                                started_at = COALESCE(started_at, ?),
+                                lease_owner = ?, lease_expires_at = ?
+                WHERE id = ?
+            ''', (now, self.owner, now + self.lease_seconds, row[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        job = self.get(row[0])
+        with self._secrets_lock:
+            job['payload'].update(self._secrets.get(job['id'], {}))
+        return job
+
+    def renew_leases(self, job_ids):
+        """Extend the leases this queue holds on job_ids; return how many it still holds"""
+        if not job_ids:
+            return 0
+        conn = self.connect()
+        cursor = conn.execute(f'''
+            UPDATE jobs SET lease_expires_at = ?
+            WHERE lease_owner = ? AND status = 'running' AND id IN ({','.join('?' * len(job_ids))})
+        ''', [time.time() + self.lease_seconds, self.owner] + list(job_ids))
+        conn.close()
+        return cursor.rowcount
+
+    # Progress and outcomes are only written while this queue holds the lease,
+    # so a worker whose lease was taken over cannot overwrite the new run
+
+    def save_progress(self, job_id, state, stage_timings, current_stage):
+        """Record finished stages so a retry can resume where it stopped"""
+        conn = self.connect()
+        conn.execute('''
+            UPDATE jobs SET state_json = ?, stage_timings_json = ?, current_stage = ?
+            WHERE id = ? AND lease_owner = ?
+        ''', (json.dumps(state), json.dumps(stage_timings), current_stage, job_id, self.owner))
+        conn.close()
+
+    def complete(self, job_id, state, stage_timings):
+        conn = self.connect()
+        conn.execute('''
+            UPDATE jobs SET status = 'succeeded', state_json = ?, stage_timings_json = ?,
+                            current_stage = NULL, error = NULL, finished_at = ?,
+                            lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ? AND lease_owner = ?
+        ''', (json.dumps(state), json.dumps(stage_timings), time.time(), job_id, self.owner))
+        conn.close()
+        self.forget_secrets(job_id)
+
+    def fail(self, job_id, error, state, stage_timings):
+        """Schedule a retry with exponential backoff, or dead-letter the job"""
+        job = self.get(job_id)
+        now = time.time()
+        conn = self.connect()
+
+        if job['attempts'] >= job['max_attempts']:
+            conn.execute('''
+                UPDATE jobs SET status = 'dead', error = ?, state_json = ?, stage_timings_json = ?,
+                                finished_at = ?, lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ? AND lease_owner = ?
+            ''', (error, json.dumps(state), json.dumps(stage_timings), now, job_id, self.owner))
+            self.forget_secrets(job_id)
+        else:
+            delay = self.retry_backoff * (2 ** (job['attempts'] - 1))
+            conn.execute('''
+                UPDATE jobs SET status = 'retrying', error = ?, state_json = ?, stage_timings_json = ?,
+                                available_at = ?, current_stage = NULL, lease_owner = NULL,
+                                lease_expires_at = NULL
+                WHERE id = ? AND lease_owner = ?
+            ''', (error, json.dumps(state), json.dumps(stage_timings), now + delay, job_id, self.owner))
+
+        conn.close()
+
+    def requeue(self, job_id):
+        """Give a dead-lettered job a fresh set of attempts"""
+        conn = self.connect()
+        cursor = conn.execute('''
+            UPDATE jobs SET status = 'queued', attempts = 0, available_at = ?, finished_at = NULL
+            WHERE id = ? AND status = 'dead'
+        ''', (time.time(), job_id))
+        conn.close()
+        return cursor.rowcount > 0
+
+    def forget_secrets(self, job_id):
+        with self._secrets_lock:
+            self._secrets.pop(job_id, None)
+
+    def get(self, job_id):
+        conn = self.connect()
+        row = conn.execute('''
+            SELECT id, status, payload_json, state_json, error, attempts, max_attempts,
+                   current_stage, stage_timings_json, created_at, started_at, finished_at
+            FROM jobs WHERE id = ?
+        ''', (job_id,)).fetchone()
+        conn.close()
+        return self.row_to_job(row) if row else None
+
+    def list_jobs(self, status=None, limit=50):
+        conn = self.connect()
+        query = '''
+            SELECT id, status, payload_json, state_json, error, attempts, max_attempts,
+                   current_stage, stage_timings_json, created_at, started_at, finished_at
+            FROM jobs
+        '''
+        params = []
+        if status:
+            query += ' WHERE status = ?'
+            params.append(status)
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return [self.row_to_job(row) for row in rows]
+
+    def get_stats(self):
+        conn = self.connect()
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        conn.close()
+        return counts
+
+    @staticmethod
+    def row_to_job(row):
+        timestamp = lambda value: datetime.fromtimestamp(value).isoformat() if value else None
+        return {
+            'id': row[0],
+            'status': row[1],
+            'payload': json.loads(row[2]),
+            'state': json.loads(row[3] or '{}'),
+            'error': row[4],
+            'attempts': row[5],
+            'max_attempts': row[6],
+            'current_stage': row[7],
+            'stage_timings': json.loads(row[8] or '{}'),
+            'created_at': timestamp(row[9]),
+            'started_at': timestamp(row[10]),
+            'finished_at': timestamp(row[11])
+        }
+
+class BillPipeline:
+    """analyze -> store -> post-to-ERPNext, resumable from the last finished stage"""
+
+    def __init__(self, db, analyzers=None, erpnext_clients=None, outbox=None, stage_timeouts=None):
+        """analyzers and erpnext_clients are ClientRegistry instances; by default
+        the ones owned by the analyzer and ERPNext services are shared, as is
+        the ERPNext outbox."""
+        if analyzers is None:
+            from bill_analyzer import analyzer_registry as analyzers
+        if erpnext_clients is None:
+            from erpnext_integration import erpnext_clients
+        if outbox is None:
+            from erpnext_integration import erpnext_outbox as outbox
+        self.db = db
+        self.analyzers = analyzers
+        self.erpnext_clients = erpnext_clients
+        self.outbox = outbox
+        self.stage_timeouts = stage_timeouts or {'analyze': 180, 'store': 30, 'post': 120}
+        self.stages = [('analyze', self.analyze), ('store', self.store), ('post', self.post)]
+
+    def analyze(self, payload, state):
+        mode = payload.get('mode', 'full')
+        api_key = payload.get('openai_api_key') or os.environ.get('OPENAI_API_KEY')
+        if not api_key and mode != 'fast':
+            raise ValueError('openai_api_key is required')
+        with self.analyzers.hold(api_key, mode=mode) as analyzer:
+            analysis = analyzer.analyze_bill(payload['bill_text'], payload.get('account_id'))
+        if 'error' in analysis:
+            raise RuntimeError(f"analysis failed: {analysis['error']}")
+        state['analysis'] = analysis
+
+    def store(self, payload, state):
+        analysis = state['analysis']
+        summary = analysis.get('bill_summary') or {}
+        if payload.get('billing_period') and not summary.get('billing_period'):
+            # Known from the row of a bill-history workbook (bulk_ingest.py)
+            analysis = dict(analysis, bill_summary=dict(summary, billing_period=payload['billing_period']))
+        # Keyed on the job id: a store abandoned after its timeout may still
+        # commit, and the retry must then pick up that bill, not add another
+        state['bill_id'] = self.db.store_bill_analysis(
+            payload.get('file_url'), payload.get('file_type'), payload['bill_text'], analysis,
+            account_id=payload.get('account_id'), job_id=payload.get('job_id')
+        )
+
+    def post(self, payload, state):
+        erpnext_url = payload.get('erpnext_url') or os.environ.get('ERP_URL')
+        api_key = payload.get('erpnext_api_key') or os.environ.get('ERP_API_KEY')
+        api_secret = payload.get('erpnext_api_secret') or os.environ.get('ERP_API_SECRET')
+        if not all([erpnext_url, api_key, api_secret]):
+            state['erpnext'] = {'skipped': 'ERPNext credentials not configured'}
+            return
+
+        # Documents ERPNext does not accept now stay in the outbox and are sent
+        # by its flusher, so an ERPNext outage does not fail the job
+        with self.erpnext_clients.hold(erpnext_url, api_key, api_secret, bulk_mode='concurrent') as erp:
+            state['erpnext'] = self.outbox.post_bill(erp, state['bill_id'], state['analysis'])
+
+class JobWorkerPool:
+    def __init__(self, queue, pipeline, workers=4, poll_interval=0.5):
+        self.queue = queue
+        self.pipeline = pipeline
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+        self._active = set()
+        self._active_lock = threading.Lock()
+        # Stage calls run here so a hung stage can be abandoned after its timeout
+        self._stage_executor = ThreadPoolExecutor(max_workers=workers * 2)
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self.heartbeat, name='job-lease-heartbeat', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._stage_executor.shutdown(wait=False)
+
+    def run(self):
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            with self._active_lock:
+                self._active.add(job['id'])
+            try:
+                self.process(job)
+            finally:
+                with self._active_lock:
+                    self._active.discard(job['id'])
+
+    def heartbeat(self):
+        """Renew the leases of running jobs well before they expire"""
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._active_lock:
+                job_ids = list(self._active)
+            try:
+                self.queue.renew_leases(job_ids)
+            except Exception as e:
+                log_event('job.lease_renewal_failed', logging.WARNING, error=str(e))
+
+    def process(self, job):
+        with trace(job['payload'].get('trace_id')):
+            self.run_stages(job)
+
+    def run_stages(self, job):
+        payload = dict(job['payload'], job_id=job['id'])
+        state = job['state']
+        timings = job['stage_timings']
+
+        for stage, handler in self.pipeline.stages:
+            if stage in state.get('completed_stages', []):
+                continue
+            self.queue.save_progress(job['id'], state, timings, stage)
+            started = time.perf_counter()
+            # Stages work on a copy so an abandoned, timed-out stage cannot
+            # change the state that gets persisted for the retry
+            stage_state = dict(state)
+            try:
+                future = self._stage_executor.submit(traced(handler), payload, stage_state)
+                future.result(timeout=self.pipeline.stage_timeouts.get(stage))
+            except StageTimeout:
+                self.record_timing(timings, stage, started, 'timeout')
+                self.queue.fail(job['id'], f'{stage} timed out', state, timings)
+                return
+            except Exception as e:
+                self.record_timing(timings, stage, started, 'error')
+                self.queue.fail(job['id'], f'{stage}: {e}', state, timings)
+                return
+            self.record_timing(timings, stage, started, 'ok')
+            state = stage_state
+            state['completed_stages'] = state.get('completed_stages', []) + [stage]
+
+        self.queue.complete(job['id'], state, timings)
+
+    def record_timing(self, timings, stage, started, outcome):
+        elapsed = time.perf_counter() - started
+        timings.setdefault(stage, []).append(round(elapsed, 4))
+        metrics.observe('pipeline_stage_seconds', elapsed, stage=stage, runner='queue', outcome=outcome)
+
+from flask import Flask, request, jsonify
+from database_manager import db
+
+app = Flask(__name__)
+init_app(app, 'job_queue')
+job_queue = JobQueue(max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 3)),
+                     lease_seconds=int(os.environ.get('JOB_LEASE_SECONDS', 60)))
+workers = None
+
+def start_workers():
+    global workers
+    if workers is None:
+        pipeline = BillPipeline(db)
+        workers = JobWorkerPool(job_queue, pipeline, workers=int(os.environ.get('JOB_WORKERS', 4)))
+        workers.start()
+    return workers
+
+@app.route('/enqueue-bill', methods=['POST'])
+def enqueue_bill():
+    try:
+        data = request.json
+        if not data or not data.get('bill_text'):
+            return jsonify({'error': 'bill_text is required'}), 400
+
+        job_id = job_queue.enqueue(data)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/job-status/{job_id}'
+        }), 202
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/job-status/<job_id>', methods=['GET'])
+def job_status(job_id):
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        job['payload'] = {k: v for k, v in job['payload'].items() if k != 'bill_text'}
+        return jsonify({'job': job})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    try:
+        status = request.args.get('status')
+        limit = request.args.get('limit', 50, type=int)
+        jobs = job_queue.list_jobs(status, limit)
+        for job in jobs:
+            job['payload'] = {k: v for k, v in job['payload'].items() if k != 'bill_text'}
+        return jsonify({'jobs': jobs, 'counts': job_queue.get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>/requeue', methods=['POST'])
+def requeue_job(job_id):
+    try:
+        if not job_queue.requeue(job_id):
+            return jsonify({'error': 'Only dead-lettered jobs can be requeued'}), 409
+        return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+if __name__ == '__main__':
+    start_workers()
+    app.run(host='0.0.0.0', port=5004, debug=True, use_reloader=False)
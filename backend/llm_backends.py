@@ -0,0 +1,286 @@
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import openai
+
+from bill_extractor import extract_bill_summary, is_complete, parse_figure
+from prompt_compactor import count_tokens
+
+OPENROUTER_URL = 'https://openrouter.ai/api/v1'
+MOCK_SERVER_URL = 'http://localhost:5005/v1'
+BACKENDS = ('openai', 'openrouter', 'mock', 'mock-server')
+
+class BackendMetrics:
+    """Call counts, error rate and latency percentiles per (backend, model).
+
+    Latency percentiles cover the last `window` calls of each pair.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, backend, model, latency, error=None):
+        with self._lock:
+            stats = self._stats.setdefault((backend, model), {
+                'calls': 0,
+                'errors': 0,
+                'latencies': deque(maxlen=self.window),
+                'last_error': None
+            })
+            stats['calls'] += 1
+            if error is not None:
+                stats['errors'] += 1
+                stats['last_error'] = str(error)[:200]
+            else:
+                stats['latencies'].append(latency)
+
+    def get_stats(self):
+        with self._lock:
+            snapshot = [(key, dict(stats, latencies=sorted(stats['latencies'])))
+                        for key, stats in self._stats.items()]
+
+        report = []
+        for (backend, model), stats in sorted(snapshot):
+            latencies = stats['latencies']
+            pick = lambda q: round(latencies[min(len(latencies) - 1, int(len(latencies) * q))], 3) if latencies else None
+            report.append({
+                'backend': backend,
+                'model': model,
+                'calls': stats['calls'],
+                'errors': stats['errors'],
+                'error_rate': stats['errors'] / stats['calls'] if stats['calls'] else 0.0,
+                'latency_mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                'latency_p50': pick(0.50),
+                'latency_p95': pick(0.95),
+                'last_error': stats['last_error']
+            })
+        return report
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+backend_metrics = BackendMetrics()
+
+class OpenAIBackend:
+    """Chat completions over the OpenAI API or a compatible endpoint.
+
+    base_url points the same client at OpenRouter or the local mock server.
+    One HTTP pool per instance (openai>=1.0); older openai releases have no
+    client object, so the key and base URL are passed on each call instead.
+    """
+
+    def __init__(self, api_key, base_url=None, name='openai', metrics=backend_metrics):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.name = name
+        self.metrics = metrics
+        self.client = None
+        if api_key and hasattr(openai, 'OpenAI'):
+            # Retries are handled by ElectricityBillAnalyzer.create_completion
+            self.client = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+    def complete(self, **kwargs):
+        """One chat completion; streams are timed until their last chunk"""
+        started = time.perf_counter()
+        try:
+            if self.client is not None:
+                response = self.client.chat.completions.create(**kwargs)
+            elif self.base_url:
+                response = openai.ChatCompletion.create(api_key=self.api_key, api_base=self.base_url, **kwargs)
+            else:
+                response = openai.ChatCompletion.create(api_key=self.api_key, **kwargs)
+        except Exception as e:
+            self.metrics.record(self.name, kwargs.get('model'), time.perf_counter() - started, e)
+            raise
+        if kwargs.get('stream'):
+            return self.timed_stream(response, kwargs.get('model'), started)
+        self.metrics.record(self.name, kwargs.get('model'), time.perf_counter() - started)
+        return response
+
+    def timed_stream(self, stream, model, started):
+        try:
+            for chunk in stream:
+                yield chunk
+        except Exception as e:
+            self.metrics.record(self.name, model, time.perf_counter() - started, e)
+            raise
+        self.metrics.record(self.name, model, time.perf_counter() - started)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+def mock_analysis(bill_text, model):
+    """Deterministic analysis of a bill from its locally extracted figures"""
+    summary = extract_bill_summary(bill_text)
+    units = parse_figure(summary.get('units_consumed'))
+    if units is None:
+        rating = 'average'
+    elif units < 150:
+        rating = 'excellent'
+    elif units < 300:
+        rating = 'good'
+    elif units < 500:
+        rating = 'average'
+    else:
+        rating = 'poor'
+
+    return {
+        'bill_summary': {field: summary.get(field, '') for field in
+                         ('billing_period', 'total_amount', 'units_consumed', 'rate_per_unit')},
+        'consumption_analysis': {
+            'consumption_trend': f'{summary.get("units_consumed", "Unknown usage")} this period',
+            'peak_usage_period': 'Not stated on the bill',
+            'efficiency_rating': rating
+        },
+        'cost_insights': {
+            'cost_breakdown': f'Total payable {summary.get("total_amount", "not found")}',
+            'hidden_charges': 'None identified',
+            'savings_potential': '10-15% with load shifting' if rating in ('average', 'poor') else 'Limited'
+        },
+        'recommendations': [
+            'Shift heavy appliance use to off-peak hours',
+            'Check appliances with high standby consumption',
+            'Compare this bill with the same month last year'
+        ],
+        'anomalies': [] if rating != 'poor' else ['Consumption is well above a typical household'],
+        'comparison_metrics': {
+            'average_household_comparison': f'Rated {rating} against a 250 kWh household',
+            'seasonal_factors': 'Not assessed by the mock backend'
+        },
+        'action_items': ['Review the next bill for changes'],
+        'mock_model': model
+    }
+
+def mock_reply(messages, model, invalid_share=0.0):
+    """Content and token counts a model would return for these messages.
+
+    The bill is whatever follows "BILL DATA:" in the last message. A
+    deterministic invalid_share of prompts (by hash) get a reply that
+    fails validate_analysis, to exercise escalation.
+    """
+    prompt = messages[-1]['content'] if messages else ''
+    bill_text = prompt.split('BILL DATA:', 1)[-1]
+    analysis = mock_analysis(bill_text, model)
+
+    digest = hashlib.sha256(f'{model}\n{prompt}'.encode('utf-8')).digest()
+    if int.from_bytes(digest[:4], 'big') / 2 ** 32 < invalid_share:
+        analysis['recommendations'] = []
+        analysis['consumption_analysis']['efficiency_rating'] = 'unknown'
+
+    content = json.dumps(analysis, indent=2)
+    prompt_tokens = sum(count_tokens(message.get('content') or '', model) for message in messages)
+    return content, prompt_tokens, count_tokens(content, model)
+
+class MockBackend:
+    """In-process stand-in for an LLM: no network, same response shape as openai.
+
+    Replies come from mock_reply. Each call sleeps latency plus
+    token_latency per output token, scaled by model_speeds[model]
+    (e.g. {'gpt-4o-mini': 0.3}); invalid_share maps a model to the share
+    of its replies that fail validation.
+    """
+
+    def __init__(self, latency=0.0, token_latency=0.0, model_speeds=None, invalid_share=None,
+                 name='mock', metrics=backend_metrics):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.model_speeds = model_speeds or {}
+        self.invalid_share = invalid_share or {}
+        self.name = name
+        self.metrics = metrics
+
+    def delay(self, model, tokens_out):
+        return (self.latency + self.token_latency * tokens_out) * self.model_speeds.get(model, 1.0)
+
+    def complete(self, **kwargs):
+        started = time.perf_counter()
+        model = kwargs.get('model')
+        content, tokens_in, tokens_out = mock_reply(kwargs.get('messages') or [], model,
+                                                    self.invalid_share.get(model, 0.0))
+        delay = self.delay(model, tokens_out)
+        if kwargs.get('stream'):
+            return self.stream(content, model, delay, started)
+        time.sleep(delay)
+        self.metrics.record(self.name, model, time.perf_counter() - started)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role='assistant', content=content),
+                                     finish_reason='stop')],
+            usage=SimpleNamespace(prompt_tokens=tokens_in, completion_tokens=tokens_out,
+                                  total_tokens=tokens_in + tokens_out),
+            model=model
+        )
+
+    def stream(self, content, model, delay, started, chunk_size=16):
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        for text in chunks:
+            time.sleep(delay / len(chunks))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+        self.metrics.record(self.name, model, time.perf_counter() - started)
+
+    def close(self):
+        pass
+
+def create_backend(kind, api_key=None, base_url=None, **options):
+    """Backend by name: openai, openrouter, mock (in-process) or mock-server"""
+    if kind == 'openai':
+        return OpenAIBackend(api_key, base_url, name='openai')
+    if kind == 'openrouter':
+        return OpenAIBackend(api_key, base_url or OPENROUTER_URL, name='openrouter')
+    if kind == 'mock':
+        return MockBackend(**options)
+    if kind == 'mock-server':
+        return OpenAIBackend(api_key or 'mock', base_url or MOCK_SERVER_URL, name='mock-server')
+    raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+
+class ModelRouter:
+    """Send short or simple bills to a cheaper model and escalate failures.
+
+    A bill is short when it has at most max_fast_tokens tokens and simple
+    when every bill_summary field can be read locally. Those go to
+    fast_model; everything else, and any fast reply that fails validation,
+    goes to strong_model.
+    """
+
+    def __init__(self, fast_model, strong_model='gpt-4', max_fast_tokens=1200):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.max_fast_tokens = max_fast_tokens
+        self.routed = {fast_model: 0, strong_model: 0}
+        self.escalations = 0
+        self.last_problems = None
+        self._lock = threading.Lock()
+
+    def choose(self, bill_text, bill_summary=None):
+        short = count_tokens(bill_text or '', self.strong_model) <= self.max_fast_tokens
+        if bill_summary is None:
+            bill_summary = extract_bill_summary(bill_text)
+        model = self.fast_model if short or is_complete(bill_summary) else self.strong_model
+        with self._lock:
+            self.routed[model] = self.routed.get(model, 0) + 1
+        return model
+
+    def record_escalation(self, problems):
+        with self._lock:
+            self.escalations += 1
+            self.last_problems = problems
+
+    def get_stats(self):
+        with self._lock:
+            fast_calls = self.routed.get(self.fast_model, 0)
+            return {
+                'fast_model': self.fast_model,
+                'strong_model': self.strong_model,
+                'max_fast_tokens': self.max_fast_tokens,
+                'routed': dict(self.routed),
+                'escalations': self.escalations,
+                'escalation_rate': self.escalations / fast_calls if fast_calls else 0.0,
+                'last_problems': self.last_problems
+            }
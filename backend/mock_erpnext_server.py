@@ -0,0 +1,127 @@
+"""ERPNext REST stand-in for tests and benchmarks.
+
+Implements the calls ERPNextIntegration makes: POST and filtered GET on
+/api/resource/<doctype> and /api/method/frappe.client.insert_many.
+Documents are kept in memory and get sequential names, so the outbox's
+lookups find what was created earlier. Point /post-to-erpnext at it with
+erpnext_url=http://localhost:5006 and any api_key / api_secret.
+
+    MOCK_ERPNEXT_LATENCY=0.05 MOCK_ERPNEXT_ERROR_SHARE=0.02 python mock_erpnext_server.py
+
+MOCK_ERPNEXT_ERROR_SHARE and MOCK_ERPNEXT_RATE_LIMIT_SHARE make that share
+of requests fail with a 500 or a 417 (ERPNext's reply when its rate limit
+is hit).
+"""
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+LATENCY = float(os.environ.get('MOCK_ERPNEXT_LATENCY', 0))
+ERROR_SHARE = float(os.environ.get('MOCK_ERPNEXT_ERROR_SHARE', 0))
+RATE_LIMIT_SHARE = float(os.environ.get('MOCK_ERPNEXT_RATE_LIMIT_SHARE', 0))
+
+class DocumentStore:
+    """In-memory documents per doctype with ERPNext-style names"""
+
+    def __init__(self):
+        self.documents = {}
+        self.numbers = Counter()
+        self.lock = threading.Lock()
+
+    def insert(self, doctype, data):
+        with self.lock:
+            self.numbers[doctype] += 1
+            prefix = ''.join(word[0] for word in doctype.split()).upper()
+            document = dict(data, doctype=doctype, name=f'{prefix}-{self.numbers[doctype]:05d}',
+                            creation=time.strftime('%Y-%m-%d %H:%M:%S'))
+            self.documents.setdefault(doctype, []).append(document)
+            return document
+
+    def find(self, doctype, filters, limit):
+        """Documents matching [field, '=' | 'like', value] filters, newest first"""
+        with self.lock:
+            documents = list(reversed(self.documents.get(doctype, [])))
+        matches = []
+        for document in documents:
+            if all(matches_filter(document, *condition) for condition in filters):
+                matches.append(document)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def get_stats(self):
+        with self.lock:
+            return {doctype: len(documents) for doctype, documents in self.documents.items()}
+
+def matches_filter(document, field, operator, value):
+    actual = document.get(field)
+    if operator == '=':
+        return actual == value
+    if operator == 'like':
+        return value.strip('%') in str(actual or '')
+    raise ValueError(f'unsupported filter operator {operator}')
+
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+store = DocumentStore()
+request_numbers = itertools.count(1)
+requests_served = {'total': 0}
+
+def injected_failure():
+    """A 417 or 500 for a fixed share of requests, chosen by hashing the request number"""
+    number = next(request_numbers)
+    requests_served['total'] = number
+    digest = hashlib.sha256(str(number).encode('utf-8')).digest()
+    bucket = int.from_bytes(digest[:4], 'big') / 2 ** 32
+    if bucket < RATE_LIMIT_SHARE:
+        return jsonify({'exc_type': 'RateLimitExceededError', 'exception': 'Too Many Requests'}), 417
+    if bucket < RATE_LIMIT_SHARE + ERROR_SHARE:
+        return jsonify({'exc_type': 'Exception', 'exception': 'Mock server error'}), 500
+    return None
+
+@app.before_request
+def simulate_network():
+    if request.path == '/health':
+        return None
+    if not request.headers.get('Authorization', '').startswith('token '):
+        return jsonify({'exc_type': 'AuthenticationError', 'exception': 'Not permitted'}), 401
+    time.sleep(LATENCY)
+    return injected_failure()
+
+@app.route('/api/resource/<doctype>', methods=['POST'])
+def create_document(doctype):
+    try:
+        return jsonify({'data': store.insert(doctype, request.json or {})})
+    except Exception as e:
+        return jsonify({'exc_type': 'Exception', 'exception': str(e)}), 500
+
+@app.route('/api/resource/<doctype>', methods=['GET'])
+def list_documents(doctype):
+    try:
+        filters = json.loads(request.args.get('filters') or '[]')
+        fields = json.loads(request.args.get('fields') or '["name"]')
+        limit = request.args.get('limit_page_length', 20, type=int)
+        documents = store.find(doctype, filters, limit)
+        return jsonify({'data': [{field: document.get(field) for field in fields} for document in documents]})
+    except Exception as e:
+        return jsonify({'exc_type': 'Exception', 'exception': str(e)}), 500
+
+@app.route('/api/method/frappe.client.insert_many', methods=['POST'])
+def insert_many():
+    try:
+        docs = (request.json or {}).get('docs') or []
+        return jsonify({'message': [store.insert(doc.get('doctype'), doc)['name'] for doc in docs]})
+    except Exception as e:
+        return jsonify({'exc_type': 'Exception', 'exception': str(e)}), 500
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok', 'requests': requests_served['total'], 'documents': store.get_stats()})
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5006, debug=True, threaded=True)
@@ -0,0 +1,131 @@
+"""OpenAI-compatible chat completions server with deterministic replies.
+
+Stands in for OpenAI / OpenRouter in tests and benchmarks: point the
+analyzer at it with LLM_BACKEND=mock-server (or LLM_BASE_URL). Replies are
+built from the bill figures by llm_backends.mock_reply, so the same prompt
+always gets the same analysis.
+
+    MOCK_LLM_LATENCY=0.5 MOCK_LLM_TOKEN_LATENCY=0.005 python mock_llm_server.py
+
+MOCK_LLM_MODEL_SPEEDS (e.g. "gpt-4o-mini=0.3") scales the delay per model
+and MOCK_LLM_INVALID_SHARE (e.g. "gpt-4o-mini=0.2") makes that share of a
+model's replies fail validation.
+"""
+import hashlib
+import itertools
+import json
+import os
+import time
+import uuid
+
+from llm_backends import MockBackend, mock_reply
+
+def parse_model_map(value):
+    """'model=0.3,other=1.5' -> {'model': 0.3, 'other': 1.5}"""
+    mapping = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            model, number = item.rsplit('=', 1)
+            mapping[model.strip()] = float(number)
+    return mapping
+
+from flask import Flask, Response, request, jsonify
+
+app = Flask(__name__)
+# Only used for its delay model; replies are built here so they can be served as JSON
+timing = MockBackend(
+    latency=float(os.environ.get('MOCK_LLM_LATENCY', 0)),
+    token_latency=float(os.environ.get('MOCK_LLM_TOKEN_LATENCY', 0)),
+    model_speeds=parse_model_map(os.environ.get('MOCK_LLM_MODEL_SPEEDS')),
+    invalid_share=parse_model_map(os.environ.get('MOCK_LLM_INVALID_SHARE'))
+)
+# Optional failure injection: this share of requests gets a 500 or a 429
+ERROR_SHARE = float(os.environ.get('MOCK_LLM_ERROR_SHARE', 0))
+RATE_LIMIT_SHARE = float(os.environ.get('MOCK_LLM_RATE_LIMIT_SHARE', 0))
+request_numbers = itertools.count(1)
+requests_served = {'total': 0}
+
+def injected_failure(key):
+    """A 429 or 500 for a fixed share of requests, chosen by hashing key"""
+    digest = hashlib.sha256(key.encode('utf-8')).digest()
+    bucket = int.from_bytes(digest[:4], 'big') / 2 ** 32
+    if bucket < RATE_LIMIT_SHARE:
+        return jsonify({'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}}), 429
+    if bucket < RATE_LIMIT_SHARE + ERROR_SHARE:
+        return jsonify({'error': {'message': 'Mock server error', 'type': 'server_error'}}), 500
+    return None
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    try:
+        data = request.json or {}
+        model = data.get('model', 'mock')
+        messages = data.get('messages') or []
+        number = next(request_numbers)
+        requests_served['total'] = number
+
+        # Keyed on the request number too, so a retried request can succeed
+        failure = injected_failure(f'{number}:{json.dumps(messages, sort_keys=True)}')
+        if failure is not None:
+            return failure
+
+        content, tokens_in, tokens_out = mock_reply(messages, model, timing.invalid_share.get(model, 0.0))
+        delay = timing.delay(model, tokens_out)
+        completion_id = f'chatcmpl-{uuid.uuid4().hex[:24]}'
+        created = int(time.time())
+
+        if data.get('stream'):
+            def generate():
+                pieces = [content[i:i + 16] for i in range(0, len(content), 16)]
+                for piece in pieces:
+                    time.sleep(delay / len(pieces))
+                    yield 'data: ' + json.dumps({
+                        'id': completion_id,
+                        'object': 'chat.completion.chunk',
+                        'created': created,
+                        'model': model,
+                        'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]
+                    }) + '\n\n'
+                yield 'data: ' + json.dumps({
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': created,
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+                }) + '\n\n'
+                yield 'data: [DONE]\n\n'
+
+            return Response(generate(), mimetype='text/event-stream')
+
+        time.sleep(delay)
+        return jsonify({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': tokens_in,
+                'completion_tokens': tokens_out,
+                'total_tokens': tokens_in + tokens_out
+            }
+        })
+
+    except Exception as e:
+        return jsonify({'error': {'message': str(e), 'type': 'server_error'}}), 500
+
+@app.route('/v1/models', methods=['GET'])
+def list_models():
+    models = sorted(set(timing.model_speeds) | set(timing.invalid_share) | {'gpt-4'})
+    return jsonify({'object': 'list', 'data': [{'id': model, 'object': 'model'} for model in models]})
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok', 'requests': requests_served['total']})
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5005, debug=True, threaded=True)
@@ -0,0 +1,130 @@
+import re
+from collections import Counter
+
+# Lines matching these are tariff boilerplate, not bill data
+BOILERPLATE_PATTERNS = [
+    r'terms\s+(?:and|&)\s+conditions',
+    r'computer[\s-]+generated',
+    r'does\s+not\s+require\s+(?:a\s+)?signature',
+    r'subject\s+to\s+.*jurisdiction',
+    r'disclaimer',
+    r'for\s+(?:any\s+)?(?:complaints?|queries|grievances?)',
+    r'toll[\s-]+free',
+    r'customer\s+care',
+    r'(?:visit|log\s*on\s+to)\s+(?:us\s+at\s+)?(?:www\.|https?://)',
+    r'pay\s+(?:online|through|via)',
+    r'please\s+(?:ignore|note|quote)',
+    r'save\s+(?:electricity|energy|power)',
+    r'regulation\s+\d+',
+    r'as\s+per\s+(?:the\s+)?(?:tariff\s+)?(?:order|regulations?|act)',
+    r'electricity\s+act'
+]
+BOILERPLATE_RE = re.compile('|'.join(BOILERPLATE_PATTERNS), re.IGNORECASE)
+
+# Sections mentioning these carry the figures the analysis needs
+KEY_TERMS_RE = re.compile(
+    r'amount|payable|total|due|units?|kwh|reading|period|month|charge|tariff|rate|'
+    r'consum|demand|load|arrear|subsidy|surcharge|rebate|tax|duty',
+    re.IGNORECASE
+)
+
+_encoder = None
+
+def count_tokens(text, model='gpt-4'):
+    """Count tokens with tiktoken when installed, else estimate ~4 chars per token"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            try:
+                _encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoder = tiktoken.get_encoding('cl100k_base')
+        except ImportError:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text))
+    return (len(text) + 3) // 4
+
+def normalize_whitespace(text):
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\f', '\n\n')
+    text = re.sub(r'[ \t\u00a0]+', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+def strip_repeated_lines(text, min_repeats=2):
+    """Keep only the first copy of lines that repeat, e.g. page headers and footers"""
+    lines = text.split('\n')
+    counts = Counter(line for line in lines if line)
+    seen = set()
+    kept = []
+    for line in lines:
+        if line and counts[line] >= min_repeats:
+            if line in seen:
+                continue
+            seen.add(line)
+        kept.append(line)
+    return '\n'.join(kept)
+
+def strip_boilerplate(text):
+    return '\n'.join(line for line in text.split('\n') if not BOILERPLATE_RE.search(line))
+
+def split_sections(text):
+    return [section for section in re.split(r'\n\s*\n|\f', text) if section.strip()]
+
+def fit_to_budget(text, budget, model='gpt-4'):
+    """Shrink text to at most budget tokens, keeping the sections with bill figures.
+
+    Sections without key terms are first reduced to their lines that contain
+    numbers, then dropped from the end; key sections are only cut as a last
+    resort.
+    """
+    if count_tokens(text, model) <= budget:
+        return text
+
+    sections = split_sections(text)
+    key = [bool(KEY_TERMS_RE.search(section)) for section in sections]
+    reduced = [
+        section if is_key else '\n'.join(line for line in section.split('\n') if re.search(r'\d', line))
+        for section, is_key in zip(sections, key)
+    ]
+
+    joined = lambda parts: '\n\n'.join(part for part in parts if part)
+    if count_tokens(joined(reduced), model) <= budget:
+        return joined(reduced)
+
+    for index in reversed(range(len(reduced))):
+        if not key[index]:
+            reduced[index] = ''
+            if count_tokens(joined(reduced), model) <= budget:
+                return joined(reduced)
+
+    text = joined(reduced)
+    # Still over budget: keep the head of the bill, where the summary usually is
+    marker = '\n[...truncated]'
+    budget = max(1, budget - count_tokens(marker, model))
+    chars = max(1, int(len(text) * budget / max(1, count_tokens(text, model))))
+    while chars > 0 and count_tokens(text[:chars], model) > budget:
+        chars = int(chars * 0.9)
+    return text[:chars] + marker
+
+class PromptCompactor:
+    def __init__(self, token_budget=1500, model='gpt-4'):
+        self.token_budget = token_budget
+        self.model = model
+
+    def compact(self, bill_text):
+        """Return (compacted_text, stats) for one bill"""
+        tokens_before = count_tokens(bill_text or '', self.model)
+        text = normalize_whitespace(bill_text or '')
+        text = strip_repeated_lines(text)
+        text = strip_boilerplate(text)
+        text = normalize_whitespace(text)
+        if self.token_budget:
+            text = fit_to_budget(text, self.token_budget, self.model)
+        tokens_after = count_tokens(text, self.model)
+        return text, {
+            'bill_tokens_before': tokens_before,
+            'bill_tokens_after': tokens_after,
+            'token_budget': self.token_budget
+        }
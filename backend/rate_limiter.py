@@ -0,0 +1,42 @@
+import random
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """rate is tokens added per second; capacity caps the burst size"""
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, tokens=1):
+        """Block until enough tokens are available, then take them"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+def is_rate_limit_error(error):
+    """True for HTTP 429 errors from openai, requests or httpx"""
+    if type(error).__name__ == 'RateLimitError':
+        return True
+    for attr in ('http_status', 'status_code'):
+        if getattr(error, attr, None) == 429:
+            return True
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 429
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Full-jitter exponential backoff for the given retry attempt"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
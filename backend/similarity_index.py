@@ -0,0 +1,335 @@
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from bill_extractor import is_complete, parse_figure
+
+TOKEN_RE = re.compile(r'[a-z]+|\d+(?:[.,]\d+)*')
+# Plain digit runs this long are identifiers (consumer, meter, account numbers) and
+# are kept; shorter ones are amounts, readings and dates, which change every
+# month and are compared separately through COMPARED_FIGURES
+IDENTIFIER_DIGITS = 6
+# Month names change every bill too, like dates written as numbers
+MONTH_NAMES = {
+    'jan', 'january', 'feb', 'february', 'mar', 'march', 'apr', 'april', 'may', 'jun', 'june',
+    'jul', 'july', 'aug', 'august', 'sep', 'sept', 'september', 'oct', 'october', 'nov',
+    'november', 'dec', 'december'
+}
+
+# Bookkeeping keys that are not part of an analysis worth reusing or showing
+EXAMPLE_SKIP_KEYS = ('analysis_date', 'raw_analysis', 'usage', 'analysis_source', 'similar_to', 'error',
+                     'figures', 'validation_errors')
+
+# Figures that must stay close for a neighbour's narrative to still hold
+COMPARED_FIGURES = ('total_amount', 'units_consumed')
+
+def hashed_features(text, dimensions):
+    """Sparse hashed term frequencies of words, word pairs and identifiers.
+
+    Short numbers all count as one '#' term and month names as one '@'
+    term. Each term lands in one of `dimensions` buckets with a hash-derived sign,
+    so collisions tend to cancel rather than add up. Returns (indices, values)
+    with sublinear (1 + log count) weights.
+    """
+    tokens = []
+    for token in TOKEN_RE.findall((text or '').lower()):
+        if token[0].isdigit() and not (token.isdigit() and len(token) >= IDENTIFIER_DIGITS):
+            token = '#'
+        elif token in MONTH_NAMES:
+            token = '@'
+        tokens.append(token)
+    terms = Counter(tokens)
+    terms.update(f'{first} {second}' for first, second in zip(tokens, tokens[1:]))
+
+    buckets = {}
+    for term, count in terms.items():
+        digest = zlib.crc32(term.encode('utf-8'))
+        sign = 1.0 if digest & 0x80000000 else -1.0
+        bucket = digest % dimensions
+        buckets[bucket] = buckets.get(bucket, 0.0) + sign * (1.0 + math.log(count))
+
+    indices = np.fromiter(buckets.keys(), dtype=np.int32, count=len(buckets))
+    values = np.fromiter(buckets.values(), dtype=np.float32, count=len(buckets))
+    return indices, values
+
+def pack_features(indices, values):
+    return indices.astype(np.int32).tobytes() + values.astype(np.float32).tobytes()
+
+def unpack_features(blob):
+    half = len(blob) // 2
+    return np.frombuffer(blob[:half], dtype=np.int32), np.frombuffer(blob[half:], dtype=np.float32)
+
+def figures_close(summary, previous, max_change):
+    """True when every compared figure is known for both bills and within max_change"""
+    for field in COMPARED_FIGURES:
+        current = parse_figure((summary or {}).get(field))
+        earlier = parse_figure((previous or {}).get(field))
+        if current is None or earlier is None:
+            return False
+        if abs(current - earlier) > max_change * max(abs(earlier), 1e-9):
+            return False
+    return True
+
+class SimilarityIndex:
+    """Nearest previously analyzed bill, by hashed TF-IDF cosine similarity.
+
+    Vectors live in one contiguous float32 matrix that grows by doubling, so
+    adding a bill is amortized O(1) and a lookup is a single matrix-vector
+    product. Analyses and their sparse term frequencies are kept in SQLite,
+    which is read back on startup.
+
+    plan() decides what to do with a new bill:
+
+      reuse    similarity >= reuse_threshold, every bill_summary field could
+               be extracted locally and total amount and units are within
+               max_figure_change of the neighbour's: its narrative is reused
+               with this bill's own figures, no LLM call
+      example  similarity >= example_threshold: the neighbour's analysis is
+               sent as a worked example in place of the format description
+      miss     a full analysis
+    """
+
+    def __init__(self, db_path='similarity_index.db', dimensions=1024, max_entries=20000,
+                 reuse_threshold=0.95, example_threshold=0.75, max_figure_change=0.15):
+        self.db_path = db_path
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.reuse_threshold = reuse_threshold
+        self.example_threshold = example_threshold
+        self.max_figure_change = max_figure_change
+        self.lookups = 0
+        self.outcomes = {'reuse': 0, 'example': 0, 'miss': 0}
+        self.lookup_seconds = 0.0
+        self.seconds_saved = 0.0
+        # Running means of LLM latency and prompt size for full and example calls
+        self.call_stats = {action: {'calls': 0, 'latency': 0.0, 'tokens_in': 0.0}
+                           for action in ('example', 'miss')}
+        self._lock = threading.Lock()
+        self.init_database()
+        self.load()
+
+    def init_database(self):
+        """Initialize index table"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS similar_bills (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                variant TEXT,
+                text_hash TEXT,
+                features BLOB,
+                analysis_json TEXT,
+                created_at REAL,
+                UNIQUE (variant, text_hash)
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def load(self):
+        """Rebuild the in-memory matrix and document frequencies from SQLite"""
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('SELECT id, variant, features FROM similar_bills ORDER BY id').fetchall()
+        conn.close()
+
+        with self._lock:
+            self._variants = {}
+            self._ids = np.zeros(max(len(rows), 64), dtype=np.int64)
+            self._variant_codes = np.zeros(len(self._ids), dtype=np.int32)
+            self._matrix = np.zeros((len(self._ids), self.dimensions), dtype=np.float32)
+            self._features = []
+            self._df = np.zeros(self.dimensions, dtype=np.int64)
+            self._count = 0
+            for row in rows:
+                self._append(row[0], row[1], *unpack_features(row[2]))
+            self.reweight()
+
+    def reweight(self):
+        """Recompute IDF from the current document frequencies and re-weight every row.
+
+        Rows and queries must share one IDF for identical bills to score 1.0,
+        so it is frozen in between and refreshed each time the index grows
+        by a tenth. Call with the lock held.
+        """
+        documents = self._count
+        self._idf = (np.log((1.0 + documents) / (1.0 + self._df)) + 1.0).astype(np.float32)
+        self._idf_documents = documents
+        if not documents:
+            return
+        lengths = [len(indices) for indices, _ in self._features]
+        rows = np.repeat(np.arange(documents), lengths)
+        columns = np.concatenate([indices for indices, _ in self._features])
+        weights = np.concatenate([values for _, values in self._features]) * self._idf[columns]
+
+        matrix = self._matrix[:documents]
+        matrix[:] = 0.0
+        matrix[rows, columns] = weights
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+    def vectorize(self, indices, values):
+        """Unit-length TF-IDF vector from sparse term frequencies"""
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        vector[indices] = values * self._idf[indices]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _append(self, entry_id, variant, indices, values):
+        if self._count == len(self._ids):
+            capacity = len(self._ids) * 2
+            self._ids = np.resize(self._ids, capacity)
+            self._variant_codes = np.resize(self._variant_codes, capacity)
+            matrix = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            matrix[:self._count] = self._matrix[:self._count]
+            self._matrix = matrix
+        self._ids[self._count] = entry_id
+        self._variant_codes[self._count] = self._variants.setdefault(variant, len(self._variants))
+        self._features.append((indices, values))
+        self._df[indices] += 1
+        self._count += 1
+
+    def search(self, bill_text, variant):
+        """(entry id, cosine similarity) of the closest bill with this variant, or (None, 0.0)"""
+        indices, values = hashed_features(bill_text, self.dimensions)
+        with self._lock:
+            code = self._variants.get(variant)
+            if code is None or not len(indices):
+                return None, 0.0
+            scores = self._matrix[:self._count] @ self.vectorize(indices, values)
+            scores[self._variant_codes[:self._count] != code] = -1.0
+            # Several bills of an account often score alike; prefer the latest
+            best = int(np.flatnonzero(scores >= scores.max() - 1e-6)[-1])
+            if scores[best] <= 0:
+                return None, 0.0
+            return int(self._ids[best]), float(scores[best])
+
+    def get_analysis(self, entry_id):
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute('SELECT analysis_json FROM similar_bills WHERE id = ?', (entry_id,)).fetchone()
+        conn.close()
+        return json.loads(row[0]) if row else None
+
+    def plan(self, bill_text, variant, bill_summary=None):
+        """Look up the nearest bill and choose reuse, example or miss (see class docstring)"""
+        started = time.perf_counter()
+        entry_id, similarity = self.search(bill_text, variant)
+        analysis = self.get_analysis(entry_id) if similarity >= self.example_threshold else None
+
+        action = 'miss'
+        if analysis is not None:
+            action = 'example'
+            if (similarity >= self.reuse_threshold and bill_summary and is_complete(bill_summary)
+                    and figures_close(bill_summary, analysis.get('bill_summary'), self.max_figure_change)):
+                action = 'reuse'
+
+        with self._lock:
+            self.lookups += 1
+            self.lookup_seconds += time.perf_counter() - started
+        return {
+            'action': action,
+            'entry_id': entry_id,
+            'similarity': round(similarity, 4),
+            'analysis': analysis
+        }
+
+    @staticmethod
+    def example_json(analysis):
+        """Compact JSON of an analysis without bookkeeping keys, for prompts"""
+        example = {key: value for key, value in analysis.items() if key not in EXAMPLE_SKIP_KEYS}
+        return json.dumps(example, ensure_ascii=False, separators=(',', ':'))
+
+    def add(self, bill_text, variant, analysis):
+        """Index a freshly analyzed bill; returns its entry id, or None if already indexed"""
+        text_hash = hashlib.sha256(re.sub(r'\s+', ' ', bill_text or '').strip().encode('utf-8')).hexdigest()
+        stored = {key: value for key, value in analysis.items() if key not in EXAMPLE_SKIP_KEYS}
+        indices, values = hashed_features(bill_text, self.dimensions)
+        if not len(indices):
+            return None
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO similar_bills (variant, text_hash, features, analysis_json, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (variant, text_hash, pack_features(indices, values), json.dumps(stored), time.time()))
+        entry_id = cursor.lastrowid if cursor.rowcount else None
+        conn.commit()
+        conn.close()
+        if entry_id is None:
+            return None
+
+        with self._lock:
+            self._append(entry_id, variant, indices, values)
+            if self._count >= self._idf_documents * 1.1 + 1:
+                self.reweight()
+            else:
+                self._matrix[self._count - 1] = self.vectorize(indices, values)
+            over = self._count - self.max_entries if self.max_entries else 0
+        if over > 0:
+            self.evict(max(over, self.max_entries // 10))
+        return entry_id
+
+    def evict(self, count):
+        """Drop the oldest entries and rebuild the matrix"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('DELETE FROM similar_bills WHERE id IN (SELECT id FROM similar_bills ORDER BY id LIMIT ?)',
+                     (count,))
+        conn.commit()
+        conn.close()
+        self.load()
+
+    def record(self, action, latency=None, tokens_in=None):
+        """Count a plan() outcome; latency / tokens_in are those of the LLM call made, if any.
+
+        Time saved is measured against the running mean latency of full
+        analyses: all of it for a reuse, the difference for an example call.
+        """
+        with self._lock:
+            self.outcomes[action] += 1
+            stats = self.call_stats.get(action)
+            if stats is not None and latency is not None:
+                stats['calls'] += 1
+                stats['latency'] += (latency - stats['latency']) / stats['calls']
+                if tokens_in is not None:
+                    stats['tokens_in'] += (tokens_in - stats['tokens_in']) / stats['calls']
+            baseline = self.call_stats['miss']
+            if baseline['calls'] and action != 'miss':
+                self.seconds_saved += baseline['latency'] - (latency or 0.0)
+
+    def clear(self):
+        """Remove every indexed bill"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('DELETE FROM similar_bills')
+        conn.commit()
+        conn.close()
+        self.load()
+
+    def get_stats(self):
+        """Hit rate, time saved and index size"""
+        with self._lock:
+            lookups = self.lookups
+            hits = self.outcomes['reuse'] + self.outcomes['example']
+            return {
+                'entries': self._count,
+                'max_entries': self.max_entries,
+                'lookups': lookups,
+                'reused': self.outcomes['reuse'],
+                'examples': self.outcomes['example'],
+                'misses': self.outcomes['miss'],
+                'reuse_rate': self.outcomes['reuse'] / lookups if lookups else 0.0,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'avg_lookup_ms': round(self.lookup_seconds / lookups * 1000, 3) if lookups else 0.0,
+                'avg_full_latency_seconds': round(self.call_stats['miss']['latency'], 3),
+                'avg_example_latency_seconds': round(self.call_stats['example']['latency'], 3),
+                'avg_full_tokens_in': round(self.call_stats['miss']['tokens_in']),
+                'avg_example_tokens_in': round(self.call_stats['example']['tokens_in']),
+                'seconds_saved': round(self.seconds_saved, 3),
+                'reuse_threshold': self.reuse_threshold,
+                'example_threshold': self.example_threshold
+            }
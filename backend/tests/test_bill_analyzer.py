@@ -0,0 +1,70 @@
+from analysis_cache import AnalysisCache
+from bill_analyzer import ElectricityBillAnalyzer
+from llm_backends import ModelRouter, create_backend
+from similarity_index import SimilarityIndex
+
+BILL_TEXT = ('Electricity bill for April 2024. Billing Period: 01-04-2024 to 30-04-2024. '
+             'Units consumed: 300 kWh. Rate: Rs 6.50 per unit. Total amount: Rs 1,950.00')
+
+def make_analyzer(tmp_path, api_key='key', **options):
+    return ElectricityBillAnalyzer(api_key, backend=create_backend('mock'),
+                                   cache=AnalysisCache(str(tmp_path / 'cache.db')), **options)
+
+def final_analysis(events):
+    events = list(events)
+    assert events[-1]['event'] == 'complete'
+    return events[-1]['analysis']
+
+def test_stream_cache_hit_reports_no_usage(tmp_path):
+    analyzer = make_analyzer(tmp_path)
+    first = final_analysis(analyzer.analyze_bill_stream(BILL_TEXT))
+    assert first['usage']['tokens_in'] > 0
+
+    usage = final_analysis(analyzer.analyze_bill_stream(BILL_TEXT))['usage']
+    assert usage['cached'] is True
+    assert usage['tokens_in'] == 0
+    assert usage['tokens_out'] == 0
+
+def test_cache_hit_reports_no_usage(tmp_path):
+    analyzer = make_analyzer(tmp_path)
+    analyzer.analyze_bill(BILL_TEXT)
+    usage = analyzer.analyze_bill(BILL_TEXT)['usage']
+    assert usage['cached'] is True
+    assert (usage['tokens_in'], usage['tokens_out'], usage['latency_seconds']) == (0, 0, 0.0)
+
+def test_similar_bills_stay_within_api_key_and_account(tmp_path):
+    similar = SimilarityIndex(str(tmp_path / 'similar.db'))
+    first = make_analyzer(tmp_path, similar=similar)
+    first.cache = None
+    first.analyze_bill(BILL_TEXT, account_id='A1')
+    assert first.analyze_bill(BILL_TEXT, account_id='A1')['analysis_source'] == 'similar'
+
+    other_account = first.analyze_bill(BILL_TEXT, account_id='A2')
+    assert other_account.get('analysis_source') != 'similar'
+    assert 'similar_to' not in other_account
+
+    other_key = make_analyzer(tmp_path, api_key='other-key', similar=similar)
+    other_key.cache = None
+    analysis = other_key.analyze_bill(BILL_TEXT, account_id='A1')
+    assert analysis.get('analysis_source') != 'similar'
+    assert 'similar_to' not in analysis
+
+def test_stream_uses_the_router_model(tmp_path):
+    router = ModelRouter('gpt-4o-mini', 'gpt-4')
+    analyzer = make_analyzer(tmp_path, router=router)
+    assert final_analysis(analyzer.analyze_bill_stream(BILL_TEXT))['usage']['model'] == 'gpt-4o-mini'
+
+def test_stream_escalates_invalid_fast_replies(tmp_path):
+    router = ModelRouter('gpt-4o-mini', 'gpt-4')
+    analyzer = make_analyzer(tmp_path, router=router)
+    analyzer.backend = create_backend('mock', invalid_share={'gpt-4o-mini': 1.0})
+    usage = final_analysis(analyzer.analyze_bill_stream(BILL_TEXT))['usage']
+    assert usage['model'] == 'gpt-4'
+    assert usage['escalated_from']['model'] == 'gpt-4o-mini'
+
+def test_stream_reuses_similar_bills(tmp_path):
+    analyzer = make_analyzer(tmp_path, similar=SimilarityIndex(str(tmp_path / 'similar.db')))
+    analyzer.cache = None
+    analyzer.analyze_bill(BILL_TEXT, account_id='A1')
+    analysis = final_analysis(analyzer.analyze_bill_stream(BILL_TEXT, account_id='A1'))
+    assert analysis['analysis_source'] == 'similar'
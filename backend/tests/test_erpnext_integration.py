@@ -0,0 +1,17 @@
+from erpnext_integration import ERPNextIntegration
+
+def make_client():
+    return ERPNextIntegration('http://erpnext.invalid', 'key', 'secret')
+
+def test_insight_amount_with_thousands_separator():
+    analysis = {'bill_summary': {'total_amount': '₹1,234.50'}}
+    assert make_client().build_bill_insight(1, analysis)['total_amount'] == 1234.5
+
+def test_insight_amount_prefers_parsed_figures():
+    analysis = {'bill_summary': {'total_amount': 'Rs. 1,234'}, 'figures': {'total_amount': 1234.0}}
+    assert make_client().build_bill_insight(1, analysis)['total_amount'] == 1234.0
+
+def test_insight_amount_accepts_numbers_and_missing_values():
+    client = make_client()
+    assert client.build_bill_insight(1, {'bill_summary': {'total_amount': 120.5}})['total_amount'] == 120.5
+    assert client.build_bill_insight(1, {'bill_summary': {}})['total_amount'] == 0.0
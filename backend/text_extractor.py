@@ -0,0 +1,259 @@
+import calendar
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from datetime import date
+
+from instrumentation import metrics
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import pdfplumber
+except ImportError:
+    pdfplumber = None
+
+FILE_TYPES = {'.pdf': 'pdf', '.xlsx': 'xlsx', '.xlsm': 'xlsx', '.txt': 'txt', '.csv': 'txt'}
+# Bump whenever extraction output changes so cached text is not reused
+EXTRACTOR_VERSION = '1'
+# A sheet whose header row has Year, Month and one of these is a bill history,
+# one bill per row (Assets/E-Bill.xlsx)
+HISTORY_AMOUNT_HEADERS = ('amount', 'bill amount', 'net amount', 'amount payable', 'total amount')
+
+def file_type_for(name, default='pdf'):
+    """pdf / xlsx / txt from a file name or URL; default when the extension is unknown"""
+    return FILE_TYPES.get(os.path.splitext((name or '').split('?', 1)[0])[1].lower(), default)
+
+class ExtractionError(ValueError):
+    """The file could not be read as its file type (corrupt, encrypted, not a PDF)"""
+
+def require(module, name):
+    if module is None:
+        raise RuntimeError(f'{name} is not installed')
+
+def pdf_page_count(data):
+    require(pdfplumber, 'pdfplumber')
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        return len(pdf.pages)
+
+def extract_pdf_pages(data, first, last):
+    """Text of pages first..last-1; runs in a worker process"""
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        return [pdf.pages[number].extract_text() or '' for number in range(first, last)]
+
+def extract_xlsx_sheets(data):
+    """One ' | '-joined block of rows per worksheet"""
+    require(openpyxl, 'openpyxl')
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        sheets = []
+        for sheet in workbook.worksheets:
+            lines = []
+            for row in sheet.iter_rows(values_only=True):
+                cells = [str(cell) for cell in row if cell is not None]
+                if cells:
+                    lines.append(' | '.join(cells))
+            sheets.append('\n'.join(lines))
+        return sheets
+    finally:
+        workbook.close()
+
+def month_name(value):
+    """'April' for 'April', 'apr', 4 or a date; None for anything else"""
+    if isinstance(value, date):
+        return calendar.month_name[value.month]
+    if isinstance(value, (int, float)):
+        return calendar.month_name[int(value)] if 1 <= value <= 12 else None
+    text = str(value).strip().lower()
+    for number in range(1, 13):
+        if text in (calendar.month_name[number].lower(), calendar.month_abbr[number].lower()):
+            return calendar.month_name[number]
+    return None
+
+def format_cell(value):
+    if isinstance(value, date):
+        return value.strftime('%d-%m-%Y')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def extract_xlsx_bills(data):
+    """One bill per row of every bill-history sheet in a workbook.
+
+    Returns [{'sheet', 'row', 'billing_period', 'text'}], the text holding a
+    'Billing Period: April 2020' line and the row's other columns as
+    'Header: value' lines. Empty when no sheet is a history table, i.e. the
+    workbook is a single bill to be read as a whole.
+    """
+    require(openpyxl, 'openpyxl')
+    try:
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    except Exception as e:
+        raise ExtractionError(f'not a readable XLSX workbook: {e}') from e
+    try:
+        bills = []
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            # The table ends at the first blank header cell; summary tables
+            # (totals, per-year averages) often sit to its right
+            columns = []
+            for cell in next(rows, None) or ():
+                if cell is None or not str(cell).strip():
+                    break
+                columns.append(str(cell).strip())
+            lowered = [column.lower() for column in columns]
+            amount_at = next((i for i, column in enumerate(lowered) if column in HISTORY_AMOUNT_HEADERS), None)
+            if 'year' not in lowered or 'month' not in lowered or amount_at is None:
+                continue
+            year_at, month_at = lowered.index('year'), lowered.index('month')
+
+            for number, row in enumerate(rows, 2):
+                cells = (list(row) + [None] * len(columns))[:len(columns)]
+                month = month_name(cells[month_at]) if cells[month_at] is not None else None
+                if month is None or cells[year_at] is None or cells[amount_at] is None:
+                    continue
+                try:
+                    period = f'{month} {int(float(cells[year_at]))}'
+                except ValueError:
+                    continue
+                lines = [f'Electricity bill for {period}', f'Billing Period: {period}']
+                lines += [f'{column}: {format_cell(value)}' for index, (column, value) in enumerate(zip(columns, cells))
+                          if index not in (year_at, month_at) and value is not None]
+                bills.append({'sheet': sheet.title, 'row': number, 'billing_period': period,
+                              'text': '\n'.join(lines)})
+        return bills
+    finally:
+        workbook.close()
+
+class TextExtractor:
+    """Extract bill text locally instead of a PDF.co round trip.
+
+    PDFs are split into page ranges that run in parallel on a process pool
+    (pdfplumber is pure Python, so threads would not help); spreadsheets
+    yield one page per worksheet and text files are decoded as they are.
+    Results are cached by the SHA-256 of the file bytes, so re-uploads and
+    retries skip extraction entirely.
+    """
+
+    FILE_TYPES = ('pdf', 'xlsx', 'txt')
+
+    def __init__(self, workers=None, pages_per_task=4, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.cache = cache
+        self._pool = None
+        self._lock = threading.Lock()
+        self.files = 0
+        self.pages = 0
+        self.seconds = 0.0
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Not fork: the pool starts lazily inside threaded servers, and a
+                # forked child would inherit their SQLite connections, HTTP
+                # sessions and any lock another thread held at that moment
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(method))
+            return self._pool
+
+    def make_key(self, data, file_type):
+        digest = hashlib.sha256(data).hexdigest()
+        return f'{EXTRACTOR_VERSION}:{file_type}:{digest}'
+
+    def page_ranges(self, page_count):
+        """Ranges of pages_per_task pages, widened so there are at most two per worker"""
+        size = max(self.pages_per_task, -(-page_count // (self.workers * 2)))
+        return [(first, min(first + size, page_count)) for first in range(0, page_count, size)]
+
+    def iter_pages(self, data, file_type):
+        """Yield (page number, text) in page order, each as soon as its range is done"""
+        if file_type not in self.FILE_TYPES:
+            raise ValueError(f"file_type must be one of {', '.join(self.FILE_TYPES)}")
+
+        cache_key = self.make_key(data, file_type) if self.cache is not None else None
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield from enumerate(cached['pages'])
+                return
+
+        started = time.perf_counter()
+        pages = []
+        if file_type == 'pdf':
+            require(pdfplumber, 'pdfplumber')
+            try:
+                page_count = pdf_page_count(data)
+            except Exception as e:
+                raise ExtractionError(f'not a readable PDF: {e}') from e
+            ranges = self.page_ranges(page_count)
+            futures = [self.pool.submit(extract_pdf_pages, data, first, last) for first, last in ranges]
+            try:
+                for future in futures:
+                    for text in self.result(future, 'PDF'):
+                        yield len(pages), text
+                        pages.append(text)
+            finally:
+                # A consumer that stops early should not leave the pool busy
+                for future in futures:
+                    future.cancel()
+        else:
+            if file_type == 'xlsx':
+                require(openpyxl, 'openpyxl')
+                texts = self.result(self.pool.submit(extract_xlsx_sheets, data), 'XLSX workbook')
+            else:
+                texts = [data.decode('utf-8', errors='replace')]
+            for text in texts:
+                yield len(pages), text
+                pages.append(text)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.files += 1
+            self.pages += len(pages)
+            self.seconds += elapsed
+        metrics.observe('operation_duration_seconds', elapsed, operation='extract_text', file_type=file_type)
+        metrics.inc('extracted_pages_total', len(pages), file_type=file_type)
+        if cache_key is not None:
+            self.cache.set(cache_key, {'pages': pages})
+
+    @staticmethod
+    def result(future, kind):
+        """A worker's result, with errors reading the file raised as ExtractionError"""
+        try:
+            return future.result()
+        except BrokenExecutor:
+            raise
+        except Exception as e:
+            raise ExtractionError(f'not a readable {kind}: {e}') from e
+
+    def extract(self, data, file_type):
+        """Whole text of a file, pages separated by blank lines"""
+        return '\n\n'.join(text for _, text in self.iter_pages(data, file_type))
+
+    def get_stats(self):
+        with self._lock:
+            stats = {
+                'workers': self.workers,
+                'files': self.files,
+                'pages': self.pages,
+                'seconds': round(self.seconds, 3),
+                'pages_per_second': round(self.pages / self.seconds, 1) if self.seconds else None
+            }
+        stats['cache'] = self.cache.get_stats() if self.cache is not None else None
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None